@@ -1,75 +1,240 @@
 import os
+import re
+import gzip
 import shutil
-import time
+import sqlite3
+import tempfile
+import threading
 from datetime import datetime
-from PyQt5.QtCore import QTimer, QObject
+from PyQt5.QtCore import QTimer, QObject, pyqtSignal
+from metrics import timed
+
+# 新备份: 20250509_213000_db.bak.gz，同一秒内的第二份起为20250509_213000-2_db.bak.gz；
+# 旧版备份: 20250509_db.bak
+BACKUP_PATTERN = re.compile(r'^((\d{8})(?:_(\d{6})(?:-(\d+))?)?)_db\.bak(\.gz)?$')
+
 
 class BackupManager(QObject):
-    def __init__(self, db_manager):
+    # 后台备份完成: 是否成功, 备份文件路径或错误信息
+    backup_finished = pyqtSignal(bool, str)
+
+    def __init__(self, db_manager, keep_daily=7, keep_weekly=4, pages_per_step=1024):
         super().__init__()
         self.db_manager = db_manager
         self.backup_folder = 'database'
+        self.keep_daily = keep_daily  # 保留最近几天的每日快照
+        self.keep_weekly = keep_weekly  # 保留最近几周的每周快照
+        self.pages_per_step = pages_per_step  # 每批复制的页数，批次之间让出写锁
         self.timer = QTimer()
         self.timer.timeout.connect(self.create_backup)
-
-    def start_backup_timer(self):
-        """启动定时备份 - 每24小时备份一次"""
-        # 设置为24小时
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start_backup_timer(self, initial_delay=60):
+        """启动定时备份 - 每24小时备份一次
+
+        启动时不立即备份，以免与界面加载争抢磁盘：最近一次备份还不满24小时时
+        等到满24小时再备份，否则在initial_delay秒后于后台备份。
+        """
+        interval = 24 * 60 * 60
+        delay = initial_delay
+        backups = self.list_backups()
+        if backups:
+            age = (datetime.now() - backups[0][0]).total_seconds()
+            delay = max(delay, interval - age)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self._start_periodic)
+        self.timer.start(int(min(delay, interval) * 1000))
+        print(f"首次备份将在{int(min(delay, interval))}秒后进行")
+
+    def _start_periodic(self):
+        """首次备份之后改为每24小时一次"""
+        self.timer.timeout.disconnect(self._start_periodic)
+        self.timer.setSingleShot(False)
         self.timer.start(24 * 60 * 60 * 1000)
-        # 立即执行一次备份
-        self.create_backup()
-
-    def create_backup(self):
-        """创建数据库和Excel的备份"""
-        current_date = datetime.now().strftime('%Y%m%d')
-
-        # 备份SQLite数据库
-        db_source = self.db_manager.db_path
-        db_backup = os.path.join(self.backup_folder, f"{current_date}_db.bak")
 
-        # 备份Excel文件
-        excel_source = self.db_manager.excel_path
-        excel_backup = os.path.join(self.backup_folder, f"{current_date}_excel.bak")
+    def create_backup(self, background=True):
+        """创建数据库快照；默认在后台线程执行，不阻塞界面"""
+        if not background:
+            return self.backup_now() is not None
 
+        if self._thread is not None and self._thread.is_alive():
+            print("上一次备份尚未完成，跳过本次备份")
+            return False
+        self._thread = threading.Thread(target=self.backup_now, name='backup', daemon=True)
+        self._thread.start()
+        return True
+
+    @timed('backup.backup_now')
+    def backup_now(self):
+        """在当前线程完成一次备份，返回备份文件路径，失败返回None"""
+        with self._lock:
+            backup_path = self._new_backup_path(datetime.now().strftime('%Y%m%d_%H%M%S'))
+            snapshot = None
+            try:
+                snapshot = self._snapshot()
+                self._verify(snapshot)
+                self._compress(snapshot, backup_path)
+                self.apply_retention()
+            except Exception as e:
+                message = f"备份失败: {str(e)}"
+                print(message)
+                self.backup_finished.emit(False, message)
+                return None
+            finally:
+                if snapshot and os.path.exists(snapshot):
+                    os.remove(snapshot)
+
+            print(f"备份已创建: {backup_path}")
+            self.backup_finished.emit(True, backup_path)
+            return backup_path
+
+    def _new_backup_path(self, stamp):
+        """同一秒内重复备份时接着已有的最大序号编号，不覆盖已有备份，也不排到它们前面"""
+        count = 0
+        for filename in os.listdir(self.backup_folder):
+            match = BACKUP_PATTERN.match(filename)
+            if match and match.group(2) + '_' + (match.group(3) or '') == stamp:
+                count = max(count, int(match.group(4) or 1))
+        name = f"{stamp}-{count + 1}" if count else stamp
+        return os.path.join(self.backup_folder, f"{name}_db.bak.gz")
+
+    def _snapshot(self):
+        """用SQLite在线备份接口分批复制，得到一致的快照"""
+        fd, snapshot = tempfile.mkstemp(prefix='.snapshot-', suffix='.db', dir=self.backup_folder)
+        os.close(fd)
+        source = sqlite3.connect(self.db_manager.db_path)
+        target = sqlite3.connect(snapshot)
         try:
-            # 确保数据库是最新的
-            self.db_manager.sync_db_to_excel()
-
-            # 复制文件
-            if os.path.exists(db_source):
-                shutil.copy2(db_source, db_backup)
-
-            if os.path.exists(excel_source):
-                shutil.copy2(excel_source, excel_backup)
-
-            print(f"备份已创建: {db_backup} 和 {excel_backup}")
-            return True
-
-        except Exception as e:
-            print(f"备份失败: {str(e)}")
+            source.backup(target, pages=self.pages_per_step, sleep=0.005)
+        finally:
+            target.close()
+            source.close()
+        return snapshot
+
+    @staticmethod
+    def _verify(path):
+        """完整性检查，损坏的快照不会被保存或恢复"""
+        conn = sqlite3.connect(path)
+        try:
+            result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        finally:
+            conn.close()
+        if result != 'ok':
+            raise sqlite3.DatabaseError(f"完整性检查未通过: {result}")
+
+    @staticmethod
+    def _compress(source, target):
+        """gzip压缩后改名，避免留下写了一半的备份"""
+        tmp_path = target + '.tmp'
+        try:
+            with open(source, 'rb') as src, gzip.open(tmp_path, 'wb', compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def list_backups(self):
+        """按时间从新到旧列出备份: [(时间, 名称, 路径)]"""
+        backups = []
+        for filename in os.listdir(self.backup_folder):
+            match = BACKUP_PATTERN.match(filename)
+            if not match:
+                continue
+            name, day, clock, count = match.group(1, 2, 3, 4)
+            taken_at = datetime.strptime(day + (clock or '000000'), '%Y%m%d%H%M%S')
+            backups.append((taken_at, int(count or 1), name,
+                            os.path.join(self.backup_folder, filename)))
+        backups.sort(reverse=True)
+        return [(taken_at, name, path) for taken_at, count, name, path in backups]
+
+    def apply_retention(self):
+        """保留策略：每天最新一份保留keep_daily天，每周最新一份保留keep_weekly周"""
+        keep = set()
+        days, weeks = [], []
+        for taken_at, name, path in self.list_backups():
+            if not path.endswith('.gz'):
+                continue  # 旧版备份由用户自行处理
+            day = taken_at.date()
+            week = taken_at.isocalendar()[:2]
+            if day not in days and len(days) < self.keep_daily:
+                days.append(day)
+                keep.add(path)
+            if week not in weeks and len(weeks) < self.keep_weekly:
+                weeks.append(week)
+                keep.add(path)
+
+        for taken_at, name, path in self.list_backups():
+            if path.endswith('.gz') and path not in keep:
+                os.remove(path)
+
+    def wait(self):
+        """等待正在进行的后台备份结束"""
+        if self._thread is not None:
+            self._thread.join()
+
+    def shutdown(self):
+        """停止定时器并等待后台备份结束"""
+        self.timer.stop()
+        self.wait()
+
+    @timed('backup.restore_backup')
+    def restore_backup(self, backup_name):
+        """从备份恢复数据，backup_name为备份名称(如20250509、20250509_213000或20250509_213000-2)"""
+        matches = [path for taken_at, name, path in self.list_backups() if name == backup_name]
+        if not matches:
+            print(f"恢复失败: 找不到 {backup_name} 的备份")
             return False
 
-    def restore_backup(self, backup_date):
-        """从备份恢复数据"""
-        db_backup = os.path.join(self.backup_folder, f"{backup_date}_db.bak")
-        excel_backup = os.path.join(self.backup_folder, f"{backup_date}_excel.bak")
-
+        backup_path = matches[0]
+        restored = None
         try:
-            # 恢复SQLite数据库
-            if os.path.exists(db_backup):
-                shutil.copy2(db_backup, self.db_manager.db_path)
-
-            # 恢复Excel文件
-            if os.path.exists(excel_backup):
-                shutil.copy2(excel_backup, self.db_manager.excel_path)
-
-            # 刷新数据
-            self.db_manager.sync_excel_to_db()
-            self.db_manager.data_updated.emit()
+            # 先解压到临时文件并校验，确认无误后再替换正在使用的数据库
+            fd, restored = tempfile.mkstemp(prefix='.restore-', suffix='.db', dir=self.backup_folder)
+            os.close(fd)
+            opener = gzip.open if backup_path.endswith('.gz') else open
+            with opener(backup_path, 'rb') as src, open(restored, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            self._verify(restored)
+
+            # 恢复后仍是同一个分店：记下同步节点标识和进度，数据库损坏读不出时只能放弃
+            try:
+                identity = self.db_manager.replication_identity()
+            except sqlite3.Error as e:
+                identity = None
+                print(f"读取同步节点标识失败，恢复后将作为新的节点: {e}")
+
+            # 暂停Excel写入并独占数据库文件：替换期间后台写线程和读连接池都不会重新打开它
+            with self.db_manager.excel_mirror.paused(), self.db_manager.connections.exclusive():
+                for suffix in ('-wal', '-shm'):
+                    # 残留的WAL属于旧数据库，不能套用到恢复出的文件上
+                    if os.path.exists(self.db_manager.db_path + suffix):
+                        os.remove(self.db_manager.db_path + suffix)
+                os.replace(restored, self.db_manager.db_path)
+                restored = None
+                self.db_manager.invalidate_cache()
+
+                # 补齐旧版备份缺少的索引和查找列
+                self.db_manager.install_schema()
+                if identity is not None:
+                    self.db_manager.keep_replication_identity(identity)
+
+            # 按恢复后的数据重建Excel
+            self.db_manager.sync_db_to_excel()
+            if identity is not None and identity['peers']:
+                print("已保留本店的同步节点标识和进度。备份之后从其他分店导入的改动不在恢复的数据中，"
+                      "请各分店不指定 --peer 导出一次全部改动，再在本店导入")
+            self.db_manager.bulk_reloaded.emit('')
 
-            print(f"已从 {backup_date} 的备份恢复")
+            print(f"已从 {backup_name} 的备份恢复")
             return True
 
         except Exception as e:
             print(f"恢复失败: {str(e)}")
             return False
+
+        finally:
+            if restored and os.path.exists(restored):
+                os.remove(restored)
@@ -0,0 +1,364 @@
+import os
+import sys
+import csv
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+from datetime import datetime
+from PyQt5.QtCore import QCoreApplication
+from database_manager import DatabaseManager, MEMBERS_TABLE, DEFAULT_CARD_TYPES
+from backup_manager import BackupManager
+from lookup_keys import lookup_values
+
+RESULT_FORMAT = 1
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+_SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈姚卢姜崔钟谭陆汪范金石廖贾夏韦付方白邹孟熊秦邱江尹薛闫段雷侯龙史陶黎贺顾毛郝龚邵万钱严覃武戴莫孔向汤'
+_GIVEN = '伟芳娜秀英敏静丽强磊军洋勇艳杰娟涛明超秀兰霞平刚桂英华建国志红玉梅文斌宇浩凯鹏飞鑫宁欣怡子涵梓轩思雨佳琪晨阳博文雪婷嘉怡一诺紫萱雨泽俊杰天佑浩然雅静晓东春燕海燕金凤永强国华'
+_PHONE_PREFIXES = ['130', '131', '132', '133', '135', '136', '137', '138', '139', '150', '151', '152',
+                   '155', '156', '157', '158', '159', '166', '170', '176', '177', '180', '181', '182',
+                   '183', '185', '186', '187', '188', '189', '191', '198', '199']
+
+
+def generate_members(count, seed=0, exclude=()):
+    """生成count个合规的会员: [(姓名, 手机号, 剩余次数, 余额)]，同一seed结果相同
+
+    姓名为2-10个汉字，多数是常见的两三字名；手机号为11位且互不重复，不与exclude重复。
+    """
+    rng = random.Random(seed)
+    lengths = [2, 3, 4, 5, 10]
+    weights = [30, 60, 6, 3, 1]
+    exclude = set(exclude)
+    phones = set()
+    members = []
+    while len(members) < count:
+        phone = rng.choice(_PHONE_PREFIXES) + f"{rng.randrange(10 ** 8):08d}"
+        if phone in phones or phone in exclude:
+            continue
+        phones.add(phone)
+        length = rng.choices(lengths, weights)[0]
+        name = rng.choice(_SURNAMES) + ''.join(rng.choice(_GIVEN) for _ in range(length - 1))
+        # 次卡会员有剩余次数，储值会员有余额
+        if rng.random() < 0.7:
+            times, balance = rng.randint(0, 30), 0
+        else:
+            times, balance = 0, rng.randint(0, 2000)
+        members.append((name, phone, times, balance))
+    return members
+
+
+def seed_database(db, members, card_types):
+    """把会员轮流分到各卡种，在一个事务中直接写入数据库(不经过Excel)"""
+    with db.connections.transaction() as conn:
+        for i, code in enumerate(card_types):
+            conn.executemany(f"""
+            INSERT INTO {MEMBERS_TABLE}
+                (card_type, name, phone, remaining_times, balance, phone_rev, name_initials)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, ((code, *member, *lookup_values(member[0], member[1]))
+                  for member in members[i::len(card_types)]))
+    db.invalidate_cache()
+
+
+def measure(fn, runs, setup=None):
+    """执行runs次fn并计时，setup在每次之前执行且不计时，返回毫秒耗时统计"""
+    times = []
+    for _ in range(runs):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - started) * 1000)
+    return {'median_ms': round(statistics.median(times), 3), 'min_ms': round(min(times), 3),
+            'max_ms': round(max(times), 3), 'runs': runs}
+
+
+class Benchmark:
+    """在临时目录中生成合成会员数据，测量存储、搜索、Excel同步、备份和导入的耗时
+
+    每个规模使用独立的数据库，会员平均分到各卡种；Excel相关操作在超过excel_max_rows时跳过，
+    因为整表读写Excel在百万行时需要数分钟。
+    """
+
+    def __init__(self, runs=5, heavy_runs=3, excel_max_rows=200000, seed=0, keep=False):
+        self.runs = runs  # 轻量操作的重复次数
+        self.heavy_runs = heavy_runs  # 整表操作(Excel、备份、导入)的重复次数
+        self.excel_max_rows = excel_max_rows
+        self.seed = seed
+        self.keep = keep  # 保留临时目录便于检查
+        self.results = {}
+
+    def run(self, sizes):
+        for size in sizes:
+            print(f"\n== {size} 行 ==")
+            workdir = tempfile.mkdtemp(prefix=f'barbershop-bench-{size}-')
+            cwd = os.getcwd()
+            try:
+                os.chdir(workdir)
+                self.results[str(size)] = self._run_size(size)
+            finally:
+                os.chdir(cwd)
+                if self.keep:
+                    print(f"数据保留在 {workdir}")
+                else:
+                    shutil.rmtree(workdir, ignore_errors=True)
+        return self.report(sizes)
+
+    def report(self, sizes):
+        return {
+            'format': RESULT_FORMAT,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'machine': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'processor': platform.processor() or platform.machine()},
+            'sizes': list(sizes),
+            'settings': {'runs': self.runs, 'heavy_runs': self.heavy_runs,
+                         'excel_max_rows': self.excel_max_rows, 'seed': self.seed},
+            'results': self.results,
+        }
+
+    def _run_size(self, size):
+        os.makedirs('database', exist_ok=True)
+        results = {}
+        heavy = self.heavy_runs if size <= 10000 else 1
+        with_excel = size <= self.excel_max_rows
+        card_types = [code for code, _ in DEFAULT_CARD_TYPES]
+        members = generate_members(size, self.seed)
+        card_type = card_types[0]
+        own = members[0::len(card_types)]  # 第一种卡的会员
+        rng = random.Random(self.seed + 1)
+
+        def record(name, stats):
+            results[name] = stats
+            print(f"  {name:<28} 中位数 {stats['median_ms']:>10.2f} ms  (最快 {stats['min_ms']:.2f}, {stats['runs']}次)")
+
+        def skip(name, reason):
+            results[name] = {'skipped': reason}
+            print(f"  {name:<28} 跳过: {reason}")
+
+        started = time.perf_counter()
+        db = DatabaseManager(excel_flush_interval=3600)
+        seed_database(db, members, card_types)
+        print(f"  生成并写入数据 {time.perf_counter() - started:.1f}s")
+
+        try:
+            if with_excel:
+                record('sync_db_to_excel', measure(db.sync_db_to_excel, heavy))
+            else:
+                skip('sync_db_to_excel', f"超过 {self.excel_max_rows} 行")
+
+            record('get_all_members_cold', measure(lambda: db.get_all_members(card_type), heavy,
+                                                   setup=db.invalidate_cache))
+            record('get_all_members_warm', measure(lambda: db.get_all_members(card_type), self.runs))
+
+            samples = [rng.choice(own) for _ in range(self.runs)]
+            queries = {
+                'prefix': [name[:2] for name, *_ in samples],  # 姓名开头
+                'suffix': [phone[-4:] for _, phone, *_ in samples],  # 手机尾号
+                'substring': [phone[3:8] for _, phone, *_ in samples],  # 手机号中间一段
+            }
+            for kind, texts in queries.items():
+                for state in ('cold', 'warm'):
+                    pending = iter(texts)
+                    setup = db.invalidate_cache if state == 'cold' else None
+                    if state == 'warm':
+                        db.get_member_columns(card_type)
+                    record(f'search_{kind}_{state}',
+                           measure(lambda: db.search_members(next(pending), card_type=card_type),
+                                   len(texts), setup=setup))
+
+            phones = iter(phone for _, phone, *_ in samples)
+            record('get_member_by_phone_cold', measure(
+                lambda: db.get_member_by_phone(next(phones), card_type), self.runs, setup=db.invalidate_cache))
+            phones = iter(phone for _, phone, *_ in samples)
+            record('get_member_by_phone_warm', measure(
+                lambda: db.get_member_by_phone(next(phones), card_type), self.runs))
+
+            self._measure_writes(db, card_type, members, with_excel, heavy, record, skip)
+
+            if with_excel:
+                def touch_excel():
+                    # 删除写入记录，使同步时完整读取并比对Excel
+                    if os.path.exists(db.excel_mirror.index_path):
+                        os.remove(db.excel_mirror.index_path)
+                record('sync_excel_to_db', measure(db.sync_excel_to_db, heavy, setup=touch_excel))
+            else:
+                skip('sync_excel_to_db', f"超过 {self.excel_max_rows} 行")
+
+            backups = BackupManager(db)
+            record('create_backup', measure(lambda: backups.create_backup(background=False), heavy,
+                                            setup=lambda: time.sleep(1.01)))  # 备份文件名精确到秒
+            if with_excel:
+                name = backups.list_backups()[0][1]
+                record('restore_backup', measure(lambda: backups.restore_backup(name), heavy))
+            else:
+                skip('restore_backup', f"超过 {self.excel_max_rows} 行(恢复会重建Excel)")
+
+            record('migrator_import', self._measure_import(members, card_types[-1], heavy))
+        finally:
+            db.close()
+        return results
+
+    def _measure_writes(self, db, card_type, members, with_excel, heavy, record, skip):
+        """逐条添加和修改会员，分别测量只写数据库和写完后同步Excel的耗时
+
+        同步Excel会重新读写整个工作簿，按整表操作的次数heavy重复
+        """
+        existing = {phone for _, phone, *_ in members}
+        fresh = iter(generate_members((self.runs + self.heavy_runs) * 2, self.seed + 2, exclude=existing))
+
+        def new_member():
+            name, phone, times, balance = next(fresh)
+            return {'name': name, 'phone': phone, 'remaining_times': times, 'balance': balance}
+
+        added = []
+
+        def add(sync):
+            def step():
+                member = new_member()
+                ok, message = db.add_member(member, card_type)
+                if not ok:
+                    raise RuntimeError(message)
+                added.append(member)
+                if sync:
+                    db.excel_mirror.flush()
+            return step
+
+        record('add_member', measure(add(False), self.runs, setup=db.excel_mirror.flush))
+        if with_excel:
+            record('add_member_excel', measure(add(True), heavy))
+        else:
+            skip('add_member_excel', f"超过 {self.excel_max_rows} 行")
+
+        targets = iter(added * 2)
+
+        def update(sync):
+            def step():
+                member = next(targets)
+                member = dict(member, remaining_times=(member['remaining_times'] + 1) % 100)
+                ok, message = db.update_member(member['phone'], member, card_type)
+                if not ok:
+                    raise RuntimeError(message)
+                if sync:
+                    db.excel_mirror.flush()
+            return step
+
+        record('update_member', measure(update(False), self.runs, setup=db.excel_mirror.flush))
+        if with_excel:
+            record('update_member_excel', measure(update(True), heavy))
+        else:
+            skip('update_member_excel', f"超过 {self.excel_max_rows} 行")
+        db.excel_mirror.flush()
+
+    def _measure_import(self, members, card_type, runs):
+        """用DataMigrator导入与现有会员等量的新会员CSV，每次导入不同的手机号"""
+        from database.migration import DataMigrator
+        existing = {phone for _, phone, *_ in members}
+        files = []
+        for i in range(runs):
+            batch = generate_members(len(members), self.seed + 10 + i, exclude=existing)
+            existing.update(phone for _, phone, *_ in batch)
+            path = os.path.join('database', f'import_{i}.csv')
+            with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+                writer = csv.writer(f)
+                writer.writerow(['name', 'phone', 'remaining_times', 'balance'])
+                writer.writerows(batch)
+            files.append(path)
+
+        migrator = DataMigrator(os.path.join('database', 'members.db'))
+        pending = iter(files)
+        return measure(lambda: migrator.import_file(next(pending), card_type), runs)
+
+
+# 参与基线比较的字段: 字段 -> 单位
+COMPARED_FIELDS = {'median_ms': 'ms', 'peak_rss_mb': 'MB'}
+
+
+def compare(current, baseline, tolerance=0.25, min_delta_ms=2.0, min_delta_mb=5.0):
+    """与基线比较中位数耗时和峰值内存，返回 (回退列表, 比较明细)
+
+    变差超过tolerance比例且绝对差超过min_delta_ms(内存为min_delta_mb)才算回退，
+    避免毫秒级操作的抖动误报。
+    """
+    min_delta = {'ms': min_delta_ms, 'MB': min_delta_mb}
+    regressions = []
+    rows = []
+    for size, ops in current['results'].items():
+        base_ops = baseline.get('results', {}).get(size, {})
+        for op, stats in ops.items():
+            base = base_ops.get(op) or {}
+            for field, unit in COMPARED_FIELDS.items():
+                if field not in stats or field not in base:
+                    continue
+                now, before = stats[field], base[field]
+                ratio = now / before if before else float('inf')
+                row = {'size': size, 'op': op, 'field': field, 'unit': unit,
+                       'baseline': before, 'current': now, 'ratio': round(ratio, 3)}
+                rows.append(row)
+                if ratio > 1 + tolerance and now - before > min_delta[unit]:
+                    regressions.append(row)
+    return regressions, rows
+
+
+def add_report_arguments(parser, output, baseline):
+    """结果输出和基线比较的公共参数"""
+    parser.add_argument('--output', default=output, help='结果JSON文件')
+    parser.add_argument('--baseline', default=baseline, help='基线JSON文件')
+    parser.add_argument('--save-baseline', action='store_true', help='把本次结果保存为基线')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='允许变慢的比例')
+    parser.add_argument('--min-delta-ms', type=float, default=2.0, help='低于该绝对差不算回退')
+
+
+def finish(current, args):
+    """写出结果并与基线比较，有回退时返回1"""
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(current, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写入 {args.output}")
+
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f"已保存为基线 {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"没有基线文件 {args.baseline}，可用 --save-baseline 保存本次结果")
+        return 0
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions, rows = compare(current, baseline, args.tolerance, args.min_delta_ms)
+    print(f"与基线 {args.baseline} ({baseline.get('created')}) 比较了{len(rows)}项")
+    if regressions:
+        print(f"性能回退 {len(regressions)} 项(比基线差{args.tolerance:.0%}以上):")
+        for row in regressions:
+            print(f"  {row['size']:>8} 行 {row['op']:<28} {row['baseline']:.2f} -> "
+                  f"{row['current']:.2f} {row['unit']} (x{row['ratio']:.2f})")
+        return 1
+    print("没有发现性能回退")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='用合成会员数据测量存储、搜索、Excel同步、备份和导入的性能')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='逗号分隔的会员总数，默认 1000,10000,100000,1000000')
+    parser.add_argument('--runs', type=int, default=5, help='轻量操作的重复次数')
+    parser.add_argument('--heavy-runs', type=int, default=3, help='整表操作在1万行及以下时的重复次数')
+    parser.add_argument('--excel-max-rows', type=int, default=200000, help='超过该行数时跳过Excel相关操作')
+    parser.add_argument('--seed', type=int, default=0)
+    add_report_arguments(parser, 'benchmark_results.json', 'benchmark_baseline.json')
+    parser.add_argument('--keep', action='store_true', help='保留生成的临时数据库')
+    args = parser.parse_args()
+
+    app = QCoreApplication.instance() or QCoreApplication(sys.argv[:1])
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    benchmark = Benchmark(args.runs, args.heavy_runs, args.excel_max_rows, args.seed, args.keep)
+    current = benchmark.run(sizes)
+    return finish(current, args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,50 +1,243 @@
 import os
-import pandas as pd
+import sys
+import time
+import argparse
 import sqlite3
+import openpyxl
+import pandas as pd
+from openpyxl.utils import column_index_from_string
+
+# 作为脚本在database目录中运行时，也能引用项目根目录下的模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ledger import Ledger
+from lookup_keys import pinyin_initials
+from validation import MEMBER_RULES
+
+MEMBER_COLUMNS = ['name', 'phone', 'remaining_times', 'balance']
+MEMBERS_TABLE = 'members'  # 所有卡种共用的会员表
+CONFLICT_POLICIES = ('skip', 'upsert')
+
 
 class DataMigrator:
-    def __init__(self):
+    """批量导入会员：分块读取Excel/CSV，向量化清洗，单事务executemany写入"""
+
+    def __init__(self, db_path='members.db', on_conflict='skip', chunk_size=20000):
+        if on_conflict not in CONFLICT_POLICIES:
+            raise ValueError(f"未知的冲突处理方式: {on_conflict}")
         self.old_excel_path = os.path.join('old_db.xlsx')
-        self.db_path = 'members.db'
+        self.db_path = db_path
+        self.on_conflict = on_conflict  # skip: 已存在的手机号跳过；upsert: 覆盖
+        self.chunk_size = chunk_size
 
     def migrate_haircut_card(self):
-        # Connect to the SQLite database
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        return self.import_file(self.old_excel_path, 'haircut_card', sheet_name='卡',
+                                usecols='B:D', columns=['name', 'phone', 'remaining_times'])
+
+    def migrate_wash_blow_card(self):
+        return self.import_file(self.old_excel_path, 'wash_blow_card', sheet_name='洗发卡',
+                                usecols='B:D', columns=['name', 'phone', 'remaining_times'])
+
+    def import_file(self, path, card_type, sheet_name=None, usecols=None, columns=None,
+                    on_conflict=None, reject_path=None):
+        """导入一个Excel或CSV文件到指定卡种，返回导入报告"""
+        on_conflict = on_conflict or self.on_conflict
+        started = time.perf_counter()
+        report = {'card_type': card_type, 'source': path, 'read': 0, 'inserted': 0, 'updated': 0,
+                  'skipped': 0, 'rejected': 0, 'reject_file': None, 'seconds': 0.0}
+        rejects = []
+
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
         try:
-            df = pd.read_excel(self.old_excel_path, sheet_name='卡', header=0, usecols='B:D')
-            df.columns = ['name', 'phone', 'remaining_times']
-            for _, row in df.iterrows():
-                cursor.execute('''
-                    INSERT INTO haircut_card (name, phone, remaining_times, balance)
-                    VALUES (?,?,?,0)
-                ''', (row['name'], str(row['phone']), row['remaining_times']))
-            conn.commit()
-        except Exception as e:
-            print(f'剪头卡迁移失败: {str(e)}')
+            table_columns = self._table_columns(conn, card_type)
+            existing = {row[0] for row in conn.execute(
+                f"SELECT phone FROM {MEMBERS_TABLE} WHERE card_type = ?", (card_type,))}
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 导入的是已有的会员资料，不是当天的充值，不记消费流水
+                with Ledger.suspended(conn):
+                    for chunk in self._read_chunks(path, sheet_name, usecols, columns):
+                        report['read'] += len(chunk)
+                        clean, rejected = normalize_frame(chunk)
+                        rejects.append(rejected)
+                        self._load_chunk(conn, card_type, table_columns, clean, existing,
+                                         on_conflict, report, rejects)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
         finally:
             conn.close()
 
-    def migrate_wash_blow_card(self):
-        # Connect to the SQLite database
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        rejected = pd.concat(rejects, ignore_index=True) if rejects else pd.DataFrame()
+        report['rejected'] = len(rejected) - report['skipped']
+        if len(rejected):
+            report['reject_file'] = reject_path or f"{os.path.splitext(path)[0]}_{card_type}_rejects.csv"
+            rejected.to_csv(report['reject_file'], index=False, encoding='utf-8-sig')
+        report['seconds'] = round(time.perf_counter() - started, 3)
+        return report
+
+    @staticmethod
+    def _table_columns(conn, card_type):
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({MEMBERS_TABLE})")]
+        if not columns:
+            raise sqlite3.OperationalError(f"数据表 {MEMBERS_TABLE} 不存在，请先运行主程序初始化数据库")
+        if not conn.execute("SELECT 1 FROM card_types WHERE code = ?", (card_type,)).fetchone():
+            raise ValueError(f"未登记的卡种: {card_type}")
+        return columns
+
+    def _load_chunk(self, conn, card_type, table_columns, clean, existing, on_conflict, report, rejects):
+        """把清洗后的一块数据写入数据库"""
+        if clean.empty:
+            return
+        conflict = clean['phone'].isin(existing)
+        if on_conflict == 'skip' and conflict.any():
+            skipped = clean[conflict].assign(reason='手机号已存在')
+            rejects.append(skipped)
+            report['skipped'] += len(skipped)
+            clean = clean[~conflict]
+        else:
+            report['updated'] += int(conflict.sum())
+        report['inserted'] += int((~conflict).sum()) if on_conflict == 'upsert' else len(clean)
+
+        clean = clean.assign(card_type=card_type)
+        columns = ['card_type'] + MEMBER_COLUMNS
+        if 'phone_rev' in table_columns:
+            # 主程序的尾号和拼音首字母查找列
+            initials = {name: pinyin_initials(name) for name in clean['name'].unique()}
+            clean = clean.assign(phone_rev=clean['phone'].str[::-1],
+                                 name_initials=clean['name'].map(initials))
+            columns += ['phone_rev', 'name_initials']
+
+        placeholders = ', '.join('?' * len(columns))
+        sql = f"INSERT INTO {MEMBERS_TABLE} ({', '.join(columns)}) VALUES ({placeholders})"
+        if on_conflict == 'upsert':
+            updates = ', '.join(f"{col} = excluded.{col}" for col in columns
+                                if col not in ('card_type', 'phone'))
+            sql += f" ON CONFLICT(card_type, phone) DO UPDATE SET {updates}"
+        rows = clean[columns].astype(object).itertuples(index=False, name=None)
+        conn.executemany(sql, rows)
+        existing.update(clean['phone'])
+
+    def _read_chunks(self, path, sheet_name, usecols, columns):
+        """按块读取源文件，每块带上源文件行号"""
+        if path.lower().endswith('.csv'):
+            reader = pd.read_csv(path, dtype=str, chunksize=self.chunk_size,
+                                 usecols=usecols, keep_default_na=False)
+            for chunk in reader:
+                chunk['source_row'] = chunk.index + 2  # 第1行是表头
+                yield self._rename(chunk, columns)
+        else:
+            yield from self._read_excel_chunks(path, sheet_name, usecols, columns)
+
+    def _read_excel_chunks(self, path, sheet_name, usecols, columns):
+        # 只读模式流式读取，内存占用与块大小相关而不是与文件大小相关
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
         try:
-            df = pd.read_excel(self.old_excel_path, sheet_name='洗发卡', header=0, usecols='B:D')
-            df.columns = ['name', 'phone', 'remaining_times']
-            for _, row in df.iterrows():
-                cursor.execute('''
-                    INSERT INTO wash_blow_card (name, phone, remaining_times, balance)
-                    VALUES (?,?,?,0)
-                ''', (row['name'], str(row['phone']), row['remaining_times']))
-            conn.commit()
-        except Exception as e:
-            print(f'洗头卡迁移失败: {str(e)}')
+            sheet = workbook[sheet_name] if sheet_name else workbook.worksheets[0]
+            min_col = max_col = None
+            if usecols:
+                first, _, last = usecols.partition(':')
+                min_col = column_index_from_string(first)
+                max_col = column_index_from_string(last or first)
+            rows = sheet.iter_rows(min_col=min_col, max_col=max_col, values_only=True)
+            header = [str(value) if value is not None else '' for value in next(rows, ())]
+
+            batch, start_row = [], 2
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= self.chunk_size:
+                    yield self._excel_frame(batch, header, start_row, columns)
+                    start_row += len(batch)
+                    batch = []
+            if batch:
+                yield self._excel_frame(batch, header, start_row, columns)
         finally:
-            conn.close()
+            workbook.close()
 
-if __name__ == '__main__':
-    migrator = DataMigrator()
-    migrator.migrate_haircut_card()
-    migrator.migrate_wash_blow_card()
+    def _excel_frame(self, batch, header, start_row, columns):
+        frame = pd.DataFrame(batch, columns=header[:len(batch[0])] if header else None)
+        frame['source_row'] = range(start_row, start_row + len(frame))
+        # 去掉只读模式下可能出现的空行
+        frame = frame[frame.drop(columns='source_row').notna().any(axis=1)]
+        return self._rename(frame, columns)
+
+    @staticmethod
+    def _rename(frame, columns):
+        """按位置把源列重命名为会员字段(source_row固定在最后一列)"""
+        if columns:
+            data_columns = list(frame.columns[:-1])
+            frame.columns = list(columns) + data_columns[len(columns):] + ['source_row']
+        return frame
+
+
+def normalize_frame(frame):
+    """向量化清洗一块数据，返回(合格数据, 被拒绝的行及原因)"""
+    frame = frame.copy()
+    if 'balance' not in frame.columns:
+        frame['balance'] = 0
+    missing = [col for col in MEMBER_COLUMNS if col not in frame.columns]
+    if missing:
+        raise ValueError(f"源文件缺少列: {', '.join(missing)}")
+
+    name = frame['name'].astype('string').str.strip()
+    # Excel中的手机号常被存成数字，去掉浮点尾巴和分隔符
+    phone = (frame['phone'].astype('string').str.strip()
+             .str.replace(r'\.0+$', '', regex=True)
+             .str.replace(r'[\s\-]', '', regex=True))
+    times = pd.to_numeric(frame['remaining_times'], errors='coerce')
+    balance = pd.to_numeric(frame['balance'].replace('', 0), errors='coerce').fillna(0)
+
+    normalized = pd.DataFrame({'name': name, 'phone': phone,
+                               'remaining_times': times, 'balance': balance})
+    reason = MEMBER_RULES.reasons(MEMBER_RULES.validate_frame(normalized))
+    duplicated = phone.duplicated(keep='first') & reason.isna()
+    reason = reason.mask(duplicated, '文件内手机号重复')
+
+    ok = reason.isna()
+    clean = pd.DataFrame({
+        'name': name[ok].astype(str),
+        'phone': phone[ok].astype(str),
+        'remaining_times': times[ok].astype('int64'),
+        'balance': balance[ok].astype('int64'),
+        'source_row': frame.loc[ok, 'source_row'],
+    })
+    rejected = frame.loc[~ok, ['source_row'] + MEMBER_COLUMNS].assign(reason=reason[~ok])
+    return clean, rejected
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量导入会员数据')
+    parser.add_argument('source', nargs='?', help='Excel或CSV文件；不指定时迁移old_db.xlsx')
+    parser.add_argument('--card-type', '--table', dest='card_type', default='haircut_card',
+                        help='目标卡种代码')
+    parser.add_argument('--sheet', help='Excel工作表名称')
+    parser.add_argument('--usecols', help='Excel列范围(如B:D)或CSV列名(逗号分隔)')
+    parser.add_argument('--columns', help='按位置对应的字段名，如 name,phone,remaining_times')
+    parser.add_argument('--db', default='members.db', help='SQLite数据库路径')
+    parser.add_argument('--on-conflict', choices=CONFLICT_POLICIES, default='skip')
+    parser.add_argument('--chunk-size', type=int, default=20000)
+    parser.add_argument('--rejects', help='拒绝报告输出路径')
+    args = parser.parse_args()
+
+    migrator = DataMigrator(args.db, args.on_conflict, args.chunk_size)
+    if args.source is None:
+        reports = [migrator.migrate_haircut_card(), migrator.migrate_wash_blow_card()]
+    else:
+        usecols = args.usecols
+        if usecols and args.source.lower().endswith('.csv'):
+            usecols = usecols.split(',')
+        columns = args.columns.split(',') if args.columns else None
+        reports = [migrator.import_file(args.source, args.card_type, args.sheet, usecols, columns,
+                                        reject_path=args.rejects)]
+
+    for report in reports:
+        print(f"{report['card_type']}: 读取{report['read']}行，新增{report['inserted']}，"
+              f"更新{report['updated']}，跳过{report['skipped']}，拒绝{report['rejected']}，"
+              f"耗时{report['seconds']}秒")
+        if report['reject_file']:
+            print(f"  拒绝明细: {report['reject_file']}")
     print('数据迁移完成')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,184 +1,539 @@
 import os
+import re
+import csv
+import json
 import sqlite3
-import pandas as pd
 from PyQt5.QtCore import QObject, pyqtSignal
+from db_connection import ConnectionManager
+from excel_mirror import ExcelMirror
+from ledger import Ledger
+from lookup_keys import lookup_values
+from member_cache import MemberCache
+from member_store import MemberColumns, PHONE_DIGITS
+from metrics import timed
+from replication import Replicator
+from search_index import SearchIndex
+from validation import MEMBER_RULES, MEMBER_COLUMN_TYPES
+
+MEMBER_COLUMNS = ['name', 'phone', 'remaining_times', 'balance']
+MEMBERS_TABLE = 'members'  # 所有卡种共用的会员表
+CARD_TYPES_TABLE = 'card_types'  # 卡种登记表
+DEFAULT_CARD_TYPES = [('haircut_card', '剪发卡'), ('wash_blow_card', '洗吹卡')]
+CARD_TYPE_PATTERN = r'[a-z][a-z0-9_]{0,30}'  # 卡种代码同时用作Excel工作表名
+SEARCH_LIMIT = 500  # 单次搜索最多返回的会员数
+SORT_COLUMNS = ['name', 'phone', 'remaining_times', 'balance']  # 列表可排序的列
+PAGE_SIZE = 200  # 分页列出会员时每页的行数
+SCHEMA_VERSION = 1  # PRAGMA user_version，低于此版本的数据库启动时先修复旧数据
 
 class DatabaseManager(QObject):
-    data_updated = pyqtSignal()
-
-    def __init__(self):
+    # 细粒度的变更通知，界面据此只修补受影响的行
+    member_added = pyqtSignal(str, dict)  # 卡种, 会员
+    member_updated = pyqtSignal(str, str, str, dict)  # 卡种, 原手机号, 新手机号, 会员
+    member_removed = pyqtSignal(str, str)  # 卡种, 手机号
+    card_type_switched = pyqtSignal(str)  # 新的当前卡种
+    card_types_changed = pyqtSignal()  # 登记了新的卡种
+    bulk_reloaded = pyqtSignal(str)  # 整体重新载入的卡种，空字符串表示全部
+    members_updated = pyqtSignal(str, list)  # 卡种, 批量修改后的会员列表
+
+    def __init__(self, excel_flush_interval=30.0):
         super().__init__()
         self.db_path = os.path.join('database', 'members.db')
         self.excel_path = os.path.join('database', 'members.xlsx')
-        self.current_table = 'haircut_card'  # 默认显示剪发卡
+        self.current_card_type = 'haircut_card'  # 默认显示剪发卡
+        self.card_types = []  # [(代码, 名称)]，按登记顺序
+        self.connections = ConnectionManager(self.db_path)
+        self.excel_mirror = ExcelMirror(self.connections, self.excel_path, MEMBERS_TABLE, [],
+                                        MEMBER_COLUMNS, flush_interval=excel_flush_interval)
+        self.search_index = SearchIndex(MEMBERS_TABLE, MEMBER_COLUMNS)
+        self.ledger = Ledger(MEMBERS_TABLE)
+        self.replication = Replicator(MEMBERS_TABLE)
+        self.cache = MemberCache()
         self.initialize_database()
+        self.excel_mirror.start()
 
-    def initialize_database(self):
-        """初始化数据库，创建所需表格"""
-        # 创建SQLite数据库
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        # 创建剪发卡表
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS haircut_card (
-            name TEXT CHECK(length(name) >= 2 AND length(name) <= 10),
-            phone TEXT CHECK(length(phone) = 11),
-            remaining_times INTEGER CHECK(remaining_times >= 0 AND remaining_times <= 99),
-            balance INTEGER CHECK(balance >= 0 AND balance <= 9999),
-            PRIMARY KEY (phone)
-        )
-        ''')
-
-        # 创建洗吹卡表
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS wash_blow_card (
-            name TEXT CHECK(length(name) >= 2 AND length(name) <= 10),
-            phone TEXT CHECK(length(phone) = 11),
-            remaining_times INTEGER CHECK(remaining_times >= 0 AND remaining_times <= 99),
-            balance INTEGER CHECK(balance >= 0 AND balance <= 9999),
-            PRIMARY KEY (phone)
-        )
-        ''')
+    def initialize_database(self, rewrite_excel=False):
+        """初始化数据库，创建所需表格，并迁移旧版按卡种分表的数据
 
-        conn.commit()
-        conn.close()
+        Excel仍是上次写入的内容且数据库此后没有变化时不重写，rewrite_excel为True时总是重写
+        """
+        self.install_schema()
 
         # 初始化Excel文件
-        self.sync_db_to_excel()
-
-    def sync_db_to_excel(self):
-        """将SQLite数据同步到Excel"""
-        conn = sqlite3.connect(self.db_path)
-
-        # 读取两个表的数据
-        haircut_df = pd.read_sql_query("SELECT * FROM haircut_card", conn)
-        wash_blow_df = pd.read_sql_query("SELECT * FROM wash_blow_card", conn)
-
-        # 创建Excel写入器
-        with pd.ExcelWriter(self.excel_path) as writer:
-            haircut_df.to_excel(writer, sheet_name='haircut_card', index=False)
-            wash_blow_df.to_excel(writer, sheet_name='wash_blow_card', index=False)
-
-        conn.close()
+        if rewrite_excel or not self.excel_mirror.up_to_date():
+            self.sync_db_to_excel()
 
-    def sync_excel_to_db(self):
-        """将Excel数据同步到SQLite"""
-        if not os.path.exists(self.excel_path):
+    def install_schema(self):
+        """建表、迁移旧数据并安装索引和触发器，再载入卡种；不涉及Excel"""
+        with self.connections.transaction() as conn:
+            self._create_tables(conn)
+            self._migrate_card_tables(conn)
+            self._repair_members(conn)
+            self.search_index.install(conn)
+            self.ledger.install(conn)
+            self.replication.install(conn)
+            self.excel_mirror.install(conn, (MEMBERS_TABLE, CARD_TYPES_TABLE))
+        self._load_card_types()
+
+    def _create_tables(self, conn):
+        """创建卡种登记表和会员表，CHECK约束由校验规则生成"""
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {CARD_TYPES_TABLE} (
+            code TEXT PRIMARY KEY,
+            label TEXT NOT NULL,
+            position INTEGER NOT NULL DEFAULT 0
+        )
+        """)
+        conn.executemany(
+            f"INSERT OR IGNORE INTO {CARD_TYPES_TABLE} (code, label, position) VALUES (?, ?, ?)",
+            [(code, label, position) for position, (code, label) in enumerate(DEFAULT_CARD_TYPES)])
+
+        columns = MEMBER_RULES.column_definitions(MEMBER_COLUMN_TYPES, ',\n            ')
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {MEMBERS_TABLE} (
+            card_type TEXT NOT NULL REFERENCES {CARD_TYPES_TABLE} (code),
+            {columns},
+            PRIMARY KEY (card_type, phone)
+        )
+        """)
+        # 覆盖索引：按手机号一次查出顾客持有的所有卡，不用回表
+        conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_{MEMBERS_TABLE}_phone
+        ON {MEMBERS_TABLE} (phone, card_type, name, remaining_times, balance)
+        """)
+        # 分页排序用的索引：按加入顺序(rowid)以及按各列排序，手机号用于打破并列
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{MEMBERS_TABLE}_card_type "
+                     f"ON {MEMBERS_TABLE} (card_type)")
+        for column in SORT_COLUMNS:
+            if column != 'phone':  # 按手机号排序直接使用主键
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{MEMBERS_TABLE}_{column}_sort "
+                             f"ON {MEMBERS_TABLE} (card_type, {column}, phone)")
+
+    def _migrate_card_tables(self, conn):
+        """把旧版的每卡种一张表(haircut_card等)并入会员表，随后删除旧表"""
+        legacy = [code for code, _ in self._fetch_card_types(conn)
+                  if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                  (code,)).fetchone()]
+        for code in legacy:
+            # 查找列由搜索索引安装时补齐；旧表的触发器随表一起删除
+            conn.execute(f"""
+            INSERT OR IGNORE INTO {MEMBERS_TABLE} (card_type, {', '.join(MEMBER_COLUMNS)})
+            SELECT ?, {', '.join(MEMBER_COLUMNS)} FROM {code} ORDER BY rowid
+            """, (code,))
+            conn.execute(f"DROP TABLE IF EXISTS {code}_fts")
+            conn.execute(f"DROP TABLE {code}")
+            print(f"已将旧表 {code} 的数据迁移到 {MEMBERS_TABLE}")
+
+    def _repair_members(self, conn):
+        """旧版表结构的CHECK约束放过空值：剩余次数和余额为空的补0；手机号不是11位数字的
+        会员原样保留(列存储按原文保存这些手机号)，只列在 members_rejects.csv 中供人工核对
+
+        只在版本号低于SCHEMA_VERSION时执行一次
+        """
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
             return
-
+        conn.execute(f"""
+        UPDATE {MEMBERS_TABLE} SET remaining_times = coalesce(remaining_times, 0),
+                                   balance = coalesce(balance, 0)
+        WHERE remaining_times IS NULL OR balance IS NULL
+        """)
+        rows = conn.execute(f"SELECT card_type, {', '.join(MEMBER_COLUMNS)} FROM {MEMBERS_TABLE} "
+                            f"WHERE coalesce(phone, '') NOT GLOB '{'[0-9]' * PHONE_DIGITS}'").fetchall()
+        if rows:
+            reject_path = os.path.join(os.path.dirname(self.db_path), 'members_rejects.csv')
+            exists = os.path.exists(reject_path)
+            with open(reject_path, 'a', newline='', encoding='utf-8-sig') as f:
+                writer = csv.writer(f)
+                if not exists:
+                    writer.writerow(['card_type'] + MEMBER_COLUMNS + ['reason'])
+                writer.writerows(list(row) + [MEMBER_RULES['phone'].message] for row in rows)
+            print(f"{len(rows)}位会员的手机号不是{PHONE_DIGITS}位数字，已保留在会员表中，"
+                  f"请核对 {reject_path} 后在程序中修改")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    @staticmethod
+    def _fetch_card_types(conn):
+        return conn.execute(
+            f"SELECT code, label FROM {CARD_TYPES_TABLE} ORDER BY position, rowid").fetchall()
+
+    def _load_card_types(self):
+        with self.connections.reader() as conn:
+            self.card_types = self._fetch_card_types(conn)
+        self.excel_mirror.sheets = [code for code, _ in self.card_types]
+
+    def get_card_types(self):
+        """已登记的卡种: [(代码, 名称)]"""
+        return list(self.card_types)
+
+    def card_type_label(self, code):
+        """卡种代码对应的显示名称"""
+        return dict(self.card_types).get(code, code)
+
+    def add_card_type(self, code, label):
+        """登记新卡种，之后即可在该卡种下添加会员，不需要建表"""
+        if not re.fullmatch(CARD_TYPE_PATTERN, code):
+            return False, "卡种代码只能由小写字母、数字和下划线组成，并以字母开头"
+        if not label.strip():
+            return False, "卡种名称不能为空"
         try:
-            # 读取Excel数据
-            haircut_df = pd.read_excel(self.excel_path, sheet_name='haircut_card')
-            wash_blow_df = pd.read_excel(self.excel_path, sheet_name='wash_blow_card')
+            with self.connections.transaction() as conn:
+                conn.execute(f"""
+                INSERT INTO {CARD_TYPES_TABLE} (code, label, position)
+                SELECT ?, ?, coalesce(max(position), -1) + 1 FROM {CARD_TYPES_TABLE}
+                """, (code, label.strip()))
+        except sqlite3.IntegrityError:
+            return False, "卡种已存在"
 
-            conn = sqlite3.connect(self.db_path)
+        self._load_card_types()
+        self.excel_mirror.mark_dirty()
+        self.card_types_changed.emit()
+        return True, "添加成功"
 
-            # 清空现有表格
-            conn.execute("DELETE FROM haircut_card")
-            conn.execute("DELETE FROM wash_blow_card")
+    @timed('db.sync_db_to_excel')
+    def sync_db_to_excel(self):
+        """将SQLite数据立即同步到Excel"""
+        return self.excel_mirror.flush(force=True)
 
-            # 写入新数据
-            haircut_df.to_sql('haircut_card', conn, if_exists='append', index=False)
-            wash_blow_df.to_sql('wash_blow_card', conn, if_exists='append', index=False)
+    @timed('db.sync_excel_to_db')
+    def sync_excel_to_db(self):
+        """把Excel中的改动按手机号合并到SQLite，返回变更摘要
 
-            conn.commit()
-            conn.close()
-        except Exception as e:
-            print(f"同步Excel到数据库出错: {e}")
-
-    def get_all_members(self):
-        """获取当前表的所有会员"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(f"SELECT * FROM {self.current_table}")
-        members = cursor.fetchall()
-        conn.close()
-        return members
-
-    def search_members(self, search_text):
-        """根据姓名或手机号搜索会员"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        # 使用模糊搜索
-        cursor.execute(f"""
-        SELECT * FROM {self.current_table}
-        WHERE name LIKE ? OR phone LIKE ?
-        """, (f'%{search_text}%', f'%{search_text}%'))
-
-        results = cursor.fetchall()
-        conn.close()
-        return results
-
-    def add_member(self, data):
-        """添加新会员"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        摘要格式: {'status', 'message', 'card_types': {卡种: {'inserted', 'updated',
+        'deleted', 'conflicts': 手机号列表, 'unchanged': 行数}}, 'rejected': [不合格行]}
+        status为 unchanged / merged / rejected / conflict / error 之一
+        """
+        summary = {'status': 'unchanged', 'message': '', 'card_types': {}, 'rejected': []}
+        if not os.path.exists(self.excel_path):
+            summary.update(status='error', message="Excel文件不存在")
+            return summary
+
+        events = {}
+        with self.excel_mirror.locked():
+            # 修改时间和内容哈希都没变，说明Excel仍是上次写入的样子
+            if self.excel_mirror.matches_written():
+                summary['message'] = "Excel没有新的改动"
+                return summary
+
+            full_pending, pending = self.excel_mirror.pending()
+            if full_pending:
+                summary.update(status='conflict',
+                               message="数据库有尚未写入Excel的批量改动，请稍后再同步")
+                print(summary['message'])
+                return summary
+
+            # pandas和openpyxl导入较慢，只在真正需要读取Excel时加载
+            import pandas as pd
+            from database.migration import normalize_frame
+            try:
+                # 缺少工作表的卡种不参与合并，以免被当成全部删除
+                with pd.ExcelFile(self.excel_path) as workbook:
+                    sheets = [code for code, _ in self.card_types if code in workbook.sheet_names]
+                    frames = pd.read_excel(workbook, sheet_name=sheets, dtype={'phone': str})
+                cleaned = {}
+                for card_type, df in frames.items():
+                    df['source_row'] = df.index + 2  # Excel行号：表头占第1行
+                    cleaned[card_type], rejected = normalize_frame(df)
+                    summary['rejected'] += [f"{card_type} 第{row}行: {reason}" for row, reason
+                                            in rejected[['source_row', 'reason']].itertuples(index=False)]
+                # 有不合格的行时一次性报告并放弃同步，避免把对应会员误判为已删除
+                if summary['rejected']:
+                    summary.update(status='rejected',
+                                   message=f"Excel中有{len(summary['rejected'])}行数据不合格，未同步到数据库")
+                    print(summary['message'] + ":\n" + '\n'.join(summary['rejected']))
+                    return summary
+
+                # 表格里的改动无法区分消费和更正，不记消费流水
+                with self.connections.transaction() as conn, self.ledger.suspended(conn):
+                    for card_type in sheets:
+                        summary['card_types'][card_type], events[card_type] = self._merge_card_type(
+                            conn, card_type, cleaned[card_type], pending.get(card_type, set()))
+
+                # 文件内容已与数据库一致(冲突行稍后由后台线程重写)
+                self.excel_mirror.adopt()
+            except Exception as e:
+                summary.update(status='error', message=f"同步Excel到数据库出错: {e}")
+                print(summary['message'])
+                return summary
+
+        summary['status'] = 'merged'
+        summary['message'] = '；'.join(
+            f"{self.card_type_label(card_type)}: 新增{len(changes['inserted'])}，"
+            f"更新{len(changes['updated'])}，删除{len(changes['deleted'])}，冲突{len(changes['conflicts'])}"
+            for card_type, changes in summary['card_types'].items())
+        print(f"Excel同步到数据库: {summary['message']}")
+        for card_type, (added, updated, removed) in events.items():
+            self._publish_merge(card_type, added, updated, removed)
+        return summary
+
+    def _merge_card_type(self, conn, card_type, clean, protected):
+        """对比Excel与数据库中的一种卡，只写入有差异的行
+
+        protected是尚未写入Excel的手机号，这些行以数据库为准
+        """
+        import pandas as pd
+        current = pd.read_sql_query(
+            f"SELECT {', '.join(MEMBER_COLUMNS)} FROM {MEMBERS_TABLE} WHERE card_type = ?",
+            conn, params=(card_type,))
+        merged = clean[MEMBER_COLUMNS].merge(current, on='phone', how='outer',
+                                             suffixes=('', '_db'), indicator=True)
+        conflict = merged['phone'].isin(protected)
+        present = merged['_merge'] == 'both'
+        differs = present & pd.concat([merged[col] != merged[f"{col}_db"]
+                                       for col in ('name', 'remaining_times', 'balance')],
+                                      axis=1).any(axis=1)
+
+        inserted = merged[(merged['_merge'] == 'left_only') & ~conflict]
+        updated = merged[differs & ~conflict]
+        deleted = merged[(merged['_merge'] == 'right_only') & ~conflict]
+        changed = merged['_merge'].ne('both') | differs
+
+        added = [self._merge_member(row) for row in inserted.itertuples(index=False)]
+        modified = [self._merge_member(row) for row in updated.itertuples(index=False)]
+        removed = list(deleted['phone'])
+        conn.executemany(f"""
+        INSERT INTO {MEMBERS_TABLE}
+            (card_type, name, phone, remaining_times, balance, phone_rev, name_initials)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [(card_type,) + self._member_tuple(m) + lookup_values(m['name'], m['phone'])
+              for m in added])
+        conn.executemany(f"""
+        UPDATE {MEMBERS_TABLE}
+        SET name = ?, remaining_times = ?, balance = ?, name_initials = ?
+        WHERE card_type = ? AND phone = ?
+        """, [(m['name'], m['remaining_times'], m['balance'],
+               lookup_values(m['name'], m['phone'])[1], card_type, m['phone']) for m in modified])
+        conn.executemany(f"DELETE FROM {MEMBERS_TABLE} WHERE card_type = ? AND phone = ?",
+                         [(card_type, phone) for phone in removed])
+
+        changes = {
+            'inserted': [m['phone'] for m in added],
+            'updated': [m['phone'] for m in modified],
+            'deleted': removed,
+            'conflicts': list(merged.loc[conflict & changed, 'phone']),
+            'unchanged': int((present & ~differs).sum()),
+        }
+        return changes, (added, modified, removed)
+
+    @staticmethod
+    def _merge_member(row):
+        return {'name': row.name, 'phone': row.phone,
+                'remaining_times': int(row.remaining_times), 'balance': int(row.balance)}
+
+    def _publish_merge(self, card_type, added, updated, removed, batch_limit=100):
+        """合并后同步缓存并通知界面；改动较多时整个卡种重新载入"""
+        if len(added) + len(updated) + len(removed) > batch_limit:
+            self.invalidate_cache(card_type)
+            self.bulk_reloaded.emit(card_type)
+            return
+        for member in added:
+            self.cache.put(card_type, self._member_tuple(member))
+            self.member_added.emit(card_type, member)
+        for member in updated:
+            self.cache.put(card_type, self._member_tuple(member))
+            self.member_updated.emit(card_type, member['phone'], member['phone'], member)
+        for phone in removed:
+            self.cache.remove(card_type, phone)
+            self.member_removed.emit(card_type, phone)
+
+    @timed('db.get_all_members')
+    def get_all_members(self, card_type=None):
+        """获取当前卡种(或指定卡种)的所有会员，按加入顺序排列"""
+        card_type = card_type or self.current_card_type
+        members = self.cache.all(card_type)
+        if members is not None:
+            return members
+        return self._load_columns(card_type).rows()
+
+    @timed('db.get_member_columns')
+    def get_member_columns(self, card_type=None):
+        """整个卡种的列存储(MemberColumns)，按加入顺序排列，适合大表上的向量化过滤和排序"""
+        card_type = card_type or self.current_card_type
+        columns = self.cache.columns(card_type)
+        if columns is not None:
+            return columns
+        return self._load_columns(card_type)
+
+    def _load_columns(self, card_type, chunk_size=50000):
+        """未命中时整个卡种分块读入列存储并放入缓存，之后的列表和单条查询都走内存"""
+        version = self.cache.version(card_type)
+        columns = MemberColumns()
+        with self.connections.reader() as conn:
+            cursor = conn.execute(f"""
+            SELECT {', '.join(MEMBER_COLUMNS)} FROM {MEMBERS_TABLE}
+            WHERE card_type = ? ORDER BY rowid
+            """, (card_type,))
+            # 分块读取，不在内存中同时保留整表的元组
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                columns.extend(rows)
+        self.cache.load(card_type, columns.take(range(len(columns))), version)
+        return columns
+
+    @timed('db.list_members')
+    def list_members(self, card_type=None, sort=None, descending=False,
+                     page_size=PAGE_SIZE, after=None):
+        """分页列出会员，返回(本页会员, 下一页游标)，游标为None表示没有更多
+
+        sort为排序列(SORT_COLUMNS之一)，None表示按加入顺序；after传入上一页返回的游标。
+        按游标在索引上定位，翻到第几页耗时都一样。
+        """
+        card_type = card_type or self.current_card_type
+        if sort is None:
+            keys = ['rowid']
+        elif sort == 'phone':
+            keys = ['phone']
+        elif sort in SORT_COLUMNS:
+            keys = [sort, 'phone']
+        else:
+            raise ValueError(f"不支持的排序列: {sort}")
+
+        direction = 'DESC' if descending else 'ASC'
+        conditions, params = ['card_type = ?'], [card_type]
+        if after is not None:
+            conditions.append(f"({', '.join(keys)}) {'<' if descending else '>'} "
+                              f"({', '.join('?' * len(keys))})")
+            params += list(after)
+        # 多取一行用来判断是否还有下一页
+        with self.connections.reader() as conn:
+            rows = conn.execute(f"""
+            SELECT {', '.join(MEMBER_COLUMNS)}, {', '.join(keys)} FROM {MEMBERS_TABLE}
+            WHERE {' AND '.join(conditions)}
+            ORDER BY {', '.join(f'{key} {direction}' for key in keys)}
+            LIMIT ?
+            """, params + [page_size + 1]).fetchall()
+
+        width = len(MEMBER_COLUMNS)
+        members = [row[:width] for row in rows[:page_size]]
+        cursor = tuple(rows[page_size - 1][width:]) if len(rows) > page_size else None
+        return members, cursor
+
+    @timed('db.search_members')
+    def search_members(self, search_text, limit=SEARCH_LIMIT, card_type=None):
+        """根据姓名或手机号搜索会员，按相关度返回最多limit条"""
+        card_type = card_type or self.current_card_type
+        text = search_text.strip()
+        plan = self.plan_search(text)
+        if plan == 'substring' and not self.search_index.uses_fts(text):
+            # 过短的子串只能逐行扫描；整表已在内存时改用列存储的向量化过滤
+            columns = self.cache.columns(card_type)
+            if columns is not None:
+                return columns.rows(columns.filter(text)[:limit])
+        with self.connections.reader() as conn:
+            if plan == 'phone_suffix':
+                return self.search_index.search_phone_suffix(conn, card_type, text, limit)
+            if plan == 'initials':
+                return self.search_index.search_initials(conn, card_type, text, limit)
+            return self.search_index.search(conn, card_type, text, limit)
+
+    @staticmethod
+    def plan_search(text):
+        """根据输入的形式选择索引：尾号、拼音首字母或子串"""
+        if re.fullmatch(r'[0-9]{4}', text):
+            return 'phone_suffix'
+        if re.fullmatch(r'[A-Za-z]+', text):
+            return 'initials'
+        # 汉字姓名片段和其他输入走trigram子串索引
+        return 'substring'
+
+    @timed('db.add_member')
+    def add_member(self, data, card_type=None):
+        """添加新会员，默认加入当前卡种"""
+        card_type = card_type or self.current_card_type
+        if card_type not in dict(self.card_types):
+            return False, "未知的卡种"
+        errors = MEMBER_RULES.validate(data)
+        if errors:
+            return False, errors[0][1]
 
         try:
-            cursor.execute(f"""
-            INSERT INTO {self.current_table} (name, phone, remaining_times, balance)
-            VALUES (?, ?, ?, ?)
-            """, (data['name'], data['phone'], data['remaining_times'], data['balance']))
-
-            conn.commit()
-            conn.close()
-
-            # 同步到Excel
-            self.sync_db_to_excel()
-            self.data_updated.emit()
+            with self.connections.transaction() as conn:
+                conn.execute(f"""
+                INSERT INTO {MEMBERS_TABLE}
+                    (card_type, name, phone, remaining_times, balance, phone_rev, name_initials)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (card_type, data['name'], data['phone'], data['remaining_times'], data['balance'],
+                      *lookup_values(data['name'], data['phone'])))
+
+            member = self._member_dict(data)
+            self.cache.put(card_type, self._member_tuple(member))
+
+            # 交给后台线程合并写入Excel
+            self.excel_mirror.mark_dirty(card_type, [member['phone']])
+            self.member_added.emit(card_type, member)
             return True, "添加成功"
 
         except sqlite3.IntegrityError:
-            conn.close()
             return False, "手机号已存在"
 
         except Exception as e:
-            conn.close()
             return False, f"添加失败: {str(e)}"
 
-    def update_member(self, phone, data):
+    @timed('db.update_member')
+    def update_member(self, phone, data, card_type=None):
         """更新会员信息"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        card_type = card_type or self.current_card_type
+        errors = MEMBER_RULES.validate(data)
+        if errors:
+            return False, errors[0][1]
 
         try:
-            cursor.execute(f"""
-            UPDATE {self.current_table}
-            SET name = ?, phone = ?, remaining_times = ?, balance = ?
-            WHERE phone = ?
-            """, (data['name'], data['phone'], data['remaining_times'], data['balance'], phone))
-
-            conn.commit()
-            conn.close()
-
-            # 同步到Excel
-            self.sync_db_to_excel()
-            self.data_updated.emit()
+            with self.connections.transaction() as conn:
+                cursor = conn.execute(f"""
+                UPDATE {MEMBERS_TABLE}
+                SET name = ?, phone = ?, remaining_times = ?, balance = ?,
+                    phone_rev = ?, name_initials = ?
+                WHERE card_type = ? AND phone = ?
+                """, (data['name'], data['phone'], data['remaining_times'], data['balance'],
+                      *lookup_values(data['name'], data['phone']), card_type, phone))
+
+            if cursor.rowcount:
+                member = self._member_dict(data)
+                self.cache.remove(card_type, phone)
+                self.cache.put(card_type, self._member_tuple(member))
+
+                # 交给后台线程合并写入Excel
+                self.excel_mirror.mark_dirty(card_type, [phone, member['phone']])
+                self.member_updated.emit(card_type, phone, member['phone'], member)
             return True, "更新成功"
 
         except sqlite3.IntegrityError:
-            conn.close()
             return False, "手机号已存在"
 
         except Exception as e:
-            conn.close()
             return False, f"更新失败: {str(e)}"
 
-    def get_member_by_phone(self, phone):
-        """根据手机号获取会员信息"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute(f"""
-        SELECT name, phone, remaining_times, balance
-        FROM {self.current_table}
-        WHERE phone = ?
-        """, (phone,))
-
-        result = cursor.fetchone()
-        conn.close()
+    @timed('db.deduct_member')
+    def deduct_member(self, phone, times=1, amount=0, card_type=None):
+        """会员消费一次：扣减剩余次数和余额，不足时整笔不扣"""
+        times, amount = int(times), int(amount)
+        if times < 0 or amount < 0 or not (times or amount):
+            return False, "扣减的次数和金额不能为负，且至少扣减一项"
+        report = self.bulk_adjust(-times, -amount, phones=[phone], card_type=card_type)
+        if report['status'] == 'error':
+            return False, report['message']
+        if report['violations']:
+            field = report['violations'][0]['field']
+            return False, "剩余次数不足" if field == 'remaining_times' else "余额不足"
+        if not report['updated']:
+            return False, "会员不存在"
+        return True, "扣减成功"
+
+    @timed('db.get_member_by_phone')
+    def get_member_by_phone(self, phone, card_type=None):
+        """根据手机号获取会员在当前卡种(或指定卡种)下的信息"""
+        card_type = card_type or self.current_card_type
+        result = self.cache.get(card_type, phone)
+        if result is None:
+            version = self.cache.version(card_type)
+            with self.connections.reader() as conn:
+                result = conn.execute(f"""
+                SELECT name, phone, remaining_times, balance
+                FROM {MEMBERS_TABLE}
+                WHERE card_type = ? AND phone = ?
+                """, (card_type, phone)).fetchone()
+            if result:
+                self.cache.put(card_type, result, version)
 
         if result:
             return {
@@ -190,10 +545,274 @@ class DatabaseManager(QObject):
         else:
             return None
 
-    def switch_table(self, table_name):
-        """切换当前操作的表"""
-        if table_name in ['haircut_card', 'wash_blow_card']:
-            self.current_table = table_name
-            self.data_updated.emit()
+    @timed('db.get_member_cards')
+    def get_member_cards(self, phone):
+        """顾客持有的所有卡，一次索引查询: [{'card_type', 'name', 'phone', ...}]"""
+        with self.connections.reader() as conn:
+            rows = conn.execute(f"""
+            SELECT card_type, {', '.join(MEMBER_COLUMNS)} FROM {MEMBERS_TABLE}
+            WHERE phone = ?
+            """, (phone,)).fetchall()
+        return [dict(zip(['card_type'] + MEMBER_COLUMNS, row)) for row in rows]
+
+    @timed('db.import_members')
+    def import_members(self, path, card_type=None, **options):
+        """批量导入Excel/CSV会员文件，返回导入报告"""
+        from database.migration import DataMigrator
+        card_type = card_type or self.current_card_type
+        report = DataMigrator(self.db_path).import_file(path, card_type, **options)
+
+        self.invalidate_cache(card_type)
+        self.excel_mirror.mark_dirty()
+        self.bulk_reloaded.emit(card_type)
+        return report
+
+    def replication_node(self):
+        """本店数据库的同步节点标识，对方导出时用它指定对端"""
+        with self.connections.reader() as conn:
+            return self.replication.node(conn)
+
+    def replication_identity(self):
+        """本店的同步节点标识和进度，恢复备份前记下"""
+        with self.connections.reader() as conn:
+            return self.replication.identity(conn)
+
+    def keep_replication_identity(self, identity):
+        """恢复备份后沿用原来的同步节点标识和进度"""
+        with self.connections.transaction() as conn:
+            return self.replication.keep_identity(conn, identity)
+
+    @timed('db.export_changes')
+    def export_changes(self, path, peer=None):
+        """导出对端peer尚未确认的会员改动，返回导出报告"""
+        with self.connections.reader() as conn:
+            return self.replication.export(conn, path, peer)
+
+    @timed('db.apply_changes')
+    def apply_changes(self, path):
+        """导入其他分店导出的会员改动，返回导入报告"""
+        with self.connections.transaction() as conn:
+            report = self.replication.apply(conn, path)
+        if report['status'] != 'applied' or not report['applied']:
+            return report
+
+        card_types = self.card_types
+        self._load_card_types()
+        if self.card_types != card_types:
+            self.card_types_changed.emit()
+        self.invalidate_cache()
+        self.excel_mirror.mark_dirty()
+        self.bulk_reloaded.emit('')
+        return report
+
+    @timed('db.remove_member')
+    def remove_member(self, phone, card_type=None):
+        """删除会员"""
+        card_type = card_type or self.current_card_type
+        try:
+            with self.connections.transaction() as conn:
+                cursor = conn.execute(f"DELETE FROM {MEMBERS_TABLE} WHERE card_type = ? AND phone = ?",
+                                      (card_type, phone))
+        except Exception as e:
+            return False, f"删除失败: {str(e)}"
+
+        if not cursor.rowcount:
+            return False, "会员不存在"
+        self.cache.remove(card_type, phone)
+        self.excel_mirror.mark_dirty(card_type, [phone])
+        self.member_removed.emit(card_type, phone)
+        return True, "删除成功"
+
+    @timed('db.bulk_adjust')
+    def bulk_adjust(self, remaining_times_delta=0, balance_delta=0, where=None, params=(),
+                    phones=None, card_type=None, skip_invalid=False):
+        """批量增减剩余次数和余额，在单个事务中用一条UPDATE完成
+
+        where为附加的SQL条件(只能由程序内部给出，不可拼接用户输入)，phones限定手机号。
+        超出CHECK范围的行会逐行列出；skip_invalid为False时整批放弃，否则只跳过这些行。
+        """
+        card_type = card_type or self.current_card_type
+        deltas = {'remaining_times': int(remaining_times_delta), 'balance': int(balance_delta)}
+        conditions, args = self._bulk_filter(card_type, where, params, phones)
+        report = self._bulk_report()
+
+        adjusted = ', '.join(f"{column} + {delta} AS {column}" for column, delta in deltas.items())
+        valid = ' AND '.join(MEMBER_RULES[column].sql_condition(f"({column} + {delta})")
+                             for column, delta in deltas.items())
+        try:
+            with self.connections.transaction() as conn:
+                # 先找出调整后会违反约束的行，逐行报告
+                rows = conn.execute(f"""
+                SELECT {', '.join(MEMBER_COLUMNS)} FROM (
+                    SELECT name, phone, {adjusted} FROM {MEMBERS_TABLE} WHERE {conditions}
+                    AND NOT ({valid})
+                )
+                """, args).fetchall()
+                report['violations'] = self._violations(rows, deltas)
+                if report['violations'] and not skip_invalid:
+                    report.update(status='rejected',
+                                  message=f"{len(report['violations'])}位会员调整后超出范围，未做任何修改")
+                    return report
+
+                with self.ledger.deferred(conn):
+                    members = conn.execute(f"""
+                    UPDATE {MEMBERS_TABLE}
+                    SET {', '.join(f"{column} = {column} + {delta}" for column, delta in deltas.items())}
+                    WHERE {conditions} AND {valid}
+                    RETURNING {', '.join(MEMBER_COLUMNS)}
+                    """, args).fetchall()
+        except Exception as e:
+            report.update(status='error', message=f"批量调整失败: {str(e)}")
+            return report
+
+        return self._finish_bulk(card_type, members, report)
+
+    @timed('db.bulk_update')
+    def bulk_update(self, updates, card_type=None, skip_invalid=False):
+        """批量修改会员，updates为 [{'phone': 手机号, 字段: 新值, ...}]
+
+        只修改给出的字段(不能改手机号)，所有行在一个事务中由一条UPDATE完成
+        """
+        card_type = card_type or self.current_card_type
+        report = self._bulk_report()
+        records = []
+        for update in updates:
+            unknown = set(update) - set(MEMBER_COLUMNS)
+            if unknown:
+                raise ValueError(f"未知字段: {', '.join(sorted(unknown))}")
+            record = {column: update.get(column) for column in MEMBER_COLUMNS}
+            errors = [(field, MEMBER_RULES[field].message) for field, value in record.items()
+                      if (field == 'phone' or value is not None) and not MEMBER_RULES[field].check(value)]
+            report['violations'] += [{'phone': record['phone'], 'name': record['name'],
+                                      'field': field, 'value': record[field], 'message': message}
+                                     for field, message in errors]
+            if not errors:
+                if record['name'] is not None:
+                    record['name_initials'] = lookup_values(record['name'], record['phone'])[1]
+                records.append(record)
+
+        if report['violations'] and not skip_invalid:
+            report.update(status='rejected',
+                          message=f"{len(report['violations'])}处数据不合格，未做任何修改")
+            return report
+
+        assignments = ', '.join(f"{column} = coalesce(u.{column}, {MEMBERS_TABLE}.{column})"
+                                for column in ('name', 'remaining_times', 'balance', 'name_initials'))
+        try:
+            with self.connections.transaction() as conn, self.ledger.deferred(conn):
+                # 所有修改打包成一个JSON参数，展开后与会员表连接更新
+                members = conn.execute(f"""
+                UPDATE {MEMBERS_TABLE}
+                SET {assignments}
+                FROM (
+                    SELECT json_extract(value, '$.phone') AS phone,
+                           json_extract(value, '$.name') AS name,
+                           json_extract(value, '$.remaining_times') AS remaining_times,
+                           json_extract(value, '$.balance') AS balance,
+                           json_extract(value, '$.name_initials') AS name_initials
+                    FROM json_each(?)
+                ) AS u
+                WHERE {MEMBERS_TABLE}.card_type = ? AND {MEMBERS_TABLE}.phone = u.phone
+                RETURNING {', '.join(f"{MEMBERS_TABLE}.{column}" for column in MEMBER_COLUMNS)}
+                """, (json.dumps(records, ensure_ascii=False), card_type)).fetchall()
+        except Exception as e:
+            report.update(status='error', message=f"批量修改失败: {str(e)}")
+            return report
+
+        found = {member[1] for member in members}
+        report['missing'] = [record['phone'] for record in records if record['phone'] not in found]
+        return self._finish_bulk(card_type, members, report)
+
+    @staticmethod
+    def _bulk_filter(card_type, where, params, phones):
+        """拼出批量操作的WHERE条件和参数"""
+        conditions, args = ['card_type = ?'], [card_type]
+        if where:
+            conditions.append(f"({where})")
+            args += list(params)
+        if phones is not None:
+            conditions.append("phone IN (SELECT value FROM json_each(?))")
+            args.append(json.dumps(list(phones)))
+        return ' AND '.join(conditions), args
+
+    @staticmethod
+    def _bulk_report():
+        return {'status': 'applied', 'message': '', 'matched': 0, 'updated': 0,
+                'violations': [], 'missing': []}
+
+    @staticmethod
+    def _violations(rows, values):
+        """逐行列出不满足校验规则的字段"""
+        violations = []
+        for row in rows:
+            member = dict(zip(MEMBER_COLUMNS, row))
+            for field in values:
+                if not MEMBER_RULES[field].check(member[field]):
+                    violations.append({'phone': member['phone'], 'name': member['name'], 'field': field,
+                                       'value': member[field], 'message': MEMBER_RULES[field].message})
+        return violations
+
+    def _finish_bulk(self, card_type, members, report):
+        """批量修改提交后：更新缓存，一次通知界面，一次标记Excel待写入"""
+        members = [dict(zip(MEMBER_COLUMNS, member)) for member in members]
+        for member in members:
+            self.cache.put(card_type, self._member_tuple(member))
+        report['updated'] = len(members)
+        report['matched'] = len(members) + len({v['phone'] for v in report['violations']})
+        report['message'] = f"已修改{len(members)}位会员"
+        if report['violations']:
+            report['message'] += f"，跳过{len({v['phone'] for v in report['violations']})}位超出范围的会员"
+        if members:
+            self.excel_mirror.mark_dirty(card_type, [member['phone'] for member in members])
+            self.members_updated.emit(card_type, members)
+        return report
+
+    def get_member_history(self, phone, card_type=None, limit=100):
+        """会员的消费和充值流水，新的在前；card_type为None时包含所有卡"""
+        with self.connections.reader() as conn:
+            return self.ledger.history(conn, phone, card_type, limit)
+
+    def get_daily_summary(self, start_day, end_day, card_type=None):
+        """按天汇总的到店、消费和充值，card_type为None时包含所有卡"""
+        with self.connections.reader() as conn:
+            return self.ledger.daily(conn, start_day, end_day, card_type)
+
+    def get_period_totals(self, start_day, end_day, card_type=None):
+        """一段时间内的合计(如本月到店次数)，由每日汇总相加得到"""
+        with self.connections.reader() as conn:
+            return self.ledger.totals(conn, start_day, end_day, card_type)
+
+    def get_top_members(self, month, card_type=None, by='visits', limit=10):
+        """某月的会员排行，month格式YYYY-MM"""
+        card_type = card_type or self.current_card_type
+        with self.connections.reader() as conn:
+            return self.ledger.top_members(conn, month, card_type, by, limit)
+
+    @staticmethod
+    def _member_tuple(data):
+        return tuple(data[column] for column in MEMBER_COLUMNS)
+
+    @staticmethod
+    def _member_dict(data):
+        return {column: data[column] for column in MEMBER_COLUMNS}
+
+    def invalidate_cache(self, card_type=None):
+        """丢弃内存缓存，数据库文件被外部替换(如恢复备份)后调用"""
+        self.cache.invalidate(card_type)
+
+    def cache_stats(self):
+        """缓存命中统计"""
+        return self.cache.stats()
+
+    def switch_card_type(self, card_type):
+        """切换当前操作的卡种"""
+        if card_type in dict(self.card_types):
+            self.current_card_type = card_type
+            self.card_type_switched.emit(card_type)
             return True
         return False
+
+    def close(self):
+        """写入未同步的Excel改动并关闭数据库连接"""
+        self.excel_mirror.stop()
+        self.connections.close()
@@ -0,0 +1,181 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from metrics import TimedConnection
+
+
+class ConnectionManager:
+    """SQLite长连接管理：单写连接 + 读连接池，WAL模式"""
+
+    def __init__(self, db_path, pool_size=4, cache_size_kb=8192,
+                 mmap_size=64 * 1024 * 1024, statement_cache=128, busy_timeout=5.0):
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.statement_cache = statement_cache
+        self.busy_timeout = busy_timeout
+
+        self._writer = None
+        self._write_lock = threading.RLock()
+        self._write_depth = 0
+
+        self._readers = queue.LifoQueue()
+        self._live_readers = set()
+        self._pool_lock = threading.Lock()
+        self._gate = threading.Condition(self._pool_lock)  # 独占期间挡住其他线程借读连接
+        self._borrowed = 0  # 已借出的读连接数
+        self._exclusive_owner = None  # 独占数据库文件的线程
+
+    def _connect(self):
+        """创建一个已调优的连接"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout,
+            isolation_level=None,  # 手动管理事务
+            check_same_thread=False,
+            cached_statements=self.statement_cache,
+            factory=TimedConnection,  # 每条SQL计时，慢查询记录执行计划
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def _get_writer(self):
+        if self._writer is None:
+            self._writer = self._connect()
+        return self._writer
+
+    @contextmanager
+    def transaction(self):
+        """写事务：正常退出时提交，异常时回滚；同一线程内可嵌套"""
+        with self._write_lock:
+            conn = self._get_writer()
+            if self._write_depth > 0:
+                # 嵌套调用并入外层事务
+                self._write_depth += 1
+                try:
+                    yield conn
+                finally:
+                    self._write_depth -= 1
+                return
+
+            conn.execute("BEGIN IMMEDIATE")
+            self._write_depth = 1
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                # 提交失败(SQLITE_BUSY、磁盘已满等)时同样回滚，否则写连接会一直停在事务中；
+                # 有些错误SQLite已自动回滚，这时不能再执行ROLLBACK
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            finally:
+                self._write_depth = 0
+
+    @contextmanager
+    def reader(self):
+        """从连接池借出一个只读连接，WAL下不会被写事务阻塞"""
+        conn = self._acquire_reader()
+        try:
+            yield conn
+        finally:
+            self._release_reader(conn)
+
+    def _acquire_reader(self):
+        with self._gate:
+            while self._exclusive_owner not in (None, threading.get_ident()):
+                self._gate.wait()
+            self._borrowed += 1
+        try:
+            return self._checkout_reader()
+        except BaseException:
+            self._returned()
+            raise
+
+    def _checkout_reader(self):
+        while True:
+            try:
+                return self._readers.get_nowait()
+            except queue.Empty:
+                pass
+
+            with self._pool_lock:
+                if len(self._live_readers) < self.pool_size:
+                    conn = self._connect()
+                    conn.execute("PRAGMA query_only=ON")
+                    self._live_readers.add(conn)
+                    return conn
+
+            # 连接池已满，等待其他线程归还
+            try:
+                return self._readers.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+    def _release_reader(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            with self._pool_lock:
+                if conn not in self._live_readers:
+                    # 借出期间连接池被关闭，直接丢弃
+                    conn.close()
+                    return
+            self._readers.put(conn)
+        finally:
+            self._returned()
+
+    def _returned(self):
+        with self._gate:
+            self._borrowed -= 1
+            self._gate.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        """独占数据库文件，用于整体替换(如恢复备份)
+
+        持有写锁，挡住其他线程借出读连接并等已借出的归还，然后关闭所有连接；
+        块内可以删除WAL、替换文件，本线程随后的读写会重新打开连接。
+        """
+        with self._write_lock:
+            with self._gate:
+                self._exclusive_owner = threading.get_ident()
+                while self._borrowed:
+                    self._gate.wait()
+            try:
+                self.close()
+                yield
+            finally:
+                with self._gate:
+                    self._exclusive_owner = None
+                    self._gate.notify_all()
+
+    def checkpoint(self):
+        """把WAL中的内容合并回主数据库文件"""
+        with self._write_lock:
+            self._get_writer().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        """关闭所有连接，之后再次使用时会自动重新打开"""
+        with self._write_lock, self._pool_lock:
+            while True:
+                try:
+                    conn = self._readers.get_nowait()
+                except queue.Empty:
+                    break
+                conn.close()
+            self._live_readers.clear()
+
+            if self._writer is not None:
+                try:
+                    self._writer.execute("PRAGMA optimize")
+                except sqlite3.Error:
+                    pass
+                self._writer.close()
+                self._writer = None
@@ -0,0 +1,124 @@
+import queue
+import threading
+from concurrent.futures import Future
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal, pyqtSlot
+
+
+class _ReadTask(QRunnable):
+    """在读线程池中执行一次读操作"""
+
+    def __init__(self, service, job, write_seq):
+        super().__init__()
+        self.service = service
+        self.job = job
+        self.write_seq = write_seq
+
+    def run(self):
+        # 先等提交在它之前的写操作完成，保证读到自己写入的数据
+        self.service.wait_for_writes(self.write_seq)
+        self.service._execute(self.job)
+
+
+class DatabaseService(QObject):
+    """异步数据库服务：界面线程只提交任务，不等待存储
+
+    写操作由唯一的写线程按提交顺序串行执行；读操作在读线程池中并行执行，
+    并且总在提交它之前的写操作完成之后才开始。结果通过回调在界面线程送达。
+    """
+
+    busy_changed = pyqtSignal(bool)  # 是否有尚未完成的写操作
+    failed = pyqtSignal(str)  # 后台任务抛出的异常
+    _completed = pyqtSignal(object, object, object)  # 内部: 任务, 结果, 异常
+
+    def __init__(self, db_manager, readers=2, parent=None):
+        super().__init__(parent)
+        self.db_manager = db_manager
+        self._completed.connect(self._on_completed)
+
+        self.read_pool = QThreadPool(self)
+        self.read_pool.setMaxThreadCount(readers)
+
+        self._writes = queue.Queue()
+        self._cond = threading.Condition()
+        self._submitted = 0  # 已提交的写操作数
+        self._finished = 0  # 已完成的写操作数
+        self._pending = 0  # 界面线程尚未收到结果的写操作数
+        self._writer = threading.Thread(target=self._write_loop, name='db-writer', daemon=True)
+        self._writer.start()
+
+    def write(self, fn, *args, callback=None, **kwargs):
+        """提交写操作，返回Future；callback(结果)在界面线程调用"""
+        job = (fn, args, kwargs, callback, Future(), True)
+        with self._cond:
+            self._submitted += 1
+        self._pending += 1
+        if self._pending == 1:
+            self.busy_changed.emit(True)
+        self._writes.put(job)
+        return job[4]
+
+    def read(self, fn, *args, callback=None, **kwargs):
+        """提交读操作，返回Future；callback(结果)在界面线程调用"""
+        job = (fn, args, kwargs, callback, Future(), False)
+        with self._cond:
+            write_seq = self._submitted
+        self.read_pool.start(_ReadTask(self, job, write_seq))
+        return job[4]
+
+    @property
+    def busy(self):
+        return self._pending > 0
+
+    def wait_for_writes(self, seq=None, timeout=None):
+        """等待前seq个写操作完成，seq为None时等待当前已提交的全部写操作"""
+        with self._cond:
+            if seq is None:
+                seq = self._submitted
+            return self._cond.wait_for(lambda: self._finished >= seq, timeout)
+
+    def _write_loop(self):
+        while True:
+            job = self._writes.get()
+            if job is None:
+                return
+            try:
+                self._execute(job)
+            finally:
+                with self._cond:
+                    self._finished += 1
+                    self._cond.notify_all()
+
+    def _execute(self, job):
+        fn, args, kwargs, callback, future, is_write = job
+        if not future.set_running_or_notify_cancel():
+            self._completed.emit(job, None, None)
+            return
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            future.set_exception(e)
+            self._completed.emit(job, None, e)
+        else:
+            future.set_result(result)
+            self._completed.emit(job, result, None)
+
+    @pyqtSlot(object, object, object)
+    def _on_completed(self, job, result, error):
+        fn, args, kwargs, callback, future, is_write = job
+        if is_write:
+            self._pending -= 1
+            if self._pending == 0:
+                self.busy_changed.emit(False)
+        if error is not None:
+            message = f"{getattr(fn, '__name__', fn)} 执行失败: {error}"
+            print(message)
+            self.failed.emit(message)
+        elif callback is not None and not future.cancelled():
+            callback(result)
+
+    def shutdown(self):
+        """执行完已提交的写操作后停止写线程，并等待读操作结束"""
+        if self._writer.is_alive():
+            self._writes.put(None)
+            self._writer.join()
+        self.read_pool.waitForDone()
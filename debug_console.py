@@ -1,27 +1,121 @@
-from PyQt5.QtWidgets import QDialog, QVBoxLayout, QTextEdit, QPushButton
-from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QTextEdit, QPushButton, QTabWidget,
+                             QWidget, QTableWidget, QTableWidgetItem, QHeaderView, QLabel, QSplitter)
+from PyQt5.QtCore import Qt, QTimer
+import os
 from datetime import datetime
+from metrics import METRICS
+
+METRIC_COLUMNS = ["操作", "次数", "p50(ms)", "p95(ms)", "p99(ms)", "最大(ms)", "平均行数"]
 
 class DebugConsole(QDialog):
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, metrics=METRICS, refresh_ms=1000):
         super().__init__(parent)
         self.setWindowTitle("调试控制台")
-        self.setGeometry(300, 300, 600, 400)
+        self.setGeometry(300, 300, 760, 480)
+        self.metrics = metrics
 
         layout = QVBoxLayout(self)
+        self.tabs = QTabWidget()
+        layout.addWidget(self.tabs)
+
+        # 日志页
+        log_page = QWidget()
+        log_layout = QVBoxLayout(log_page)
 
         # 输出文本区域
         self.text_area = QTextEdit()
         self.text_area.setReadOnly(True)
-        layout.addWidget(self.text_area)
+        log_layout.addWidget(self.text_area)
 
         # 清空按钮
         clear_btn = QPushButton("清空日志")
         clear_btn.clicked.connect(self.clear_text)
-        layout.addWidget(clear_btn)
+        log_layout.addWidget(clear_btn)
+        self.tabs.addTab(log_page, "日志")
+
+        self.tabs.addTab(self._build_metrics_page(), "性能指标")
+        self.tabs.currentChanged.connect(self.refresh_metrics)
+
+        # 性能指标页可见时每秒刷新
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(refresh_ms)
+        self.refresh_timer.timeout.connect(self.refresh_metrics)
+        self.refresh_timer.start()
 
         self.append_text("调试控制台已启动")
 
+    def _build_metrics_page(self):
+        page = QWidget()
+        page_layout = QVBoxLayout(page)
+        self.metrics_summary = QLabel()
+        page_layout.addWidget(self.metrics_summary)
+
+        splitter = QSplitter(Qt.Vertical)
+        self.metrics_table = QTableWidget(0, len(METRIC_COLUMNS))
+        self.metrics_table.setHorizontalHeaderLabels(METRIC_COLUMNS)
+        self.metrics_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.metrics_table.verticalHeader().setVisible(False)
+        self.metrics_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.metrics_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        splitter.addWidget(self.metrics_table)
+
+        # 慢查询及其执行计划
+        self.slow_queries = QTextEdit()
+        self.slow_queries.setReadOnly(True)
+        splitter.addWidget(self.slow_queries)
+        splitter.setSizes([300, 120])
+        page_layout.addWidget(splitter)
+
+        buttons = QHBoxLayout()
+        reset_btn = QPushButton("重置指标")
+        reset_btn.clicked.connect(self.reset_metrics)
+        buttons.addWidget(reset_btn)
+        export_btn = QPushButton("导出快照")
+        export_btn.clicked.connect(self.export_metrics)
+        buttons.addWidget(export_btn)
+        page_layout.addLayout(buttons)
+        return page
+
+    def refresh_metrics(self):
+        """按最新快照刷新指标表格和慢查询列表"""
+        if not self.isVisible() or self.tabs.currentIndex() != 1:
+            return
+        snapshot = self.metrics.snapshot()
+        operations = snapshot['operations']
+        self.metrics_summary.setText(
+            f"运行 {snapshot['uptime_s']:.0f} 秒，{len(operations)} 项操作；"
+            f"超过 {snapshot['slow_query_ms']:.0f}ms 的SQL记为慢查询")
+
+        self.metrics_table.setRowCount(len(operations))
+        for row, (name, stats) in enumerate(operations.items()):
+            values = [name, stats['count'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms'],
+                      stats['max_ms'], stats.get('rows_mean', '')]
+            for column, value in enumerate(values):
+                text = f"{value:.2f}" if isinstance(value, float) else str(value)
+                item = QTableWidgetItem(text)
+                if column:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.metrics_table.setItem(row, column, item)
+
+        lines = []
+        for entry in reversed(snapshot['slow_queries']):
+            lines.append(f"[{entry['time']}] {entry['ms']}ms  {entry['sql']}")
+            for detail in entry['plan'] or []:
+                lines.append(f"    {detail}")
+        text = '\n'.join(lines) or "暂无慢查询"
+        if text != self.slow_queries.toPlainText():
+            self.slow_queries.setPlainText(text)
+
+    def reset_metrics(self):
+        self.metrics.reset()
+        self.refresh_metrics()
+        self.append_text("性能指标已重置")
+
+    def export_metrics(self):
+        path = os.path.join('database', f"metrics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        self.metrics.export(path)
+        self.append_text(f"性能指标快照已导出到 {path}")
+
     def append_text(self, text):
         """添加文本到调试窗口"""
         time_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -35,4 +129,5 @@ class DebugConsole(QDialog):
 
     def closeEvent(self, event):
         """窗口关闭时的处理"""
+        self.refresh_timer.stop()
         event.accept()
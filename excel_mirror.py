@@ -0,0 +1,274 @@
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from metrics import timed
+
+REVISION_TABLE = 'data_revision'  # 数据修订号，每次会员或卡种变化加一
+
+
+class ExcelMirror:
+    """Excel镜像后台写入：改动只做标记，空闲时合并成一次写盘
+
+    每种卡一个工作表，表名即卡种代码。xlsx是压缩包，改一行也要解析并重写整个文件，
+    逐行修补并不比整表重建快，所以每次写盘都整表重建，只通过合并写盘减少次数。
+    """
+
+    def __init__(self, connections, excel_path, table, sheets, columns,
+                 flush_interval=30.0, idle_delay=2.0, max_delay=120.0):
+        self.connections = connections
+        self.excel_path = excel_path
+        self.index_path = excel_path + '.index.json'  # 上次写入时的文件状态和修订号
+        self.table = table  # 会员表
+        self.sheets = list(sheets)  # 卡种代码
+        self.columns = list(columns)
+        self.flush_interval = flush_interval  # 两次写盘的最小间隔(秒)
+        self.idle_delay = idle_delay  # 最后一次改动后多久算空闲(秒)
+        self.max_delay = max_delay  # 持续繁忙时最多推迟多久(秒)
+
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._dirty = False
+        self._full_pending = False
+        self._changes = {}  # 卡种 -> 尚未写入的手机号集合，合并Excel时这些行以数据库为准
+        self._first_change = 0.0
+        self._last_change = 0.0
+        self._last_flush = 0.0
+        self._running = False
+        self._thread = None
+
+    def install(self, conn, tables):
+        """创建修订号表，并在tables上安装触发器使每次增删改都让修订号加一，需在写事务中调用
+
+        修订号随数据库持久保存，启动时与Excel索引中记录的修订号比较即可知道是否需要重写
+        """
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {REVISION_TABLE} (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            revision INTEGER NOT NULL
+        )
+        """)
+        conn.execute(f"INSERT OR IGNORE INTO {REVISION_TABLE} (id, revision) VALUES (1, 0)")
+        for table in tables:
+            for action in ('INSERT', 'UPDATE', 'DELETE'):
+                conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_revision_{action.lower()}
+                AFTER {action} ON {table} BEGIN
+                    UPDATE {REVISION_TABLE} SET revision = revision + 1 WHERE id = 1;
+                END
+                """)
+
+    @staticmethod
+    def revision(conn):
+        """当前数据修订号，修订号表还不存在时返回None"""
+        try:
+            row = conn.execute(f"SELECT revision FROM {REVISION_TABLE} WHERE id = 1").fetchone()
+        except sqlite3.OperationalError:
+            return None
+        return row[0] if row else None
+
+    def current_revision(self):
+        with self.connections.reader() as conn:
+            return self.revision(conn)
+
+    def up_to_date(self):
+        """Excel是否仍是上次写入的内容，且数据库此后没有任何变化，满足时启动不必重写"""
+        if not self.matches_written():
+            return False
+        revision = self.current_revision()
+        return revision is not None and self._load_index_field('revision') == revision
+
+    def start(self):
+        """启动后台写入线程"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name='excel-mirror', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止后台线程，并把尚未写入的改动落盘"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def mark_dirty(self, card_type=None, phones=()):
+        """标记Excel副本已过期；给出卡种和手机号时记下这些行尚未写入"""
+        now = time.monotonic()
+        with self._cond:
+            if card_type is None:
+                self._full_pending = True
+            else:
+                self._changes.setdefault(card_type, set()).update(phones)
+            if not self._dirty:
+                self._dirty = True
+                self._first_change = now
+            self._last_change = now
+            self._cond.notify_all()
+
+    @property
+    def dirty(self):
+        with self._cond:
+            return self._dirty
+
+    @timed('excel.flush', rows=None)
+    def flush(self, force=False):
+        """立即写入Excel；force为True时即使没有改动也重新生成"""
+        with self._flush_lock:
+            with self._cond:
+                if not (self._dirty or force):
+                    return False
+                full = self._full_pending
+                changes = self._changes
+                self._dirty = False
+                self._full_pending = False
+                self._changes = {}
+            try:
+                self._write_workbook()
+            except Exception as e:
+                # 写入失败(例如文件被Excel占用)时保留脏标记，稍后重试
+                with self._cond:
+                    self._full_pending = self._full_pending or full
+                    for card_type, phones in changes.items():
+                        self._changes.setdefault(card_type, set()).update(phones)
+                    if not self._dirty:
+                        self._dirty = True
+                        self._first_change = time.monotonic()
+                    self._last_change = time.monotonic()
+                print(f"同步数据库到Excel出错: {e}")
+                return False
+            finally:
+                self._last_flush = time.monotonic()
+            return True
+
+    def pending(self):
+        """返回尚未写入Excel的改动: (是否需要整表重建, {卡种: 手机号集合})"""
+        with self._cond:
+            return self._full_pending, {card_type: set(phones)
+                                        for card_type, phones in self._changes.items()}
+
+    @contextmanager
+    def locked(self):
+        """读取或接管Excel文件期间阻止后台写入，不丢弃未写入的改动"""
+        with self._flush_lock:
+            yield
+
+    def matches_written(self):
+        """Excel文件是否仍是本程序最后一次写入(或接管)时的内容"""
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                index = json.load(f)
+            stat = os.stat(self.excel_path)
+        except (OSError, ValueError):
+            return False
+        if index.get('mtime_ns') == stat.st_mtime_ns and index.get('size') == stat.st_size:
+            return True
+        # 只是修改时间变了(如另存为但未改内容)时再比较内容哈希
+        if index.get('size') != stat.st_size or index.get('sha256') != file_digest(self.excel_path):
+            return False
+        self._save_index(index.get('revision'))
+        return True
+
+    def adopt(self):
+        """把外部修改后的Excel当作当前副本"""
+        self._save_index(self.current_revision())
+
+    @contextmanager
+    def paused(self):
+        """整体替换文件期间暂停写入，并丢弃替换前的未写入改动"""
+        with self._flush_lock:
+            yield
+            with self._cond:
+                self._dirty = False
+                self._full_pending = False
+                self._changes = {}
+
+    def _next_flush_at(self):
+        """计算下一次允许写盘的时间点，调用方需持有锁"""
+        idle_at = self._last_change + self.idle_delay
+        deadline = self._first_change + self.max_delay
+        return max(self._last_flush + self.flush_interval, min(idle_at, deadline))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._dirty:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                wait = self._next_flush_at() - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+            self.flush()
+
+    @timed('excel.write_workbook', rows=None)
+    def _write_workbook(self):
+        """读取所有卡表并原子地替换Excel文件"""
+        import pandas as pd  # pandas和openpyxl导入较慢，第一次写盘时才加载
+        frames = {}
+        with self.connections.reader() as conn:
+            # 在同一个读事务中读取修订号和数据，两者严格对应
+            conn.execute("BEGIN")
+            try:
+                revision = self.revision(conn)
+                for card_type in self.sheets:
+                    frames[card_type] = pd.read_sql_query(
+                        f"SELECT {', '.join(self.columns)} FROM {self.table} "
+                        f"WHERE card_type = ? ORDER BY rowid", conn, params=(card_type,))
+            finally:
+                conn.execute("COMMIT")
+
+        with self._atomic_target() as tmp_path:
+            with pd.ExcelWriter(tmp_path, engine='openpyxl') as writer:
+                for card_type, df in frames.items():
+                    df.to_excel(writer, sheet_name=card_type, index=False)
+        self._save_index(revision)
+
+    @contextmanager
+    def _atomic_target(self):
+        """先写临时文件再改名，写到一半崩溃也不会损坏原文件"""
+        folder = os.path.dirname(os.path.abspath(self.excel_path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.members-', suffix='.xlsx', dir=folder)
+        os.close(fd)
+        try:
+            yield tmp_path
+            os.replace(tmp_path, self.excel_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _load_index_field(self, key):
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                return json.load(f).get(key)
+        except (OSError, ValueError):
+            return None
+
+    def _save_index(self, revision=None):
+        stat = os.stat(self.excel_path)
+        index = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+                 'sha256': file_digest(self.excel_path), 'revision': revision}
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+
+def file_digest(path):
+    """计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
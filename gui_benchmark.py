@@ -0,0 +1,357 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import statistics
+from datetime import datetime
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')  # 没有显示器也能运行，须在创建应用前设置
+
+from PyQt5.QtCore import Qt, QObject, QEvent, QEventLoop, QTimer
+from PyQt5.QtGui import QKeyEvent
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtTest import QTest
+from benchmark import (generate_members, seed_database, add_report_arguments, finish,
+                       DEFAULT_SIZES, RESULT_FORMAT)
+
+def summarize(values):
+    """毫秒耗时列表的统计"""
+    values = sorted(values)
+    if not values:
+        return {'runs': 0}
+    p95 = values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))]
+    return {'median_ms': round(statistics.median(values), 3), 'p95_ms': round(p95, 3),
+            'min_ms': round(values[0], 3), 'max_ms': round(values[-1], 3), 'runs': len(values)}
+
+
+def type_text(widget, text):
+    """像输入法提交文字一样发送按键事件；QTest按ASCII键码发送，不能输入汉字"""
+    for event_type in (QEvent.KeyPress, QEvent.KeyRelease):
+        QApplication.sendEvent(widget, QKeyEvent(event_type, 0, Qt.NoModifier, text))
+
+
+def peak_rss_mb():
+    """进程的峰值常驻内存(MB)，不支持的平台返回None"""
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows没有resource模块
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux以KB为单位，macOS以字节为单位
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+class StallMonitor(QObject):
+    """用高频定时器检测事件循环卡顿：两次触发的间隔远超定时间隔，说明界面线程被占用"""
+
+    def __init__(self, interval_ms=5, threshold_ms=50, parent=None):
+        super().__init__(parent)
+        self.interval_ms = interval_ms
+        self.threshold_ms = threshold_ms  # 超过该间隔记为一次卡顿
+        self.stalls = []
+        self.gaps = []
+        self._last = None
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.setInterval(interval_ms)
+        self.timer.timeout.connect(self._tick)
+
+    def start(self):
+        self._last = time.perf_counter()
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+
+    def _tick(self):
+        now = time.perf_counter()
+        gap = (now - self._last) * 1000
+        self._last = now
+        self.gaps.append(gap)
+        if gap >= self.threshold_ms:
+            self.stalls.append(gap)
+
+
+class PaintProbe(QObject):
+    """应用级事件过滤器：记录被监视控件最近一次绘制的时间，模态对话框显示时回调on_dialog"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.painted = {}  # 控件 -> 最近一次绘制时间
+        self.on_dialog = None
+
+    def watch(self, widget):
+        self.painted[widget] = 0.0
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Paint and obj in self.painted:
+            self.painted[obj] = time.perf_counter()
+        elif event.type() == QEvent.Show and self.on_dialog is not None \
+                and obj.isWidgetType() and obj.isWindow() and obj.isModal():
+            # 对话框在嵌套事件循环中运行，显示之后再排队操作它
+            shown_at, callback = time.perf_counter(), self.on_dialog
+            QTimer.singleShot(0, lambda: callback(obj, shown_at))
+        return False
+
+
+class GuiBenchmark:
+    """在offscreen平台上启动会员管理界面，按脚本输入搜索、切换卡种和编辑会员
+
+    记录首次绘制、每次按键到输入框重绘、搜索结果显示、切换卡种、打开和保存编辑的耗时，
+    以及事件循环卡顿和峰值内存。每个规模在独立子进程中运行，峰值内存互不影响。
+    """
+
+    def __init__(self, size, seed=0, queries=3, switches=4, edits=5, key_interval_ms=80,
+                 stall_threshold_ms=50, timeout=60.0):
+        self.size = size
+        self.seed = seed
+        self.queries = queries  # 每种输入(姓名开头、手机尾号、手机号片段)各输入几次
+        self.switches = switches
+        self.edits = edits
+        self.key_interval_ms = key_interval_ms  # 模拟打字的按键间隔
+        self.stall_threshold_ms = stall_threshold_ms
+        self.timeout = timeout  # 等待单个界面响应的最长秒数
+        self.results = {}
+
+    def pump(self, ms):
+        """运行事件循环ms毫秒"""
+        deadline = time.perf_counter() + ms / 1000
+        while time.perf_counter() < deadline:
+            self.app.processEvents(QEventLoop.AllEvents, 5)
+
+    def wait_until(self, predicate, what):
+        """运行事件循环直到predicate为真，返回满足时的时间"""
+        deadline = time.perf_counter() + self.timeout
+        while not predicate():
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f"等待{what}超时")
+            self.app.processEvents(QEventLoop.AllEvents, 5)
+        return time.perf_counter()
+
+    def wait_paint(self, widget, after, what):
+        """等待widget在after之后重绘，返回重绘时间"""
+        self.wait_until(lambda: self.probe.painted[widget] > after, what)
+        return self.probe.painted[widget]
+
+    def run(self):
+        from database_manager import DatabaseManager, DEFAULT_CARD_TYPES
+        from db_service import DatabaseService
+        from member_ui import MemberManagementUI, MemberEditDialog
+
+        self.app = QApplication.instance() or QApplication(sys.argv[:1])
+        os.makedirs('database', exist_ok=True)
+        card_types = [code for code, _ in DEFAULT_CARD_TYPES]
+        members = generate_members(self.size, self.seed)
+
+        db = DatabaseManager()
+        seed_database(db, members, card_types)
+        rss_seeded = peak_rss_mb()
+
+        self.probe = PaintProbe()
+        self.app.installEventFilter(self.probe)
+        monitor = StallMonitor(threshold_ms=self.stall_threshold_ms)
+        monitor.start()
+
+        started = time.perf_counter()
+        service = DatabaseService(db)
+        window = MemberManagementUI(db, service)
+        viewport = window.table.viewport()
+        self.probe.watch(viewport)
+        self.probe.watch(window.search_input)
+        delivered = []
+        window.search_pipeline.results_ready.connect(lambda *_: delivered.append(time.perf_counter()))
+        window.show()
+
+        first_paint = self.wait_paint(viewport, started, "首次绘制")
+        self.wait_until(lambda: delivered and window.model.rowCount() > 0, "首批会员")
+        first_rows = self.wait_paint(viewport, delivered[-1], "首批会员绘制")
+        self.record('first_paint', [(first_paint - started) * 1000])
+        self.record('first_rows_paint', [(first_rows - started) * 1000])
+
+        try:
+            self._type_searches(window, viewport, members[0::len(card_types)], delivered)
+            self._switch_card_types(window, viewport, delivered)
+            self._edit_members(window, viewport, MemberEditDialog)
+        finally:
+            monitor.stop()
+            window.close()
+            service.shutdown()
+            db.close()
+
+        self.results['event_loop_stalls'] = dict(
+            summarize(monitor.stalls), count=len(monitor.stalls),
+            total_ms=round(sum(monitor.stalls), 1), threshold_ms=self.stall_threshold_ms,
+            longest_ms=round(max(monitor.stalls, default=0.0), 3))
+        # 卡顿中位数随卡顿次数波动，与基线比较时用最长的一次
+        self.results['longest_stall'] = {'median_ms': self.results['event_loop_stalls']['longest_ms'],
+                                         'runs': 1}
+        self.results['memory'] = {'peak_rss_mb': peak_rss_mb(), 'seeded_rss_mb': rss_seeded}
+        return self.results
+
+    def record(self, name, values):
+        self.results[name] = summarize(values)
+        stats = self.results[name]
+        print(f"  {name:<22} 中位数 {stats['median_ms']:>9.2f} ms  p95 {stats['p95_ms']:>9.2f}  ({stats['runs']}次)")
+
+    def _type_searches(self, window, viewport, own, delivered):
+        """逐字输入搜索词再逐字删除，测量每次按键到输入框重绘、停止输入到结果显示的耗时"""
+        rng = random.Random(self.seed + 1)
+        keystrokes = []
+        results = []
+        texts = []
+        for _ in range(self.queries):
+            name, phone, *_ = rng.choice(own)
+            texts += [name[:2], phone[-4:], phone[3:8]]
+
+        for text in texts:
+            for key in list(text) + [None] * len(text):
+                pressed = time.perf_counter()
+                if key is None:
+                    QTest.keyClick(window.search_input, Qt.Key_Backspace)
+                else:
+                    type_text(window.search_input, key)
+                keystrokes.append((self.wait_paint(window.search_input, pressed, "输入框重绘") - pressed) * 1000)
+                if key is not None and len(window.search_input.text()) == len(text):
+                    # 输完整个搜索词，等待防抖后的查询结果显示出来
+                    self.wait_until(lambda: delivered[-1] > pressed, "搜索结果")
+                    results.append((self.wait_paint(viewport, delivered[-1], "结果绘制") - pressed) * 1000)
+                else:
+                    self.pump(self.key_interval_ms)
+            self.wait_until(lambda: delivered[-1] > pressed, "清空搜索后的结果")
+        self.record('keystroke', keystrokes)
+        self.record('search_results', results)
+
+    def _switch_card_types(self, window, viewport, delivered):
+        """来回切换卡种，测量从选择到新表格绘制完成的耗时"""
+        selector = window.card_type_selector
+        latencies = []
+        for i in range(self.switches):
+            index = (selector.currentIndex() + 1) % selector.count()
+            count = len(delivered)
+            started = time.perf_counter()
+            selector.setCurrentIndex(index)
+            self.wait_until(lambda: len(delivered) > count, "切换卡种")
+            latencies.append((self.wait_paint(viewport, delivered[-1], "切换后绘制") - started) * 1000)
+            self.pump(self.key_interval_ms)
+        self.record('switch_card_type', latencies)
+
+    def _edit_members(self, window, viewport, dialog_type):
+        """点击修改按钮打开对话框，改剩余次数后保存，测量打开和保存到表格更新的耗时"""
+        opened, saved = [], []
+        changed = []  # 表格行被修补的时间，绘制可能与修补在同一轮事件处理中完成
+        window.model.dataChanged.connect(lambda *_: changed.append(time.perf_counter()))
+        window.model.rowsInserted.connect(lambda *_: changed.append(time.perf_counter()))
+        for row in range(min(self.edits, window.model.rowCount())):
+            member = window.model.member_at(row)
+            times = (member['remaining_times'] + 1) % 100
+            save_started = []
+
+            def fill_and_save(dialog, shown_at):
+                if not isinstance(dialog, dialog_type):
+                    return
+                opened.append((shown_at - started) * 1000)
+                dialog.times_spin.setValue(times)
+                save_started.append(time.perf_counter())
+                dialog.accept()
+
+            def saved_row():
+                position = window.model.row_of(member['phone'])
+                return position >= 0 and window.model.member_at(position)['remaining_times'] == times
+
+            self.probe.on_dialog = fill_and_save
+            started = time.perf_counter()
+            window.on_edit(row)  # 与点击该行的修改按钮相同
+            self.wait_until(lambda: save_started and saved_row(), "保存后的表格更新")
+            saved.append((self.wait_paint(viewport, changed[-1], "保存后绘制") - save_started[0]) * 1000)
+            self.probe.on_dialog = None
+            self.pump(self.key_interval_ms)
+        self.record('edit_open', opened)
+        self.record('edit_save', saved)
+
+
+def run_child(args):
+    """子进程: 在临时目录中跑一个规模，结果写入args.result"""
+    workdir = tempfile.mkdtemp(prefix=f'barbershop-gui-bench-{args.size}-')
+    cwd = os.getcwd()
+    try:
+        os.chdir(workdir)
+        benchmark = GuiBenchmark(args.size, args.seed, args.queries, args.switches, args.edits,
+                                 args.key_interval_ms, args.stall_threshold_ms)
+        results = benchmark.run()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    with open(args.result, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='在offscreen平台上测量会员管理界面的绘制、输入和编辑响应')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='逗号分隔的会员总数，默认 1000,10000,100000,1000000')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--queries', type=int, default=3, help='每种搜索输入的次数')
+    parser.add_argument('--switches', type=int, default=4, help='切换卡种的次数')
+    parser.add_argument('--edits', type=int, default=5, help='打开并保存编辑的次数')
+    parser.add_argument('--key-interval-ms', type=int, default=80, help='模拟打字的按键间隔')
+    parser.add_argument('--stall-threshold-ms', type=int, default=50, help='事件循环间隔超过该值记为卡顿')
+    add_report_arguments(parser, 'gui_benchmark_results.json', 'gui_benchmark_baseline.json')
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)  # 子进程内部使用
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.size is not None:
+        return run_child(args)
+
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    results = {}
+    for size in sizes:
+        print(f"\n== {size} 行 ==")
+        fd, result_path = tempfile.mkstemp(prefix='gui-bench-', suffix='.json')
+        os.close(fd)
+        try:
+            command = [sys.executable, os.path.abspath(__file__), '--size', str(size), '--result', result_path,
+                       '--seed', str(args.seed), '--queries', str(args.queries),
+                       '--switches', str(args.switches), '--edits', str(args.edits),
+                       '--key-interval-ms', str(args.key_interval_ms),
+                       '--stall-threshold-ms', str(args.stall_threshold_ms)]
+            env = dict(os.environ, QT_QPA_PLATFORM='offscreen',
+                       PYTHONPATH=os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                                os.environ.get('PYTHONPATH')])))
+            completed = subprocess.run(command, env=env)
+            if completed.returncode:
+                print(f"{size} 行的界面测试失败(退出码 {completed.returncode})")
+                results[str(size)] = {'failed': {'returncode': completed.returncode}}
+                continue
+            with open(result_path, encoding='utf-8') as f:
+                results[str(size)] = json.load(f)
+        finally:
+            os.remove(result_path)
+        stalls = results[str(size)]['event_loop_stalls']
+        memory = results[str(size)]['memory']
+        print(f"  卡顿 {stalls['count']}次，共{stalls['total_ms']} ms，最长{stalls['longest_ms']} ms；"
+              f"峰值内存 {memory['peak_rss_mb']} MB")
+
+    current = {
+        'format': RESULT_FORMAT,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(),
+                    'processor': platform.processor() or platform.machine()},
+        'sizes': sizes,
+        'settings': {'seed': args.seed, 'queries': args.queries, 'switches': args.switches,
+                     'edits': args.edits, 'key_interval_ms': args.key_interval_ms,
+                     'stall_threshold_ms': args.stall_threshold_ms},
+        'results': results,
+    }
+    code = finish(current, args)
+    return code or int(any('failed' in ops for ops in results.values()))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
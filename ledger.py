@@ -0,0 +1,243 @@
+from contextlib import contextmanager
+
+LEDGER_TABLE = 'member_ledger'
+STATE_TABLE = 'ledger_state'  # 一行：当前是否记录流水、是否即时汇总
+DAILY_TABLE = 'ledger_daily'  # 每天每种卡的汇总
+MONTHLY_TABLE = 'ledger_member_monthly'  # 每月每位会员的汇总
+SUMMARY_COLUMNS = ['visits', 'times_used', 'times_added', 'balance_spent', 'balance_added']
+RANKINGS = ('visits', 'times_used', 'balance_spent', 'balance_added')
+# 记录模式：正常记录并即时汇总；暂停(批量导入、Excel合并、分店同步不是当天的消费)；
+# 只记流水、汇总推迟到批量修改结束后一次完成
+MODE_ON, MODE_SUSPENDED, MODE_DEFERRED = 0, 1, 2
+_MODE = f"(SELECT mode FROM {STATE_TABLE} WHERE id = 1)"
+
+# 一条流水对各汇总列的贡献：扣次数或扣余额算一次到店
+_CONTRIBUTIONS = {
+    'visits': "(new.delta_times < 0 OR new.delta_balance < 0)",
+    'times_used': "max(-new.delta_times, 0)",
+    'times_added': "max(new.delta_times, 0)",
+    'balance_spent': "max(-new.delta_balance, 0)",
+    'balance_added': "max(new.delta_balance, 0)",
+}
+
+
+class Ledger:
+    """消费流水：会员剩余次数和余额的每次变化追加一条记录，并增量维护汇总表
+
+    流水由会员表上的触发器写入，与修改会员处在同一个事务中；
+    报表只查询汇总表，不扫描流水。批量载入数据时用suspended()暂停记录，
+    批量修改时用deferred()把逐行汇总合并为一次。
+    """
+
+    def __init__(self, table):
+        self.table = table  # 会员表
+
+    def install(self, conn):
+        """创建流水表、汇总表和触发器，需在写事务中调用"""
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {LEDGER_TABLE} (
+            id INTEGER PRIMARY KEY,
+            phone TEXT NOT NULL,
+            card_type TEXT NOT NULL,
+            delta_times INTEGER NOT NULL,
+            delta_balance INTEGER NOT NULL,
+            ts INTEGER NOT NULL
+        )
+        """)
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{LEDGER_TABLE}_phone_ts "
+                     f"ON {LEDGER_TABLE} (phone, ts)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{LEDGER_TABLE}_ts ON {LEDGER_TABLE} (ts)")
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            mode INTEGER NOT NULL DEFAULT {MODE_ON}
+        )
+        """)
+        conn.execute(f"INSERT OR IGNORE INTO {STATE_TABLE} (id) VALUES (1)")
+
+        summary = ',\n            '.join(f"{column} INTEGER NOT NULL DEFAULT 0"
+                                         for column in SUMMARY_COLUMNS)
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {DAILY_TABLE} (
+            day TEXT NOT NULL,
+            card_type TEXT NOT NULL,
+            {summary},
+            PRIMARY KEY (day, card_type)
+        ) WITHOUT ROWID
+        """)
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {MONTHLY_TABLE} (
+            month TEXT NOT NULL,
+            card_type TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            {summary},
+            PRIMARY KEY (month, card_type, phone)
+        ) WITHOUT ROWID
+        """)
+        for column in RANKINGS:
+            # 排行榜按索引顺序读取前N名
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{MONTHLY_TABLE}_{column} "
+                         f"ON {MONTHLY_TABLE} (month, card_type, {column} DESC)")
+
+        self._install_summary_trigger(conn)
+        self._install_member_triggers(conn)
+
+    def _install_summary_trigger(self, conn):
+        values = ', '.join(_CONTRIBUTIONS[column] for column in SUMMARY_COLUMNS)
+        updates = ', '.join(f"{column} = {column} + excluded.{column}" for column in SUMMARY_COLUMNS)
+        columns = ', '.join(SUMMARY_COLUMNS)
+        # 旧版触发器没有记录模式的条件，重新创建
+        conn.execute(f"DROP TRIGGER IF EXISTS {LEDGER_TABLE}_summary")
+        conn.execute(f"""
+        CREATE TRIGGER {LEDGER_TABLE}_summary AFTER INSERT ON {LEDGER_TABLE}
+        WHEN {_MODE} = {MODE_ON} BEGIN
+            INSERT INTO {DAILY_TABLE} (day, card_type, {columns})
+            VALUES (date(new.ts, 'unixepoch', 'localtime'), new.card_type, {values})
+            ON CONFLICT (day, card_type) DO UPDATE SET {updates};
+            INSERT INTO {MONTHLY_TABLE} (month, card_type, phone, {columns})
+            VALUES (strftime('%Y-%m', new.ts, 'unixepoch', 'localtime'), new.card_type, new.phone, {values})
+            ON CONFLICT (month, card_type, phone) DO UPDATE SET {updates};
+        END
+        """)
+        # 流水只追加，不允许改写历史
+        for action in ('UPDATE', 'DELETE'):
+            conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {LEDGER_TABLE}_no_{action.lower()}
+            BEFORE {action} ON {LEDGER_TABLE} BEGIN
+                SELECT RAISE(ABORT, '消费流水只能追加，不能修改或删除');
+            END
+            """)
+
+    def _install_member_triggers(self, conn):
+        table = self.table
+        now = "CAST(strftime('%s', 'now') AS INTEGER)"
+        recording = f"{_MODE} != {MODE_SUSPENDED}"
+        for trigger in ('insert', 'update'):
+            conn.execute(f"DROP TRIGGER IF EXISTS {table}_ledger_{trigger}")
+        conn.execute(f"""
+        CREATE TRIGGER {table}_ledger_insert AFTER INSERT ON {table}
+        WHEN {recording} AND (new.remaining_times != 0 OR new.balance != 0) BEGIN
+            INSERT INTO {LEDGER_TABLE} (phone, card_type, delta_times, delta_balance, ts)
+            VALUES (new.phone, new.card_type, new.remaining_times, new.balance, {now});
+        END
+        """)
+        conn.execute(f"""
+        CREATE TRIGGER {table}_ledger_update
+        AFTER UPDATE OF remaining_times, balance ON {table}
+        WHEN {recording} AND (new.remaining_times != old.remaining_times OR new.balance != old.balance) BEGIN
+            INSERT INTO {LEDGER_TABLE} (phone, card_type, delta_times, delta_balance, ts)
+            VALUES (new.phone, new.card_type, new.remaining_times - old.remaining_times,
+                    new.balance - old.balance, {now});
+        END
+        """)
+
+    @staticmethod
+    @contextmanager
+    def suspended(conn):
+        """块内的会员改动不记流水，用于批量导入、Excel合并和分店同步，需在写事务中调用"""
+        with Ledger._switch(conn, MODE_SUSPENDED):
+            yield
+
+    @staticmethod
+    @contextmanager
+    def deferred(conn):
+        """块内照常记流水，但汇总表在块结束时按新增流水一次更新，需在写事务中调用"""
+        first_id = conn.execute(f"SELECT coalesce(max(id), 0) + 1 FROM {LEDGER_TABLE}").fetchone()[0] \
+            if Ledger._current_mode(conn) == MODE_ON else None
+        with Ledger._switch(conn, MODE_DEFERRED):
+            yield
+        if first_id is not None:
+            Ledger._summarize(conn, first_id)
+
+    @staticmethod
+    def _current_mode(conn):
+        # 还没有由主程序安装流水表的数据库返回None
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                            (STATE_TABLE,)).fetchone():
+            return None
+        return conn.execute(f"SELECT mode FROM {STATE_TABLE} WHERE id = 1").fetchone()[0]
+
+    @staticmethod
+    @contextmanager
+    def _switch(conn, mode):
+        # 与会员改动在同一事务中切换并恢复，其他连接看不到中间状态；
+        # 已暂停时保持暂停，嵌套的同一模式不重复切换
+        previous = Ledger._current_mode(conn)
+        if previous in (None, mode, MODE_SUSPENDED):
+            yield
+            return
+        conn.execute(f"UPDATE {STATE_TABLE} SET mode = ? WHERE id = 1", (mode,))
+        try:
+            yield
+        finally:
+            conn.execute(f"UPDATE {STATE_TABLE} SET mode = ? WHERE id = 1", (previous,))
+
+    def rebuild_summaries(self, conn):
+        """按流水重新计算全部汇总表，需在写事务中调用"""
+        conn.execute(f"DELETE FROM {DAILY_TABLE}")
+        conn.execute(f"DELETE FROM {MONTHLY_TABLE}")
+        self._summarize(conn, 0)
+
+    @staticmethod
+    def _summarize(conn, first_id):
+        """把id不小于first_id的流水累加进汇总表"""
+        columns = ', '.join(SUMMARY_COLUMNS)
+        sums = ', '.join(f"sum({_CONTRIBUTIONS[column].replace('new.', '')})"
+                         for column in SUMMARY_COLUMNS)
+        updates = ', '.join(f"{column} = {column} + excluded.{column}" for column in SUMMARY_COLUMNS)
+        conn.execute(f"""
+        INSERT INTO {DAILY_TABLE} (day, card_type, {columns})
+        SELECT date(ts, 'unixepoch', 'localtime') AS day, card_type, {sums}
+        FROM {LEDGER_TABLE} WHERE id >= ? GROUP BY day, card_type
+        ON CONFLICT (day, card_type) DO UPDATE SET {updates}
+        """, (first_id,))
+        conn.execute(f"""
+        INSERT INTO {MONTHLY_TABLE} (month, card_type, phone, {columns})
+        SELECT strftime('%Y-%m', ts, 'unixepoch', 'localtime') AS month, card_type, phone, {sums}
+        FROM {LEDGER_TABLE} WHERE id >= ? GROUP BY month, card_type, phone
+        ON CONFLICT (month, card_type, phone) DO UPDATE SET {updates}
+        """, (first_id,))
+
+    @staticmethod
+    def history(conn, phone, card_type=None, limit=100):
+        """某位会员最近的流水: [(卡类型, 次数变化, 余额变化, 时间)]，新的在前"""
+        sql = (f"SELECT card_type, delta_times, delta_balance, "
+               f"datetime(ts, 'unixepoch', 'localtime') FROM {LEDGER_TABLE} WHERE phone = ?")
+        params = [phone]
+        if card_type:
+            sql += " AND card_type = ?"
+            params.append(card_type)
+        sql += " ORDER BY ts DESC, id DESC LIMIT ?"
+        return conn.execute(sql, params + [limit]).fetchall()
+
+    @staticmethod
+    def daily(conn, start_day, end_day, card_type=None):
+        """按天汇总，日期格式YYYY-MM-DD，包含首尾两天"""
+        sql = f"SELECT day, card_type, {', '.join(SUMMARY_COLUMNS)} FROM {DAILY_TABLE} WHERE day BETWEEN ? AND ?"
+        params = [start_day, end_day]
+        if card_type:
+            sql += " AND card_type = ?"
+            params.append(card_type)
+        return conn.execute(sql + " ORDER BY day, card_type", params).fetchall()
+
+    @staticmethod
+    def totals(conn, start_day, end_day, card_type=None):
+        """一段时间内的合计，如本月到店次数"""
+        sql = (f"SELECT {', '.join(f'coalesce(sum({column}), 0)' for column in SUMMARY_COLUMNS)} "
+               f"FROM {DAILY_TABLE} WHERE day BETWEEN ? AND ?")
+        params = [start_day, end_day]
+        if card_type:
+            sql += " AND card_type = ?"
+            params.append(card_type)
+        return dict(zip(SUMMARY_COLUMNS, conn.execute(sql, params).fetchone()))
+
+    @staticmethod
+    def top_members(conn, month, card_type, by='visits', limit=10):
+        """某月某种卡的会员排行: [(手机号, 汇总值...)]，month格式YYYY-MM"""
+        if by not in RANKINGS:
+            raise ValueError(f"不支持的排行方式: {by}")
+        return conn.execute(f"""
+        SELECT phone, {', '.join(SUMMARY_COLUMNS)} FROM {MONTHLY_TABLE}
+        WHERE month = ? AND card_type = ? AND {by} > 0
+        ORDER BY {by} DESC LIMIT ?
+        """, (month, card_type, limit)).fetchall()
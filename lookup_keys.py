@@ -0,0 +1,76 @@
+# GB2312一级汉字按拼音排序，每个声母对应一段连续编码
+_GB2312_INITIALS = [
+    (0xB0A1, 'a'), (0xB0C5, 'b'), (0xB2C1, 'c'), (0xB4EE, 'd'), (0xB6EA, 'e'),
+    (0xB7A2, 'f'), (0xB8C1, 'g'), (0xB9FE, 'h'), (0xBBF7, 'j'), (0xBFA6, 'k'),
+    (0xC0AC, 'l'), (0xC2E8, 'm'), (0xC4C3, 'n'), (0xC5B6, 'o'), (0xC5BE, 'p'),
+    (0xC6DA, 'q'), (0xC8BB, 'r'), (0xC8F6, 's'), (0xCBFA, 't'), (0xCDDA, 'w'),
+    (0xCEF4, 'x'), (0xD1B9, 'y'), (0xD4D1, 'z'),
+]
+_GB2312_LEVEL1_END = 0xD7F9
+
+# 姓名中常见但不在GB2312一级字库内的字
+_COMMON_NAME_INITIALS = {
+    '闫': 'y', '楠': 'n', '琪': 'q', '璐': 'l', '婷': 't', '昊': 'h', '晗': 'h', '泓': 'h',
+    '钰': 'y', '萱': 'x', '睿': 'r', '宸': 'c', '梓': 'z', '皓': 'h', '煜': 'y', '瑾': 'j',
+    '瑜': 'y', '琦': 'q', '珂': 'k', '玥': 'y', '玮': 'w', '琛': 'c', '璇': 'x', '祺': 'q',
+    '骞': 'q', '烨': 'y', '炜': 'w', '晟': 's', '昕': 'x', '旻': 'm', '曦': 'x', '翊': 'y',
+    '鑫': 'x', '淼': 'm', '焱': 'y', '垚': 'y', '犇': 'b', '骁': 'x', '骐': 'q', '麒': 'q',
+    '麟': 'l', '蔺': 'l', '邝': 'k', '郗': 'x', '亓': 'q', '邬': 'w', '缪': 'm', '佟': 't',
+    '滕': 't', '昱': 'y', '晖': 'h', '珏': 'j', '珺': 'j', '璟': 'j', '瑛': 'y', '琰': 'y',
+    '琬': 'w', '钊': 'z', '锴': 'k', '铮': 'z', '婧': 'j', '婕': 'j', '媛': 'y', '嫣': 'y',
+    '娅': 'y', '妍': 'y', '姝': 's', '娴': 'x', '倩': 'q', '芮': 'r', '菁': 'j', '茜': 'q',
+    '芊': 'q', '苒': 'r', '蓓': 'b', '薇': 'w', '筠': 'y', '箐': 'q', '覃': 'q',
+}
+
+# 作姓氏时读音特殊的多音字
+_SURNAME_INITIALS = {
+    '单': 's', '曾': 'z', '解': 'x', '区': 'o', '朴': 'p', '仇': 'q', '查': 'z',
+    '乐': 'y', '尉': 'y', '覃': 'q',
+}
+
+UNKNOWN_INITIAL = '?'  # 无法确定拼音的字符
+
+
+def reverse_phone(phone):
+    """手机号倒序存储，尾号查询就变成了前缀查询"""
+    return str(phone)[::-1]
+
+
+def char_initial(char):
+    """单个字符的拼音首字母，英文字母和数字原样返回"""
+    if char.isascii():
+        return char.lower() if char.isalnum() else ''
+    if char in _COMMON_NAME_INITIALS:
+        return _COMMON_NAME_INITIALS[char]
+    try:
+        code = int.from_bytes(char.encode('gb2312'), 'big')
+    except UnicodeEncodeError:
+        return UNKNOWN_INITIAL
+    if code > _GB2312_LEVEL1_END:
+        # 二级汉字按部首排序，无法从编码推出拼音
+        return UNKNOWN_INITIAL
+    initial = UNKNOWN_INITIAL
+    for start, letter in _GB2312_INITIALS:
+        if code < start:
+            break
+        initial = letter
+    return initial
+
+
+def pinyin_initials(name):
+    """姓名的拼音首字母串，例如 张三 -> zs"""
+    name = str(name)
+    if not name:
+        return ''
+    first = _SURNAME_INITIALS.get(name[0]) or char_initial(name[0])
+    return first + ''.join(char_initial(char) for char in name[1:])
+
+
+def lookup_values(name, phone):
+    """插入或更新会员时需要一并写入的查找列"""
+    return reverse_phone(phone), pinyin_initials(name)
+
+
+def prefix_range(prefix):
+    """前缀查询转换成可以走索引的区间 [low, high)"""
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
@@ -1,29 +1,83 @@
+import time
+_STARTED = time.perf_counter()  # 在导入其他模块之前计时，导入耗时也计入启动报告
+
 import sys
 import os
+import argparse
+from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import QApplication
 from member_ui import MemberManagementUI
 from database_manager import DatabaseManager
 from backup_manager import BackupManager
+from remote_database import RemoteDatabase
+from db_service import DatabaseService
+from startup_timer import StartupTimer
+from metrics import METRICS
 
 def main():
+    timer = StartupTimer(started=_STARTED)
+    timer.mark("导入模块")
+
+    parser = argparse.ArgumentParser(description='理发店会员管理系统')
+    parser.add_argument('--server', help='作为瘦客户端连接会员服务，如 http://127.0.0.1:8765')
+    args, qt_args = parser.parse_known_args()
+
     # 确保数据库目录存在
     os.makedirs('database', exist_ok=True)
 
     # 初始化应用
-    app = QApplication(sys.argv)
+    app = QApplication(sys.argv[:1] + qt_args)
+    timer.mark("创建应用")
+
+    backup_manager = None
+    if args.server:
+        # 数据库、Excel和备份都由服务端负责，本机只通过接口读写
+        db_manager = RemoteDatabase(args.server)
+        timer.mark("连接服务")
+    else:
+        # 创建数据库管理器(Excel没有变化时不会重写)
+        db_manager = DatabaseManager()
+        timer.mark("打开数据库")
+
+        # 创建备份管理器
+        backup_manager = BackupManager(db_manager)
 
-    # 创建数据库管理器
-    db_manager = DatabaseManager()
+        # 启动备份定时器，首次备份推迟到界面加载之后
+        backup_manager.start_backup_timer()
 
-    # 创建备份管理器
-    backup_manager = BackupManager(db_manager)
+    # 各操作的耗时统计每分钟写入 database/metrics.json，调试控制台可实时查看
+    METRICS.start_export()
 
-    # 启动备份定时器
-    backup_manager.start_backup_timer()
+    # 数据库读写在后台线程执行，界面只提交任务
+    service = DatabaseService(db_manager)
 
     # 创建并显示UI
-    window = MemberManagementUI(db_manager)
+    window = MemberManagementUI(db_manager, service)
     window.show()
+    timer.mark("创建窗口")
+
+    # 事件循环开始后的第一轮处理完成即首次绘制；首批会员数据也送达后输出启动报告
+    waiting = {"首次绘制", "载入会员列表"}
+
+    def reached(stage):
+        timer.mark(stage)
+        waiting.discard(stage)
+        if not waiting:
+            timer.report()
+
+    def on_first_results(*_):
+        window.search_pipeline.results_ready.disconnect(on_first_results)
+        reached("载入会员列表")
+
+    QTimer.singleShot(0, lambda: reached("首次绘制"))
+    window.search_pipeline.results_ready.connect(on_first_results)
+
+    # 退出时等待后台备份和尚未完成的写操作结束，再关闭数据库连接
+    if backup_manager is not None:
+        app.aboutToQuit.connect(backup_manager.shutdown)
+    app.aboutToQuit.connect(service.shutdown)
+    app.aboutToQuit.connect(METRICS.stop_export)
+    app.aboutToQuit.connect(db_manager.close)
 
     # 执行应用
     sys.exit(app.exec_())
@@ -0,0 +1,140 @@
+import threading
+from collections import OrderedDict
+from member_store import MemberColumns
+
+
+class MemberCache:
+    """会员内存缓存：完整载入的卡种按列存储，其余卡种是 手机号 -> 会员记录 的有界LRU映射"""
+
+    def __init__(self, max_entries=2000000, max_lookups=20000):
+        self.max_entries = max_entries  # 每种卡最多整表缓存的会员数，列存储每人约15字节
+        self.max_lookups = max_lookups  # 未整表载入时，单条查询最多缓存的会员数
+        self.hits = 0
+        self.misses = 0
+        self._columns = {}  # 完整载入的卡种 -> MemberColumns(按加入顺序)
+        self._tables = {}  # 其余卡种 -> OrderedDict(手机号 -> 元组)
+        self._versions = {}  # 卡种 -> 修改次数，用于丢弃回源期间已过期的结果
+        self._epoch = 0  # 整体失效的次数
+        self._lock = threading.RLock()
+
+    def version(self, card_type):
+        """回源查询前记下版本号，写回缓存时用来判断期间有没有修改"""
+        with self._lock:
+            return self._epoch, self._versions.get(card_type, 0)
+
+    def _bump(self, card_type):
+        self._versions[card_type] = self._versions.get(card_type, 0) + 1
+
+    def load(self, card_type, members, version=None):
+        """整个卡种批量载入；members可以是元组列表或MemberColumns，超出上限时不缓存"""
+        columns = members if isinstance(members, MemberColumns) else MemberColumns(members)
+        with self._lock:
+            if version is not None and version != self.version(card_type):
+                return
+            self._tables.pop(card_type, None)
+            if len(columns) > self.max_entries:
+                self._columns.pop(card_type, None)
+                return
+            self._columns[card_type] = columns
+
+    def columns(self, card_type):
+        """返回整表列存储的副本；未完整载入时返回None，调用方需回源查询"""
+        with self._lock:
+            columns = self._columns.get(card_type)
+            if columns is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return columns.take(range(len(columns)))
+
+    def all(self, card_type):
+        """返回整表数据；未完整载入时返回None，调用方需回源查询"""
+        with self._lock:
+            columns = self._columns.get(card_type)
+            if columns is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return columns.rows()
+
+    def get(self, card_type, phone):
+        """按手机号取会员记录，未命中返回None"""
+        with self._lock:
+            columns = self._columns.get(card_type)
+            if columns is not None:
+                row = columns.find(phone)
+                member = columns[row] if row >= 0 else None
+            else:
+                entries = self._tables.get(card_type)
+                member = entries.get(phone) if entries is not None else None
+                if member is not None:
+                    entries.move_to_end(phone)
+            if member is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return member
+
+    def put(self, card_type, member, version=None):
+        """写入或替换一条记录；给出version时只在期间没有修改过才写入"""
+        with self._lock:
+            if version is not None:
+                if version != self.version(card_type):
+                    return
+            else:
+                self._bump(card_type)
+            columns = self._columns.get(card_type)
+            if columns is not None:
+                row = columns.find(member[1])
+                if row >= 0:
+                    columns.update(row, member)
+                elif len(columns) < self.max_entries:
+                    columns.append(member)
+                else:
+                    # 超出上限，整表缓存失效
+                    del self._columns[card_type]
+                return
+            entries = self._tables.setdefault(card_type, OrderedDict())
+            entries[member[1]] = tuple(member)
+            entries.move_to_end(member[1])
+            while len(entries) > self.max_lookups:
+                # 淘汰最久未使用的记录
+                entries.popitem(last=False)
+
+    def remove(self, card_type, phone):
+        with self._lock:
+            self._bump(card_type)
+            columns = self._columns.get(card_type)
+            if columns is not None:
+                row = columns.find(phone)
+                if row >= 0:
+                    columns.delete(row)
+            entries = self._tables.get(card_type)
+            if entries is not None:
+                entries.pop(phone, None)
+
+    def invalidate(self, card_type=None):
+        """清空某种卡或全部缓存，数据被整体替换时调用"""
+        with self._lock:
+            if card_type is None:
+                self._epoch += 1
+                self._tables.clear()
+                self._columns.clear()
+            else:
+                self._bump(card_type)
+                self._tables.pop(card_type, None)
+                self._columns.pop(card_type, None)
+
+    def stats(self):
+        """命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            entries = {card_type: len(entries) for card_type, entries in self._tables.items()}
+            entries.update({card_type: len(columns) for card_type, columns in self._columns.items()})
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'entries': entries,
+                'column_bytes': sum(columns.nbytes for columns in self._columns.values()),
+            }
@@ -0,0 +1,334 @@
+import re
+import threading
+import numpy as np
+from lookup_keys import pinyin_initials
+
+PHONE_DIGITS = 11  # 手机号固定11位，按整数存储，显示时补齐前导零
+_PACKED_PHONE = re.compile(f'[0-9]{{{PHONE_DIGITS}}}')
+_MISSING = np.iinfo(np.int64).min  # 查找不存在的手机号时用的键，不会与任何一行相同
+
+
+class NamePool:
+    """姓名驻留池：相同的姓名只存一份，会员只记编号
+
+    按姓名过滤时只需对不重复的姓名计算一次，再按编号展开到所有会员。
+    """
+
+    def __init__(self):
+        self.names = []
+        self._codes = {}
+        self._lock = threading.Lock()
+        self._folded = None  # 小写后的姓名数组，按需构建
+        self._initials = None  # 拼音首字母数组
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name):
+        code = self._codes.get(name)
+        if code is None:
+            with self._lock:
+                code = self._codes.get(name)
+                if code is None:
+                    code = len(self.names)
+                    self.names.append(name)
+                    self._codes[name] = code
+        return code
+
+    def code(self, name):
+        """已驻留的编号，没有时返回None"""
+        return self._codes.get(name)
+
+    def _extended(self, cached, convert):
+        """姓名只增不减，缓存的数组只需补上新增的部分"""
+        count = len(self.names)
+        done = 0 if cached is None else len(cached)
+        if done == count:
+            return cached
+        added = np.array([convert(name) for name in self.names[done:count]],
+                         dtype=np.dtypes.StringDType())
+        return added if cached is None else np.concatenate([cached, added])
+
+    def folded(self):
+        """小写后的姓名数组，下标即姓名编号"""
+        self._folded = self._extended(self._folded, str.casefold)
+        return self._folded
+
+    def initials(self):
+        """拼音首字母数组，下标即姓名编号"""
+        self._initials = self._extended(self._initials, pinyin_initials)
+        return self._initials
+
+
+# 进程内共用一个驻留池，不同卡种和视图里的同名会员共享同一份姓名
+NAMES = NamePool()
+# 旧数据里不是11位数字的手机号无法按整数存储，驻留在这里，列中存负数 -(编号+1)
+ODD_PHONES = NamePool()
+
+
+class MemberColumns:
+    """按列存储的会员数据：手机号int64、剩余次数uint8、余额uint16、姓名编号int32
+
+    每位会员约15字节，而元组形式要几百字节；过滤和排序都是整列的向量运算。
+    旧数据中不是11位数字的手机号按原文保留在ODD_PHONES中，列里存负的编号。
+    行的顺序由调用方决定(加入顺序或当前排序)。按手机号查找走一份有序索引，首次查找时建立，
+    之后逐行增删改时增量维护，批量追加后才重新排序。
+    """
+
+    def __init__(self, rows=(), pool=NAMES, capacity=0, odd_phones=ODD_PHONES):
+        self.pool = pool
+        self.odd_phones = odd_phones
+        self._size = 0
+        self._phones = np.empty(capacity, dtype=np.int64)
+        self._times = np.empty(capacity, dtype=np.uint8)
+        self._balances = np.empty(capacity, dtype=np.uint16)
+        self._names = np.empty(capacity, dtype=np.int32)
+        self._by_phone = None  # 按手机号排序的行号，批量追加后失效
+        self.extend(rows)
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def nbytes(self):
+        """实际占用的数组字节数(不含共用的姓名池)"""
+        columns = (self._phones, self._times, self._balances, self._names)
+        total = sum(column.nbytes for column in columns)
+        return total + (self._by_phone.nbytes if self._by_phone is not None else 0)
+
+    @property
+    def phones(self):
+        return self._phones[:self._size]
+
+    @property
+    def remaining_times(self):
+        return self._times[:self._size]
+
+    @property
+    def balances(self):
+        return self._balances[:self._size]
+
+    @property
+    def name_codes(self):
+        return self._names[:self._size]
+
+    def _reserve(self, size):
+        if size <= len(self._phones):
+            return
+        capacity = max(size, len(self._phones) * 3 // 2, 64)
+        for attr in ('_phones', '_times', '_balances', '_names'):
+            old = getattr(self, attr)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, attr, new)
+
+    def _pack(self, member):
+        return (self.pool.intern(member[0]), self._pack_phone(member[1]),
+                int(member[2]), int(member[3]))
+
+    def _pack_phone(self, phone):
+        phone = str(phone)
+        if _PACKED_PHONE.fullmatch(phone):
+            return int(phone)
+        return -1 - self.odd_phones.intern(phone)
+
+    def _phone_key(self, phone):
+        """查找用的键，与_pack_phone一致但不驻留新的手机号"""
+        phone = str(phone)
+        if _PACKED_PHONE.fullmatch(phone):
+            return int(phone)
+        code = self.odd_phones.code(phone)
+        return _MISSING if code is None else -1 - code
+
+    def _phone_text(self, value):
+        if value < 0:
+            return self.odd_phones.names[-1 - value]
+        return f"{value:0{PHONE_DIGITS}d}"
+
+    def extend(self, rows):
+        """在末尾追加一批(姓名, 手机号, 剩余次数, 余额)"""
+        packed = [self._pack(member) for member in rows]
+        if not packed:
+            return
+        start, end = self._size, self._size + len(packed)
+        self._reserve(end)
+        names, phones, times, balances = zip(*packed)
+        self._names[start:end] = names
+        self._phones[start:end] = phones
+        self._times[start:end] = times
+        self._balances[start:end] = balances
+        self._size = end
+        self._by_phone = None
+
+    def append(self, member):
+        self.insert(self._size, member)
+
+    def insert(self, row, member):
+        """在指定位置插入一行，之后的行整体后移"""
+        name, phone, times, balance = self._pack(member)
+        position = self._index_insert_position(phone)
+        self._reserve(self._size + 1)
+        for column, value in ((self._names, name), (self._phones, phone),
+                              (self._times, times), (self._balances, balance)):
+            column[row + 1:self._size + 1] = column[row:self._size]
+            column[row] = value
+        self._size += 1
+        if self._by_phone is not None:
+            self._by_phone += self._by_phone >= row
+            self._by_phone = np.insert(self._by_phone, position, row)
+
+    def update(self, row, member):
+        name, phone, times, balance = self._pack(member)
+        if phone != self._phones[row] and self._by_phone is not None:
+            # 在索引中把这一行从旧手机号的位置移到新手机号的位置
+            old, new = self._index_position(row), self._index_insert_position(phone)
+            index = np.delete(self._by_phone, old)
+            self._by_phone = np.insert(index, new - 1 if new > old else new, row)
+        self._names[row] = name
+        self._phones[row] = phone
+        self._times[row] = times
+        self._balances[row] = balance
+
+    def delete(self, row):
+        """删除一行，之后的行整体前移"""
+        if self._by_phone is not None:
+            self._by_phone = np.delete(self._by_phone, self._index_position(row))
+            self._by_phone -= self._by_phone > row
+        for column in (self._names, self._phones, self._times, self._balances):
+            column[row:self._size - 1] = column[row + 1:self._size]
+        self._size -= 1
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += self._size
+        if not 0 <= row < self._size:
+            raise IndexError(row)
+        return (self.pool.names[self._names[row]], self._phone_text(int(self._phones[row])),
+                int(self._times[row]), int(self._balances[row]))
+
+    def value(self, row, column):
+        """单个单元格的值，显示时不必组装整行"""
+        if column == 0:
+            return self.pool.names[self._names[row]]
+        if column == 1:
+            return self._phone_text(int(self._phones[row]))
+        if column == 2:
+            return int(self._times[row])
+        return int(self._balances[row])
+
+    def rows(self, positions=None):
+        """取出为元组列表，positions为行号数组，默认全部"""
+        if positions is None:
+            positions = range(self._size)
+        return [self[int(row)] for row in positions]
+
+    def take(self, positions):
+        """按行号取出一个新的列存储，顺序与positions一致"""
+        subset = MemberColumns(pool=self.pool, odd_phones=self.odd_phones)
+        positions = np.asarray(positions, dtype=np.int64)
+        subset._phones = self.phones[positions]
+        subset._times = self.remaining_times[positions]
+        subset._balances = self.balances[positions]
+        subset._names = self.name_codes[positions]
+        subset._size = len(positions)
+        return subset
+
+    def _phone_index(self):
+        if self._by_phone is None:
+            self._by_phone = np.argsort(self.phones, kind='stable')
+        return self._by_phone
+
+    # 逐行增删改时索引只做二分查找和整列移动，不重新排序
+    def _index_insert_position(self, phone):
+        """新手机号在索引中的插入位置，需在改动各列之前调用"""
+        if self._by_phone is None:
+            return None
+        return int(np.searchsorted(self.phones, phone, side='right', sorter=self._by_phone))
+
+    def _index_position(self, row):
+        """某一行在索引中的位置"""
+        index, key = self._by_phone, self._phones[row]
+        low = np.searchsorted(self.phones, key, side='left', sorter=index)
+        high = np.searchsorted(self.phones, key, side='right', sorter=index)
+        return int(low + np.flatnonzero(index[low:high] == row)[0])
+
+    def find(self, phone):
+        """按手机号查找行号，不存在返回-1"""
+        if phone is None:
+            return -1
+        key = self._phone_key(phone)
+        index = self._phone_index()
+        position = np.searchsorted(self.phones, key, sorter=index)
+        if position < self._size and self._phones[index[position]] == key:
+            return int(index[position])
+        return -1
+
+    def contains(self, phones):
+        """一批手机号中哪些已存在，返回布尔数组"""
+        keys = np.fromiter((self._phone_key(phone) for phone in phones), dtype=np.int64)
+        return np.isin(keys, self.phones)
+
+    def filter(self, text):
+        """向量化过滤，规则与search_worker.matches_search一致，返回符合条件的行号"""
+        text = text.strip()
+        if not text:
+            return np.arange(self._size)
+        if re.fullmatch(r'[0-9]{4}', text):
+            mask = (self.phones >= 0) & (self.phones % 10 ** len(text) == int(text))
+            return np.flatnonzero(mask | self._odd_matches(lambda phones: np.strings.endswith(phones, text)))
+        if re.fullmatch(r'[A-Za-z]+', text):
+            names = np.strings.startswith(self.pool.initials(), text.lower())
+            return np.flatnonzero(names[self.name_codes])
+
+        needle = text.casefold()
+        names = np.strings.find(self.pool.folded(), needle) >= 0
+        mask = names[self.name_codes] | self._odd_matches(lambda phones: np.strings.find(phones, needle) >= 0)
+        if needle.isascii() and needle.isdigit() and len(needle) <= PHONE_DIGITS:
+            # 在11位定长的手机号里逐个位置比较，不需要转成字符串
+            width, value = 10 ** len(needle), int(needle)
+            packed = self.phones >= 0
+            for shift in range(PHONE_DIGITS - len(needle) + 1):
+                mask |= packed & ((self.phones // 10 ** shift) % width == value)
+        return np.flatnonzero(mask)
+
+    def _odd_matches(self, test):
+        """对按原文保存的手机号逐个判断，返回每行是否符合；这样的行通常没有或极少"""
+        phones = self.phones
+        odd = phones < 0
+        if not odd.any():
+            return odd
+        hits = test(np.array(self.odd_phones.names, dtype=np.dtypes.StringDType()))
+        odd[odd] = hits[-1 - phones[odd]]
+        return odd
+
+    def _phone_order(self, positions):
+        """排序用的手机号键：都按整数存储时就是手机号本身，否则按文本排出名次"""
+        phones = self.phones[positions]
+        if not (phones < 0).any():
+            return phones
+        texts = np.array([self._phone_text(int(phone)) for phone in phones], dtype=np.dtypes.StringDType())
+        return np.unique(texts, return_inverse=True)[1]
+
+    def order(self, field=None, descending=False, positions=None):
+        """向量化排序，手机号打破并列，与数据库的ORDER BY一致；返回行号"""
+        if positions is None:
+            positions = np.arange(self._size)
+        if field is None:
+            return positions
+        phones = self._phone_order(positions)
+        if field == 'phone':
+            keys = (phones,)
+        elif field == 'name':
+            # 姓名按字符串排序，先对不重复的姓名排出名次
+            names = np.array(self.pool.names, dtype=np.dtypes.StringDType())
+            rank = np.empty(len(names), dtype=np.int64)
+            rank[np.argsort(names, kind='stable')] = np.arange(len(names))
+            keys = (phones, rank[self.name_codes[positions]])
+        elif field == 'remaining_times':
+            keys = (phones, self.remaining_times[positions])
+        elif field == 'balance':
+            keys = (phones, self.balances[positions])
+        else:
+            raise ValueError(f"不支持的排序列: {field}")
+        ordered = positions[np.lexsort(keys)]
+        return ordered[::-1] if descending else ordered
@@ -0,0 +1,225 @@
+from PyQt5.QtWidgets import QStyledItemDelegate, QStyleOptionButton, QStyle, QApplication
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QVariant, QEvent, pyqtSignal
+from PyQt5.QtGui import QColor
+from member_store import MemberColumns
+
+HEADERS = ["姓名", "手机号", "剩余次数", "余额", "操作"]
+FIELDS = ['name', 'phone', 'remaining_times', 'balance']
+ACTION_COLUMN = 4
+ACTION_TEXT = "修改"
+
+
+class MemberTableModel(QAbstractTableModel):
+    """会员列表模型：按需分批交给视图，不为每行创建控件
+
+    列表来自数据库分页时，滚动到底部会发出more_requested请求下一页；
+    点击表头发出sort_requested，由数据库排序后重新分页。
+    """
+
+    more_requested = pyqtSignal(object)  # 下一页游标
+    sort_requested = pyqtSignal(object, bool)  # 排序列(None表示默认顺序), 是否降序
+
+    def __init__(self, batch_size=200, parent=None):
+        super().__init__(parent)
+        self.batch_size = batch_size
+        self.sort_field = None
+        self.descending = False
+        self._members = MemberColumns()  # 查询结果按列存储，滚动翻到几十万行也不占太多内存
+        self._loaded = 0  # 已交给视图的行数
+        self._cursor = None  # 数据库中下一页的游标，None表示已全部取回
+        self._fetching = False
+        self._alt_color = QColor('#eaeaea')
+
+    def set_members(self, members, cursor=None):
+        """替换全部数据，只先加载第一批"""
+        self.beginResetModel()
+        self._members = members if isinstance(members, MemberColumns) else MemberColumns(members)
+        self._loaded = min(self.batch_size, len(self._members))
+        self._cursor = cursor
+        self._fetching = False
+        self.endResetModel()
+
+    def append_page(self, members, cursor):
+        """追加数据库返回的下一页"""
+        self._fetching = False
+        self._cursor = cursor
+        # 翻页期间插入过的会员不再重复加入
+        if members:
+            known = self._members.contains(member[1] for member in members)
+            members = [member for member, seen in zip(members, known) if not seen]
+        if self._loaded < len(self._members):
+            # 仍有未展示的行(如新增会员)，新页排在它们后面，随滚动再展示
+            self._members.extend(members)
+        elif members:
+            first = len(self._members)
+            self.beginInsertRows(QModelIndex(), first, first + len(members) - 1)
+            self._members.extend(members)
+            self._loaded = len(self._members)
+            self.endInsertRows()
+
+    def fetch_failed(self):
+        """下一页取回失败，允许滚动时重试"""
+        self._fetching = False
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self._loaded
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(HEADERS)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return False
+        return (self._loaded < len(self._members)
+                or (self._cursor is not None and not self._fetching))
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        count = min(self.batch_size, len(self._members) - self._loaded)
+        if count <= 0:
+            if self._cursor is not None and not self._fetching:
+                # 内存中的行已展示完，向数据库要下一页，结果异步送回append_page
+                self._fetching = True
+                self.more_requested.emit(self._cursor)
+            return
+        self.beginInsertRows(QModelIndex(), self._loaded, self._loaded + count - 1)
+        self._loaded += count
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return QVariant()
+        row, col = index.row(), index.column()
+
+        if role == Qt.DisplayRole:
+            if col == ACTION_COLUMN:
+                return ACTION_TEXT
+            value = self._members.value(row, col)
+            return value if col < 2 else str(value)
+
+        if role == Qt.BackgroundRole and col != ACTION_COLUMN and row % 2 == 1:
+            # 隔行变色(不包括操作列)
+            return self._alt_color
+
+        return QVariant()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """点击表头：不在本地排序，交给数据库按索引排序"""
+        field = FIELDS[column] if 0 <= column < len(FIELDS) else None
+        descending = order == Qt.DescendingOrder and field is not None
+        if (field, descending) != (self.sort_field, self.descending):
+            self.sort_field, self.descending = field, descending
+            self.sort_requested.emit(field, descending)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+    def member_at(self, row):
+        """返回某一行的会员信息字典"""
+        return dict(zip(FIELDS, self._members[row]))
+
+    def row_of(self, phone):
+        """按手机号查找行号，不存在返回-1"""
+        return self._members.find(phone)
+
+    def update_row(self, row, data):
+        """只更新一行并通知视图重绘"""
+        self._members.update(row, tuple(data[field] for field in FIELDS))
+        if row < self._loaded:
+            self.dataChanged.emit(self.index(row, 0), self.index(row, ACTION_COLUMN - 1))
+
+    def sort_key(self, member):
+        """当前排序下的比较键，与数据库的ORDER BY一致(手机号打破并列)"""
+        return (member[FIELDS.index(self.sort_field)], member[1])
+
+    def moves(self, row, data):
+        """修改后这一行在当前排序中的位置是否可能变化"""
+        if self.sort_field is None:
+            return False
+        return self._members.value(row, FIELDS.index(self.sort_field)) != data[self.sort_field]
+
+    def place_member(self, data):
+        """按当前排序插入一行；落在尚未取回的页里时不插入，翻页时自然会取到"""
+        member = tuple(data[field] for field in FIELDS)
+        if self.sort_field is None:
+            # 默认顺序下新会员总在最后
+            if self._cursor is None:
+                self._insert(len(self._members), member)
+            return
+
+        key = self.sort_key(member)
+        low, high = 0, len(self._members)
+        while low < high:
+            mid = (low + high) // 2
+            mid_key = self.sort_key(self._members[mid])
+            if (mid_key > key) if self.descending else (mid_key < key):
+                low = mid + 1
+            else:
+                high = mid
+        if low == len(self._members) and self._cursor is not None:
+            return
+        self._insert(low, member)
+
+    def _insert(self, row, member):
+        visible = row <= self._loaded
+        if visible:
+            self.beginInsertRows(QModelIndex(), row, row)
+        self._members.insert(row, member)
+        if visible:
+            self._loaded += 1
+            self.endInsertRows()
+
+    def remove_row(self, row):
+        """删除一行，之后的行号整体前移"""
+        visible = row < self._loaded
+        if visible:
+            self.beginRemoveRows(QModelIndex(), row, row)
+        self._members.delete(row)
+        if visible:
+            self._loaded -= 1
+            self.endRemoveRows()
+
+
+class EditButtonDelegate(QStyledItemDelegate):
+    """在操作列绘制"修改"按钮，所有行共用同一个委托"""
+
+    edit_requested = pyqtSignal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._pressed_row = -1
+
+    def _button_option(self, option, row):
+        button = QStyleOptionButton()
+        button.rect = option.rect.adjusted(4, 4, -4, -4)
+        button.text = ACTION_TEXT
+        button.state = QStyle.State_Enabled
+        if row == self._pressed_row:
+            button.state |= QStyle.State_Sunken
+        else:
+            button.state |= QStyle.State_Raised
+        return button
+
+    def paint(self, painter, option, index):
+        style = option.widget.style() if option.widget else QApplication.style()
+        style.drawControl(QStyle.CE_PushButton, self._button_option(option, index.row()),
+                          painter, option.widget)
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() == QEvent.MouseButtonPress and event.button() == Qt.LeftButton:
+            if option.rect.contains(event.pos()):
+                self._pressed_row = index.row()
+                return True
+        elif event.type() == QEvent.MouseButtonRelease and event.button() == Qt.LeftButton:
+            pressed, self._pressed_row = self._pressed_row, -1
+            if pressed == index.row() and option.rect.contains(event.pos()):
+                self.edit_requested.emit(index.row())
+                return True
+        return super().editorEvent(event, model, option, index)
@@ -1,20 +1,23 @@
-import sys
-import re
 from PyQt5.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
-                            QTableWidget, QTableWidgetItem, QPushButton, 
+                            QTableView, QAbstractItemView, QPushButton, 
                             QLineEdit, QLabel, QMessageBox, QDialog, 
                             QFormLayout, QSpinBox, QDialogButtonBox, QComboBox,
                             QHeaderView)
 from PyQt5.QtCore import Qt, pyqtSlot
-from PyQt5.QtGui import QFont, QColor
+from PyQt5.QtGui import QFont
 from debug_console import DebugConsole
+from validation import MEMBER_RULES
+from member_table_model import MemberTableModel, EditButtonDelegate, ACTION_COLUMN
+from search_worker import SearchPipeline, matches_search
+from metrics import timed
 
 class MemberEditDialog(QDialog):
-    def __init__(self, member=None, is_new=False, card_type=None, parent=None):
+    def __init__(self, member=None, is_new=False, card_type=None, card_types=(), parent=None):
         super().__init__(parent)
         self.member = member
         self.is_new = is_new
         self.card_type = card_type
+        self.card_types = list(card_types)  # 可选的卡种 [(代码, 名称)]
         
         if is_new:
             self.setWindowTitle("添加新会员")
@@ -47,7 +50,8 @@ class MemberEditDialog(QDialog):
         # 如果是新建并且没有指定卡类型
         if self.is_new and not self.card_type:
             self.card_type_combo = QComboBox()
-            self.card_type_combo.addItems(["剪发卡", "洗吹卡"])
+            for code, label in self.card_types:
+                self.card_type_combo.addItem(label, code)
             layout.addRow("卡类型:", self.card_type_combo)
         
         # 按钮
@@ -73,10 +77,7 @@ class MemberEditDialog(QDialog):
         }
         
         if self.is_new and not self.card_type and hasattr(self, 'card_type_combo'):
-            if self.card_type_combo.currentText() == "剪发卡":
-                data['card_type'] = 'haircut_card'
-            else:
-                data['card_type'] = 'wash_blow_card'
+            data['card_type'] = self.card_type_combo.currentData()
         
         return data
     
@@ -84,26 +85,38 @@ class MemberEditDialog(QDialog):
         # 验证数据
         data = self.get_data()
         
-        # 验证姓名
-        if not re.match(r'^[\u4e00-\u9fa5]{2,10}$', data['name']):
-            QMessageBox.warning(self, "输入错误", "姓名必须是2-10个汉字")
-            return
-        
-        # 验证手机号
-        if not re.match(r'^\d{11}$', data['phone']):
-            QMessageBox.warning(self, "输入错误", "手机号必须是11位数字")
+        # 使用统一的校验规则
+        errors = MEMBER_RULES.validate(data)
+        if errors:
+            QMessageBox.warning(self, "输入错误", errors[0][1])
             return
         
         super().accept()
 
 
 class MemberManagementUI(QMainWindow):
-    def __init__(self, db_manager):
+    def __init__(self, db_manager, service):
         super().__init__()
         self.db_manager = db_manager
-        self.db_manager.data_updated.connect(self.refresh_table)
+        # 所有数据库读写都经由服务在后台线程执行，界面线程不等待存储
+        self.service = service
+        self.service.busy_changed.connect(self.on_busy_changed)
+        self.service.failed.connect(self.on_service_failed)
+        self.db_manager.member_added.connect(self.on_member_added)
+        self.db_manager.member_updated.connect(self.on_member_updated)
+        self.db_manager.member_removed.connect(self.on_member_removed)
+        self.db_manager.members_updated.connect(self.on_members_updated)
+        self.db_manager.card_type_switched.connect(self.refresh_table)
+        self.db_manager.card_types_changed.connect(self.load_card_types)
+        self.db_manager.bulk_reloaded.connect(self.refresh_table)
         self.debug_console = None
         
+        # 搜索在后台线程执行，结果异步回到界面
+        self.search_pipeline = SearchPipeline(service, parent=self)
+        self.search_pipeline.results_ready.connect(self.populate_table)
+        self.search_pipeline.page_ready.connect(self.append_page)
+        self.search_pipeline.search_failed.connect(self.on_search_failed)
+        
         self.init_ui()
         self.refresh_table()
     
@@ -128,18 +141,32 @@ class MemberManagementUI(QMainWindow):
         search_layout.addWidget(self.search_input)
         main_layout.addLayout(search_layout)
         
-        # 会员列表表格
-        self.table = QTableWidget()
-        self.table.setColumnCount(5)  # 姓名、手机号、剩余次数、余额、操作
-        self.table.setHorizontalHeaderLabels(["姓名", "手机号", "剩余次数", "余额", "操作"])
-        self.table.setEditTriggers(QTableWidget.NoEditTriggers)  # 不允许直接编辑
-        self.table.setSelectionBehavior(QTableWidget.SelectRows)
+        # 会员列表表格 - 姓名、手机号、剩余次数、余额、操作
+        self.model = MemberTableModel(parent=self)
+        self.model.more_requested.connect(self.search_pipeline.fetch_more)
+        self.model.sort_requested.connect(self.search_pipeline.set_sort)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        # 点击表头由数据库排序；初始不排序，按加入顺序显示
+        self.table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.table.setSortingEnabled(True)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)  # 不允许直接编辑
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        
+        # 操作列由委托绘制按钮，不再为每行创建控件
+        self.edit_delegate = EditButtonDelegate(self.table)
+        self.edit_delegate.edit_requested.connect(self.on_edit)
+        self.table.setItemDelegateForColumn(ACTION_COLUMN, self.edit_delegate)
         
         # 设置表格自适应占满区域
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
         # 操作列设置固定宽度
-        self.table.horizontalHeader().setSectionResizeMode(4, QHeaderView.Fixed)
-        self.table.setColumnWidth(4, 100)  # 设置操作列宽度
+        self.table.horizontalHeader().setSectionResizeMode(ACTION_COLUMN, QHeaderView.Fixed)
+        self.table.setColumnWidth(ACTION_COLUMN, 100)  # 设置操作列宽度
+        
+        # 统一行高，视图无需逐行测量
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.table.verticalHeader().setDefaultSectionSize(40)
         
         # 设置表格字体
         table_font = QFont()
@@ -177,131 +204,186 @@ class MemberManagementUI(QMainWindow):
         table_label.setFont(font)  # 增大标签字体
         right_buttons.addWidget(table_label)
         
-        self.table_selector = QComboBox()
-        self.table_selector.addItems(["剪发卡", "洗吹卡"])
-        self.table_selector.setMinimumSize(150, 50)  # 增大下拉框尺寸
-        self.table_selector.setFont(font)  # 增大下拉框字体
-        self.table_selector.currentIndexChanged.connect(self.on_switch_table)
-        right_buttons.addWidget(self.table_selector)
+        self.card_type_selector = QComboBox()
+        self.card_type_selector.setMinimumSize(150, 50)  # 增大下拉框尺寸
+        self.card_type_selector.setFont(font)  # 增大下拉框字体
+        self.load_card_types()
+        self.card_type_selector.currentIndexChanged.connect(self.on_switch_card_type)
+        right_buttons.addWidget(self.card_type_selector)
         
         bottom_layout.addLayout(right_buttons)
         
         main_layout.addLayout(bottom_layout)
     
     @pyqtSlot()
-    def refresh_table(self):
-        """刷新整个表格数据"""
-        members = self.db_manager.get_all_members()
-        self.populate_table(members)
+    @pyqtSlot(str)
+    def refresh_table(self, *_):
+        """按当前搜索条件重新加载表格数据"""
+        self.search_pipeline.invalidate()
+        self.search_pipeline.run_now(self.search_input.text())
     
     def update_row(self, row, data):
         """只更新表格中的一行"""
-        self.table.setItem(row, 0, QTableWidgetItem(data['name']))
-        self.table.setItem(row, 1, QTableWidgetItem(data['phone']))
-        self.table.setItem(row, 2, QTableWidgetItem(str(data['remaining_times'])))
-        self.table.setItem(row, 3, QTableWidgetItem(str(data['balance'])))
+        self.model.update_row(row, data)
     
-    def populate_table(self, members):
-        """填充表格数据"""
-        self.table.setRowCount(0)  # 清空表格
-        
+    @timed('ui.populate_table', rows_arg=1)
+    def populate_table(self, members, cursor=None):
+        """填充表格数据，cursor不为None时滚动到底部会继续取下一页"""
+        self.model.set_members(members, cursor)
+    
+    @timed('ui.append_page', rows_arg=1)
+    def append_page(self, members, cursor):
+        """追加从数据库取回的下一页"""
+        self.model.append_page(members, cursor)
+    
+    @pyqtSlot(str)
+    def on_search_failed(self, message):
+        """查询失败时记录日志，翻页请求可在下次滚动时重试"""
+        self.model.fetch_failed()
+        self.log(f"搜索失败: {message}")
+    
+    @pyqtSlot()
+    def load_card_types(self):
+        """按卡种登记表填充下拉框，保持当前选择"""
+        self.card_type_selector.blockSignals(True)
+        self.card_type_selector.clear()
+        for code, label in self.db_manager.get_card_types():
+            self.card_type_selector.addItem(label, code)
+        index = self.card_type_selector.findData(self.db_manager.current_card_type)
+        self.card_type_selector.setCurrentIndex(max(index, 0))
+        self.card_type_selector.blockSignals(False)
+    
+    def _affects_view(self, card_type):
+        """变更是否发生在当前显示的卡种"""
+        if card_type != self.db_manager.current_card_type:
+            return False
+        self.search_pipeline.data_changed()
+        return True
+    
+    @pyqtSlot(str, dict)
+    def on_member_added(self, card_type, member):
+        """新会员符合当前搜索条件时按当前排序插入表格"""
+        if self._affects_view(card_type) and matches_search(self.search_input.text(), self._as_row(member)):
+            self.model.place_member(member)
+    
+    @pyqtSlot(str, str, str, dict)
+    def on_member_updated(self, card_type, old_phone, new_phone, member):
+        """只修补被修改的一行"""
+        if self._affects_view(card_type):
+            self._patch_member(old_phone, member)
+    
+    @pyqtSlot(str, list)
+    def on_members_updated(self, card_type, members):
+        """批量修改后逐行修补，改动过多时直接重新查询"""
+        if not self._affects_view(card_type):
+            return
+        if len(members) > self.model.batch_size:
+            self.refresh_table()
+            return
         for member in members:
-            row = self.table.rowCount()
-            self.table.insertRow(row)
-            
-            # 添加数据
-            self.table.setItem(row, 0, QTableWidgetItem(member[0]))  # 姓名
-            self.table.setItem(row, 1, QTableWidgetItem(member[1]))  # 手机号
-            self.table.setItem(row, 2, QTableWidgetItem(str(member[2])))  # 剩余次数
-            self.table.setItem(row, 3, QTableWidgetItem(str(member[3])))  # 余额
-            
-            # 设置隔行变色
-            if row % 2 == 1:  # 奇数行
-                for col in range(4):  # 不包括操作列
-                    self.table.item(row, col).setBackground(QColor('#eaeaea'))    
-            # 添加编辑按钮
-            edit_btn = QPushButton("修改")
-            # 设置按钮字体和样式
-            btn_font = QFont()
-            btn_font.setPointSize(10)
-            edit_btn.setFont(btn_font)
-            edit_btn.setMinimumHeight(30)  # 增加按钮高度
-            edit_btn.clicked.connect(lambda checked, r=row: self.on_edit(r))
-            self.table.setCellWidget(row, 4, edit_btn)
-        
-        # 表格行高设置
-        for i in range(self.table.rowCount()):
-            self.table.setRowHeight(i, 40)
+            self._patch_member(member['phone'], member)
+    
+    @timed('ui.patch_member', rows=None)
+    def _patch_member(self, old_phone, member):
+        row = self.model.row_of(old_phone)
+        visible = matches_search(self.search_input.text(), self._as_row(member))
+        if row >= 0 and visible and not self.model.moves(row, member):
+            self.update_row(row, member)
+            return
+        # 排序列的值变了或不再符合搜索条件：先移除，再按新位置放回
+        if row >= 0:
+            self.model.remove_row(row)
+        if visible:
+            self.model.place_member(member)
+    
+    @pyqtSlot(str, str)
+    def on_member_removed(self, card_type, phone):
+        """从表格中移除一行"""
+        if self._affects_view(card_type):
+            row = self.model.row_of(phone)
+            if row >= 0:
+                self.model.remove_row(row)
+    
+    @staticmethod
+    def _as_row(member):
+        return (member['name'], member['phone'], member['remaining_times'], member['balance'])
     
     @pyqtSlot(str)
     def on_search(self, text):
-        """搜索会员"""
-        if text.strip() == "":
-            members = self.db_manager.get_all_members()
-        else:
-            members = self.db_manager.search_members(text)
-        
-        self.populate_table(members)
+        """搜索会员，停止输入后在后台查询"""
+        self.search_pipeline.request(text)
     
     @pyqtSlot(int)
     def on_edit(self, row):
         """编辑会员信息"""
-        phone = self.table.item(row, 1).text()
-        member = self.db_manager.get_member_by_phone(phone)
-        
-        if member:
-            dialog = MemberEditDialog(member, False, parent=self)
-            if dialog.exec_() == QDialog.Accepted:
-                new_data = dialog.get_data()
-                success, message = self.db_manager.update_member(phone, new_data)
-                
-                if success:
-                    # 只更新这一行
-                    self.update_row(row, new_data)
-                    self.log(f"已更新会员: {new_data['name']}")
-                else:
-                    QMessageBox.warning(self, "更新失败", message)
-                    self.log(f"更新失败: {message}")
+        phone = self.model.member_at(row)['phone']
+        card_type = self.db_manager.current_card_type
+        # 先在后台读取最新数据，读到后再打开编辑对话框
+        self.service.read(self.db_manager.get_member_by_phone, phone, card_type,
+                          callback=lambda member: self._edit_member(phone, card_type, member))
+    
+    def _edit_member(self, phone, card_type, member):
+        if not member:
+            self.log(f"会员不存在: {phone}")
+            return
+        dialog = MemberEditDialog(member, False, parent=self)
+        if dialog.exec_() == QDialog.Accepted:
+            new_data = dialog.get_data()
+            self.service.write(self.db_manager.update_member, phone, new_data, card_type,
+                               callback=lambda result: self._on_updated(new_data, result))
+    
+    def _on_updated(self, new_data, result):
+        success, message = result
+        if success:
+            # 表格中的这一行由member_updated通知修补
+            self.log(f"已更新会员: {new_data['name']}")
+        else:
+            QMessageBox.warning(self, "更新失败", message)
+            self.log(f"更新失败: {message}")
     
     @pyqtSlot()
     def on_add(self):
         """添加新会员"""
-        card_type = 'haircut_card' if self.table_selector.currentIndex() == 0 else 'wash_blow_card'
-        dialog = MemberEditDialog(is_new=True, card_type=card_type, parent=self)
+        card_type = self.card_type_selector.currentData()
+        dialog = MemberEditDialog(is_new=True, card_type=card_type,
+                                  card_types=self.db_manager.get_card_types(), parent=self)
         
         if dialog.exec_() == QDialog.Accepted:
             data = dialog.get_data()
             
             # 如果对话框中选择了卡类型，则使用
-            if 'card_type' in data:
-                # 临时切换表
-                current_table = self.db_manager.current_table
-                self.db_manager.switch_table(data['card_type'])
-                del data['card_type']
-                
-                success, message = self.db_manager.add_member(data)
-                
-                # 恢复原表
-                self.db_manager.switch_table(current_table)
-            else:
-                success, message = self.db_manager.add_member(data)
-            
-            if success:
-                self.log(f"已添加新会员: {data['name']}")
-                QMessageBox.information(self, "成功", message)
-            else:
-                QMessageBox.warning(self, "添加失败", message)
-                self.log(f"添加失败: {message}")
+            card_type = data.pop('card_type', card_type)
+            self.service.write(self.db_manager.add_member, data, card_type=card_type,
+                               callback=lambda result: self._on_added(data, result))
     
-    @pyqtSlot(int)
-    def on_switch_table(self, index):
-        """切换表格"""
-        if index == 0:
-            self.db_manager.switch_table('haircut_card')
-            self.log("已切换到剪发卡表")
+    def _on_added(self, data, result):
+        success, message = result
+        if success:
+            self.log(f"已添加新会员: {data['name']}")
+            QMessageBox.information(self, "成功", message)
         else:
-            self.db_manager.switch_table('wash_blow_card')
-            self.log("已切换到洗吹卡表")
+            QMessageBox.warning(self, "添加失败", message)
+            self.log(f"添加失败: {message}")
+    
+    @pyqtSlot(bool)
+    def on_busy_changed(self, busy):
+        """有写操作在后台进行时在状态栏提示"""
+        if busy:
+            self.statusBar().showMessage("正在保存...")
+        else:
+            self.statusBar().showMessage("已保存", 2000)
+    
+    @pyqtSlot(str)
+    def on_service_failed(self, message):
+        self.statusBar().clearMessage()
+        QMessageBox.warning(self, "操作失败", message)
+        self.log(message)
+    
+    @pyqtSlot(int)
+    def on_switch_card_type(self, index):
+        """切换显示的卡种"""
+        if self.db_manager.switch_card_type(self.card_type_selector.itemData(index)):
+            self.log(f"已切换到{self.card_type_selector.itemText(index)}表")
     
     @pyqtSlot()
     def toggle_debug(self):
@@ -314,6 +396,11 @@ class MemberManagementUI(QMainWindow):
             self.debug_console.close()
             self.debug_btn.setText("调试模式")
     
+    def closeEvent(self, event):
+        """窗口关闭时等待后台查询结束"""
+        self.search_pipeline.shutdown()
+        event.accept()
+    
     def log(self, message):
         """记录日志信息"""
         print(message)
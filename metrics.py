@@ -0,0 +1,321 @@
+import os
+import json
+import math
+import time
+import sqlite3
+import threading
+import functools
+import itertools
+from collections import deque
+from datetime import datetime
+
+# 直方图桶的上界按15%递增，从0.01毫秒到约两分钟，百分位数的误差不超过一个桶宽
+_BUCKET_BASE = 0.01
+_BUCKET_GROWTH = 1.15
+_BUCKET_COUNT = 118
+
+
+def _bucket_of(ms):
+    if ms <= _BUCKET_BASE:
+        return 0
+    return min(_BUCKET_COUNT - 1, int(math.ceil(math.log(ms / _BUCKET_BASE, _BUCKET_GROWTH))))
+
+
+def _bucket_bound(index):
+    return _BUCKET_BASE * _BUCKET_GROWTH ** index
+
+
+class LatencyHistogram:
+    """固定对数分桶的耗时直方图，记录一次只是一次加法，内存占用与次数无关"""
+
+    def __init__(self):
+        self.buckets = [0] * _BUCKET_COUNT
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows_total = 0  # 返回或处理的行数之和
+        self.rows_count = 0  # 有行数的调用次数
+        self.rows_max = 0
+
+    def record(self, ms, rows=None):
+        self.buckets[_bucket_of(ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        if rows is not None:
+            self.rows_total += rows
+            self.rows_count += 1
+            self.rows_max = max(self.rows_max, rows)
+
+    def percentile(self, fraction):
+        """估计的百分位耗时(毫秒)，取所在桶的上界且不超过最大值"""
+        if not self.count:
+            return 0.0
+        target = max(1, math.ceil(fraction * self.count))
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= target:
+                return min(_bucket_bound(index), self.max_ms)
+        return self.max_ms
+
+    def summary(self):
+        summary = {
+            'count': self.count,
+            'p50_ms': round(self.percentile(0.50), 3),
+            'p95_ms': round(self.percentile(0.95), 3),
+            'p99_ms': round(self.percentile(0.99), 3),
+            'max_ms': round(self.max_ms, 3),
+            'mean_ms': round(self.total_ms / self.count, 3) if self.count else 0.0,
+            'total_ms': round(self.total_ms, 1),
+        }
+        if self.rows_count:
+            summary.update(rows_mean=round(self.rows_total / self.rows_count, 1), rows_max=self.rows_max)
+        return summary
+
+
+def count_rows(result):
+    """从返回值推断行数：列表和列存储取长度，(列表, 游标)取列表长度，报告取其中的行数"""
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        return len(result[0])
+    if isinstance(result, dict):
+        counts = [result[key] for key in ('read', 'updated', 'inserted', 'applied', 'received', 'changes')
+                  if isinstance(result.get(key), int)]
+        return max(counts) if counts else None
+    if isinstance(result, (str, bytes, tuple)) or not hasattr(result, '__len__'):
+        return None
+    return len(result)
+
+
+class Metrics:
+    """进程内的性能指标：各操作的耗时直方图和行数、慢查询及其执行计划
+
+    记录可以来自任意线程；调试控制台定时读取快照显示，后台线程定期把快照写入文件。
+    """
+
+    def __init__(self, slow_query_ms=100.0, keep_slow=50):
+        self.slow_query_ms = slow_query_ms  # 超过该耗时的SQL记为慢查询
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._slow = deque(maxlen=keep_slow)
+        self._export_thread = None
+        self._export_stop = threading.Event()
+
+    def record(self, name, ms, rows=None):
+        """记录一次耗时(毫秒)，rows为本次返回或处理的行数"""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = LatencyHistogram()
+            histogram.record(ms, rows)
+
+    def timed(self, name, rows=count_rows, rows_arg=None):
+        """装饰器：记录函数每次调用的耗时
+
+        rows从返回值推断行数，为None时不记行数；rows_arg给出时改用该位置参数的长度。
+        """
+        def decorate(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException:
+                    self.record(name, (time.perf_counter() - started) * 1000)
+                    raise
+                if rows_arg is not None:
+                    count = len(args[rows_arg]) if len(args) > rows_arg else None
+                else:
+                    count = rows(result) if rows is not None else None
+                self.record(name, (time.perf_counter() - started) * 1000, count)
+                return result
+            return wrapper
+        return decorate
+
+    def slow_query(self, sql, ms, plan):
+        """记录一条慢查询"""
+        entry = {'time': datetime.now().isoformat(timespec='seconds'), 'ms': round(ms, 1),
+                 'sql': ' '.join(sql.split())[:500], 'plan': plan}
+        with self._lock:
+            self._slow.append(entry)
+        print(f"慢查询 {entry['ms']}ms: {entry['sql'][:120]}" + (f"\n  执行计划: {'; '.join(plan)}" if plan else ''))
+
+    def snapshot(self):
+        """当前所有指标: {'time', 'uptime_s', 'operations': {名称: 统计}, 'slow_queries': [...]}"""
+        with self._lock:
+            operations = {name: histogram.summary() for name, histogram in sorted(self._histograms.items())}
+            slow = list(self._slow)
+        return {'time': datetime.now().isoformat(timespec='seconds'),
+                'uptime_s': round(time.time() - self.started, 1),
+                'slow_query_ms': self.slow_query_ms,
+                'operations': operations, 'slow_queries': slow}
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._slow.clear()
+            self.started = time.time()
+
+    def export(self, path):
+        """把快照写入JSON文件，先写临时文件再改名"""
+        tmp_path = path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.snapshot(), f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"写入性能指标快照失败: {e}")
+
+    def start_export(self, path=os.path.join('database', 'metrics.json'), interval=60.0):
+        """每interval秒在后台把快照写入path"""
+        if self._export_thread is not None:
+            return
+        self._export_stop.clear()
+
+        def loop():
+            while not self._export_stop.wait(interval):
+                self.export(path)
+            self.export(path)  # 退出前再写一次
+
+        self._export_thread = threading.Thread(target=loop, name='metrics-export', daemon=True)
+        self._export_thread.start()
+
+    def stop_export(self):
+        """停止定期导出，并写入最后一次快照"""
+        if self._export_thread is None:
+            return
+        self._export_stop.set()
+        self._export_thread.join()
+        self._export_thread = None
+
+
+METRICS = Metrics()
+timed = METRICS.timed
+
+_PLANNED = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+class TimedCursor(sqlite3.Cursor):
+    """计时的游标：一条语句的耗时从execute开始，累加每次取行，到结果取完(或游标关闭、
+    重新执行、被回收)时才记录，全表扫描等主要花在取行上的开销也计算在内"""
+
+    metrics = METRICS
+    _sql = None  # 正在计时的语句，None表示没有
+    _parameters = ()
+    _ms = 0.0
+    _rows = 0
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        self._sql, self._parameters, self._ms, self._rows = sql, parameters, 0.0, 0
+        started = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        except BaseException:
+            self._ms += (time.perf_counter() - started) * 1000
+            self._finish()
+            raise
+        self._ms += (time.perf_counter() - started) * 1000
+        if self.description is None:  # 不返回行的语句已经执行完
+            self._rows = self.rowcount if self.rowcount >= 0 else None
+            self._finish()
+        return self
+
+    def executemany(self, sql, parameters):
+        self._finish()
+        # 取出第一组参数，慢语句用它生成执行计划
+        parameters = iter(parameters)
+        first = next(parameters, None)
+        if first is not None:
+            parameters = itertools.chain([first], parameters)
+        started = time.perf_counter()
+        super().executemany(sql, parameters)
+        ms = (time.perf_counter() - started) * 1000
+        self.metrics.record('sqlite.executemany', ms, self.rowcount if self.rowcount >= 0 else None)
+        if ms >= self.metrics.slow_query_ms:
+            self.metrics.slow_query(sql, ms, self._plan(sql, first) if first is not None else None)
+        return self
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._finish()
+        elif self._sql is not None:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = self._timed(super().fetchmany, size)
+        if self._sql is not None:
+            self._rows += len(rows)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        if self._sql is not None:
+            self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            row = self._timed(super().__next__)
+        except StopIteration:
+            self._finish()
+            raise
+        if self._sql is not None:
+            self._rows += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+    def _timed(self, fetch, *args):
+        started = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            self._ms += (time.perf_counter() - started) * 1000
+
+    def _finish(self):
+        """记录当前语句；慢语句附带执行计划"""
+        sql = self._sql
+        if sql is None:
+            return
+        self._sql = None
+        self.metrics.record('sqlite.execute', self._ms, self._rows)
+        if self._ms >= self.metrics.slow_query_ms:
+            self.metrics.slow_query(sql, self._ms, self._plan(sql, self._parameters))
+
+    def _plan(self, sql, parameters):
+        if not sql.lstrip().upper().startswith(_PLANNED):
+            return None
+        try:
+            # 用连接的原始execute，不再计时
+            return [row[3] for row in sqlite3.Connection.execute(
+                self.connection, f"EXPLAIN QUERY PLAN {sql}", parameters)]
+        except sqlite3.Error as e:
+            return [f"无法获取执行计划: {e}"]
+
+
+class TimedConnection(sqlite3.Connection):
+    """给每条SQL计时的连接：所有游标(包括pandas等库自行创建的)都是TimedCursor，
+    超过阈值的语句连同EXPLAIN QUERY PLAN一起记为慢查询"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self.cursor().executemany(sql, parameters)
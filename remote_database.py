@@ -0,0 +1,170 @@
+import json
+import time
+import threading
+import http.client
+from urllib.parse import urlsplit, urlencode, quote
+from PyQt5.QtCore import QObject, pyqtSignal
+from database_manager import DatabaseManager, MEMBER_COLUMNS, SEARCH_LIMIT, PAGE_SIZE
+
+
+class RemoteDatabase(QObject):
+    """连接会员服务的瘦客户端，提供界面用到的DatabaseManager接口
+
+    请求是阻塞的，由DatabaseService在后台线程中调用；
+    其他终端的改动通过长轮询取回，以与DatabaseManager相同的信号通知界面。
+    """
+
+    member_added = pyqtSignal(str, dict)
+    member_updated = pyqtSignal(str, str, str, dict)
+    member_removed = pyqtSignal(str, str)
+    card_type_switched = pyqtSignal(str)
+    card_types_changed = pyqtSignal()
+    bulk_reloaded = pyqtSignal(str)
+    members_updated = pyqtSignal(str, list)
+
+    plan_search = staticmethod(DatabaseManager.plan_search)
+
+    def __init__(self, url='http://127.0.0.1:8765', timeout=10.0, poll_wait=25):
+        super().__init__()
+        parts = urlsplit(url)
+        self.host = parts.hostname or '127.0.0.1'
+        self.port = parts.port or 8765
+        self.timeout = timeout
+        self.poll_wait = poll_wait  # 长轮询每次最多等待的秒数
+        self._local = threading.local()  # 每个线程一个长连接
+        self._running = True
+
+        result = self._request('GET', '/card_types')
+        self.card_types = [tuple(item) for item in result['card_types']]
+        self.current_card_type = self.card_types[0][0] if self.card_types else 'haircut_card'
+        self._seq = result['seq']
+        self._poller = threading.Thread(target=self._poll, name='remote-events', daemon=True)
+        self._poller.start()
+
+    def _connection(self, timeout):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+            self._local.conn = conn
+        return conn
+
+    def _request(self, method, path, params=None, data=None, timeout=None):
+        """发送一次请求，返回解析后的JSON；连接断开时重连重试一次"""
+        if params:
+            path += '?' + urlencode({key: value for key, value in params.items() if value is not None})
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8') if data is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        for attempt in range(2):
+            conn = self._connection(timeout or self.timeout)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                return json.loads(response.read().decode('utf-8'))
+            except (http.client.HTTPException, ConnectionError):
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+            except OSError:
+                conn.close()
+                self._local.conn = None
+                raise
+
+    def _result(self, method, path, data, action):
+        """写操作的结果统一为(是否成功, 信息)，连接失败也不抛出"""
+        try:
+            result = self._request(method, path, data=data)
+        except OSError as e:
+            return False, f"{action}失败: 无法连接会员服务({e})"
+        return result['ok'], result['message']
+
+    def get_card_types(self):
+        return list(self.card_types)
+
+    def card_type_label(self, code):
+        return dict(self.card_types).get(code, code)
+
+    def switch_card_type(self, card_type):
+        """切换当前操作的卡种"""
+        if card_type in dict(self.card_types):
+            self.current_card_type = card_type
+            self.card_type_switched.emit(card_type)
+            return True
+        return False
+
+    @staticmethod
+    def _rows(members):
+        return [tuple(member[field] for field in MEMBER_COLUMNS) for member in members]
+
+    def list_members(self, card_type=None, sort=None, descending=False,
+                     page_size=PAGE_SIZE, after=None):
+        result = self._request('GET', '/members', {
+            'card_type': card_type or self.current_card_type, 'sort': sort,
+            'descending': int(descending), 'page_size': page_size,
+            'after': json.dumps(list(after), ensure_ascii=False) if after is not None else None})
+        cursor = result['cursor']
+        return self._rows(result['members']), tuple(cursor) if cursor is not None else None
+
+    def search_members(self, search_text, limit=SEARCH_LIMIT, card_type=None):
+        result = self._request('GET', '/members/search', {
+            'q': search_text.strip(), 'limit': limit, 'card_type': card_type or self.current_card_type})
+        return self._rows(result['members'])
+
+    def get_member_by_phone(self, phone, card_type=None):
+        result = self._request('GET', f"/members/{quote(phone)}",
+                               {'card_type': card_type or self.current_card_type})
+        return result.get('member')
+
+    def add_member(self, data, card_type=None):
+        return self._result('POST', '/members',
+                            dict(data, card_type=card_type or self.current_card_type), "添加")
+
+    def update_member(self, phone, data, card_type=None):
+        return self._result('PUT', f"/members/{quote(phone)}",
+                            dict(data, card_type=card_type or self.current_card_type), "更新")
+
+    def deduct_member(self, phone, times=1, amount=0, card_type=None):
+        return self._result('POST', f"/members/{quote(phone)}/deduct",
+                            {'times': times, 'amount': amount,
+                             'card_type': card_type or self.current_card_type}, "扣减")
+
+    def _poll(self):
+        """长轮询服务器的变更通知，转成信号发给界面"""
+        while self._running:
+            try:
+                result = self._request('GET', '/events', {'since': self._seq, 'wait': self.poll_wait},
+                                       timeout=self.poll_wait + self.timeout)
+            except OSError as e:
+                if self._running:
+                    print(f"获取服务器变更失败: {e}")
+                    time.sleep(2)
+                continue
+            self._seq = result['seq']
+            if result['reset']:
+                # 落后太多，整体刷新
+                self.bulk_reloaded.emit('')
+                continue
+            for event in result['events']:
+                self._emit(event)
+
+    def _emit(self, event):
+        kind, card_type = event['event'], event['card_type']
+        if kind == 'added':
+            self.member_added.emit(card_type, event['member'])
+        elif kind == 'updated':
+            self.member_updated.emit(card_type, event['old_phone'], event['member']['phone'],
+                                     event['member'])
+        elif kind == 'removed':
+            self.member_removed.emit(card_type, event['phone'])
+        elif kind == 'bulk':
+            self.members_updated.emit(card_type, event['members'])
+        elif kind == 'reload':
+            self.bulk_reloaded.emit(card_type)
+        elif kind == 'card_types':
+            self.card_types = [tuple(item) for item in
+                               self._request('GET', '/card_types')['card_types']]
+            self.card_types_changed.emit()
+
+    def close(self):
+        """停止接收变更通知；正在等待的长轮询会在超时后结束"""
+        self._running = False
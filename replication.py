@@ -0,0 +1,365 @@
+import os
+import sys
+import json
+import gzip
+import uuid
+import sqlite3
+import argparse
+from ledger import Ledger
+from lookup_keys import lookup_values
+
+CHANGES_TABLE = 'member_changes'
+NODE_TABLE = 'replication_node'
+PEERS_TABLE = 'replication_peers'
+CHANGE_COLUMNS = ['name', 'remaining_times', 'balance']
+FILE_FORMAT = 1
+
+# 毫秒时间戳；同一会员的新改动至少比已知的最新改动大1，时钟偏差也不会让新改动输给旧改动
+_NOW_MS = "CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)"
+
+
+class Replicator:
+    """基于变更日志的分店间同步：只传输对方尚未确认的改动，不复制整个数据库文件
+
+    会员表上的触发器把每次增删改追加到变更日志，序号在本节点内递增；
+    导出时只写出对方上次确认之后的改动，导入时按(时间戳, 节点, 序号)确定胜出的版本，
+    各节点无论以什么顺序交换文件，最终同一手机号的数据都一致。
+    """
+
+    def __init__(self, table):
+        self.table = table  # 会员表
+
+    def install(self, conn):
+        """创建变更日志、节点和对端表以及触发器，需在写事务中调用
+
+        首次安装时把现有会员作为时间戳为0的基线写入日志，之后任何真实改动都会胜过基线。
+        """
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {NODE_TABLE} (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            node TEXT NOT NULL,
+            applying INTEGER NOT NULL DEFAULT 0
+        )
+        """)
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {PEERS_TABLE} (
+            node TEXT PRIMARY KEY,
+            acked_seq INTEGER NOT NULL DEFAULT 0,
+            sent_seq INTEGER NOT NULL DEFAULT 0
+        )
+        """)
+        created = not conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (CHANGES_TABLE,)).fetchone()
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {CHANGES_TABLE} (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            node TEXT NOT NULL,
+            origin_seq INTEGER,
+            ts INTEGER NOT NULL,
+            op TEXT NOT NULL CHECK (op IN ('upsert', 'delete')),
+            card_type TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            name TEXT,
+            remaining_times INTEGER,
+            balance INTEGER
+        )
+        """)
+        # origin_seq为空表示本节点产生的改动，其来源序号就是seq
+        conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{CHANGES_TABLE}_origin "
+                     f"ON {CHANGES_TABLE} (node, origin_seq)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{CHANGES_TABLE}_key "
+                     f"ON {CHANGES_TABLE} (card_type, phone, ts)")
+
+        conn.execute(f"INSERT OR IGNORE INTO {NODE_TABLE} (id, node) VALUES (1, ?)",
+                     (uuid.uuid4().hex[:12],))
+        if created:
+            conn.execute(f"""
+            INSERT INTO {CHANGES_TABLE} (node, ts, op, card_type, phone, {', '.join(CHANGE_COLUMNS)})
+            SELECT (SELECT node FROM {NODE_TABLE} WHERE id = 1), 0, 'upsert', card_type, phone,
+                   {', '.join(CHANGE_COLUMNS)}
+            FROM {self.table} ORDER BY rowid
+            """)
+        self._install_triggers(conn)
+
+    def _install_triggers(self, conn):
+        table = self.table
+        local = f"(SELECT applying FROM {NODE_TABLE} WHERE id = 1) = 0"
+        columns = ', '.join(CHANGE_COLUMNS)
+
+        def log(op, row, values, condition=''):
+            ts = (f"max({_NOW_MS}, coalesce((SELECT max(ts) FROM {CHANGES_TABLE} "
+                  f"WHERE card_type = {row}.card_type AND phone = {row}.phone), 0) + 1)")
+            return f"""
+            INSERT INTO {CHANGES_TABLE} (node, ts, op, card_type, phone, {columns})
+            SELECT node, {ts}, '{op}', {row}.card_type, {row}.phone, {values}
+            FROM {NODE_TABLE} WHERE id = 1{condition};"""
+
+        upsert = log('upsert', 'new', ', '.join(f"new.{column}" for column in CHANGE_COLUMNS))
+        nulls = ', '.join('NULL' for _ in CHANGE_COLUMNS)
+        delete = log('delete', 'old', nulls)
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_changes_insert AFTER INSERT ON {table}
+        WHEN {local} BEGIN {upsert}
+        END
+        """)
+        # 只记录会员数据的变化，查找列的回填不算改动；改手机号记为删除旧号加写入新号
+        changed = ' OR '.join(f"old.{column} IS NOT new.{column}" for column in ['phone'] + CHANGE_COLUMNS)
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_changes_update
+        AFTER UPDATE OF phone, {columns} ON {table}
+        WHEN {local} AND ({changed}) BEGIN {log('delete', 'old', nulls, ' AND old.phone != new.phone')}
+            {upsert}
+        END
+        """)
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_changes_delete AFTER DELETE ON {table}
+        WHEN {local} BEGIN {delete}
+        END
+        """)
+
+    @staticmethod
+    def node(conn):
+        """本节点的标识"""
+        return conn.execute(f"SELECT node FROM {NODE_TABLE} WHERE id = 1").fetchone()[0]
+
+    @staticmethod
+    def renew_node(conn):
+        """为复制出来的数据库换一个新的节点标识，需在写事务中调用
+
+        复制前的日志仍属于原节点，把它们的来源序号固定下来，与原节点导出的改动能正确去重。
+        """
+        old = Replicator.node(conn)
+        conn.execute(f"UPDATE {CHANGES_TABLE} SET origin_seq = seq WHERE node = ? AND origin_seq IS NULL", (old,))
+        node = uuid.uuid4().hex[:12]
+        conn.execute(f"UPDATE {NODE_TABLE} SET node = ? WHERE id = 1", (node,))
+        return node
+
+    @staticmethod
+    def identity(conn):
+        """本节点的标识、对端进度和用过的最大序号，恢复备份前记下，恢复后用keep_identity沿用"""
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (CHANGES_TABLE,)).fetchone()
+        return {'node': Replicator.node(conn), 'peers': Replicator.peers(conn), 'last_seq': row[0] if row else 0}
+
+    @staticmethod
+    def keep_identity(conn, identity):
+        """让恢复出的数据库沿用原来的节点标识和对端进度，需在写事务中调用，返回恢复出的数据原来的标识
+
+        备份早于同步功能时安装会生成新标识，备份来自其他数据库时标识也不同：这些日志的来源序号
+        像renew_node一样固定下来，再换回原标识。序号从恢复前用过的最大值之后继续，
+        新改动不会与对端已收到的序号重复被当成重复改动丢弃。
+        """
+        restored = Replicator.node(conn)
+        if restored != identity['node']:
+            conn.execute(f"UPDATE {CHANGES_TABLE} SET origin_seq = seq WHERE node = ? AND origin_seq IS NULL",
+                         (restored,))
+            conn.execute(f"UPDATE {NODE_TABLE} SET node = ? WHERE id = 1", (identity['node'],))
+        conn.executemany(f"""
+        INSERT INTO {PEERS_TABLE} (node, acked_seq, sent_seq) VALUES (?, ?, ?)
+        ON CONFLICT (node) DO UPDATE SET acked_seq = max(acked_seq, excluded.acked_seq),
+                                         sent_seq = max(sent_seq, excluded.sent_seq)
+        """, identity['peers'])
+        if not conn.execute("SELECT 1 FROM sqlite_sequence WHERE name = ?", (CHANGES_TABLE,)).fetchone():
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, 0)", (CHANGES_TABLE,))
+        conn.execute("UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = ?",
+                     (identity['last_seq'], CHANGES_TABLE))
+        return restored
+
+    @staticmethod
+    def peers(conn):
+        """已知的对端: [(节点, 已应用对方的序号, 对方已确认我方的序号)]"""
+        return conn.execute(f"SELECT node, acked_seq, sent_seq FROM {PEERS_TABLE} ORDER BY node").fetchall()
+
+    @staticmethod
+    def _peer(conn, node):
+        row = conn.execute(f"SELECT acked_seq, sent_seq FROM {PEERS_TABLE} WHERE node = ?",
+                           (node,)).fetchone()
+        return row or (0, 0)
+
+    def export(self, conn, path, peer=None):
+        """把对端peer尚未确认的改动写入压缩文件，peer为None时导出全部日志，返回导出报告"""
+        node = self.node(conn)
+        acked, since = self._peer(conn, peer) if peer else (0, 0)
+        rows = conn.execute(f"""
+        SELECT seq, node, coalesce(origin_seq, seq), ts, op, card_type, phone, {', '.join(CHANGE_COLUMNS)}
+        FROM {CHANGES_TABLE} WHERE seq > ? AND node != ? ORDER BY seq
+        """, (since, peer or '')).fetchall()
+        last_seq = conn.execute(f"SELECT coalesce(max(seq), 0) FROM {CHANGES_TABLE}").fetchone()[0]
+
+        # 来源节点只写一次，每条改动用下标引用，文件更紧凑
+        nodes = sorted({row[1] for row in rows})
+        position = {origin: i for i, origin in enumerate(nodes)}
+        payload = {
+            'format': FILE_FORMAT, 'node': node, 'peer': peer, 'since': since, 'last_seq': last_seq,
+            'ack': acked if peer else None,
+            'card_types': conn.execute("SELECT code, label FROM card_types ORDER BY position, rowid").fetchall(),
+            'nodes': nodes,
+            'changes': [[position[row[1]]] + list(row[2:]) for row in rows],
+        }
+        tmp_path = path + '.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+        return {'node': node, 'peer': peer, 'since': since, 'last_seq': last_seq,
+                'changes': len(rows), 'path': path}
+
+    def apply(self, conn, path):
+        """导入对端导出的改动，需在写事务中调用，返回导入报告
+
+        已有的改动(同一来源节点和序号)跳过；同一会员的多个版本中(时间戳, 节点, 序号)最大者胜出。
+        """
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            payload = json.load(f)
+        if payload.get('format') != FILE_FORMAT:
+            raise ValueError(f"不支持的同步文件格式: {payload.get('format')}")
+
+        node = self.node(conn)
+        sender = payload['node']
+        report = {'status': 'applied', 'message': '', 'sender': sender, 'received': len(payload['changes']),
+                  'applied': 0, 'superseded': 0, 'duplicates': 0}
+        if sender == node:
+            report.update(status='rejected', message="这是本节点导出的文件")
+            return report
+        acked, sent = self._peer(conn, sender)
+        if payload['since'] > acked:
+            report.update(status='rejected',
+                          message=f"缺少对方序号{acked}到{payload['since']}之间的改动，请对方重新导出")
+            return report
+
+        for code, label in payload['card_types']:
+            conn.execute("""
+            INSERT OR IGNORE INTO card_types (code, label, position)
+            SELECT ?, ?, coalesce(max(position), -1) + 1 FROM card_types
+            """, (code, label))
+
+        # 导入期间触发器不记录，改动按原来源写入日志以便转发给其他节点；
+        # 消费流水只由发生消费的分店记录，这里也不记，否则各店合计会重复计算
+        conn.execute(f"UPDATE {NODE_TABLE} SET applying = 1 WHERE id = 1")
+        try:
+            with Ledger.suspended(conn):
+                for change in payload['changes']:
+                    origin = payload['nodes'][change[0]]
+                    if origin == node:
+                        report['duplicates'] += 1  # 本节点自己的改动
+                        continue
+                    self._apply_change(conn, origin, change[1:], report)
+        finally:
+            conn.execute(f"UPDATE {NODE_TABLE} SET applying = 0 WHERE id = 1")
+
+        ack = payload['ack'] if payload.get('peer') == node and payload['ack'] is not None else sent
+        conn.execute(f"""
+        INSERT INTO {PEERS_TABLE} (node, acked_seq, sent_seq) VALUES (?, ?, ?)
+        ON CONFLICT (node) DO UPDATE SET acked_seq = max(acked_seq, excluded.acked_seq),
+                                         sent_seq = max(sent_seq, excluded.sent_seq)
+        """, (sender, payload['last_seq'], ack))
+        report['message'] = (f"收到{report['received']}条改动，应用{report['applied']}条，"
+                             f"被更新的版本覆盖{report['superseded']}条，重复{report['duplicates']}条")
+        return report
+
+    def _apply_change(self, conn, origin, change, report):
+        origin_seq, ts, op, card_type, phone, name, times, balance = change
+        cursor = conn.execute(f"""
+        INSERT OR IGNORE INTO {CHANGES_TABLE}
+            (node, origin_seq, ts, op, card_type, phone, {', '.join(CHANGE_COLUMNS)})
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (origin, origin_seq, ts, op, card_type, phone, name, times, balance))
+        if cursor.rowcount == 0:
+            report['duplicates'] += 1
+            return
+
+        latest = conn.execute(f"""
+        SELECT node, coalesce(origin_seq, seq) FROM {CHANGES_TABLE}
+        WHERE card_type = ? AND phone = ?
+        ORDER BY ts DESC, node DESC, coalesce(origin_seq, seq) DESC LIMIT 1
+        """, (card_type, phone)).fetchone()
+        if tuple(latest) != (origin, origin_seq):
+            report['superseded'] += 1
+            return
+
+        if op == 'delete':
+            conn.execute(f"DELETE FROM {self.table} WHERE card_type = ? AND phone = ?", (card_type, phone))
+        else:
+            conn.execute(f"""
+            INSERT INTO {self.table} (card_type, name, phone, remaining_times, balance, phone_rev, name_initials)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (card_type, phone) DO UPDATE SET
+                name = excluded.name, remaining_times = excluded.remaining_times,
+                balance = excluded.balance, name_initials = excluded.name_initials
+            WHERE (name, remaining_times, balance)
+                  IS NOT (excluded.name, excluded.remaining_times, excluded.balance)
+            """, (card_type, name, phone, times, balance, *lookup_values(name, phone)))
+        report['applied'] += 1
+
+    def prune(self, conn):
+        """删除所有已知对端都已确认、且已被同一会员更新版本取代的日志，需在写事务中调用"""
+        floor = conn.execute(f"SELECT min(sent_seq) FROM {PEERS_TABLE}").fetchone()[0]
+        if floor is None:
+            return 0
+        cursor = conn.execute(f"""
+        DELETE FROM {CHANGES_TABLE} AS c
+        WHERE seq <= ? AND EXISTS (
+            SELECT 1 FROM {CHANGES_TABLE} AS n
+            WHERE n.card_type = c.card_type AND n.phone = c.phone
+              AND (n.ts, n.node, coalesce(n.origin_seq, n.seq))
+                  > (c.ts, c.node, coalesce(c.origin_seq, c.seq))
+        )
+        """, (floor,))
+        return cursor.rowcount
+
+
+def _transaction(conn, fn, *args):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        result = fn(conn, *args)
+        conn.execute("COMMIT")
+        return result
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def main():
+    parser = argparse.ArgumentParser(description='分店数据库之间按变更日志同步会员数据')
+    parser.add_argument('--db', default=os.path.join('database', 'members.db'), help='SQLite数据库路径')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('status', help='显示本节点标识和对端同步进度')
+    export = commands.add_parser('export', help='导出对端尚未确认的改动')
+    export.add_argument('path', help='输出文件，如 to_branch2.changes.gz')
+    export.add_argument('--peer', help='对端节点标识；不指定时导出全部日志')
+    apply = commands.add_parser('apply', help='导入对端导出的改动')
+    apply.add_argument('path')
+    commands.add_parser('prune', help='清理所有对端都已确认且已被取代的日志')
+    commands.add_parser('new-node', help='复制数据库文件开设新分店后，为副本换一个新的节点标识')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    try:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'members'").fetchone():
+            print("数据表 members 不存在，请先运行主程序初始化数据库")
+            return 1
+        replicator = Replicator('members')
+        _transaction(conn, replicator.install)
+
+        if args.command == 'status':
+            print(f"本节点: {replicator.node(conn)}")
+            for node, acked, sent in replicator.peers(conn):
+                print(f"  对端 {node}: 已应用对方至序号{acked}，对方已确认我方至序号{sent}")
+        elif args.command == 'export':
+            report = replicator.export(conn, args.path, args.peer)
+            print(f"已导出{report['changes']}条改动(序号{report['since']}之后)到 {report['path']}")
+        elif args.command == 'apply':
+            report = _transaction(conn, replicator.apply, args.path)
+            print(report['message'] or report['status'])
+            if report['status'] != 'applied':
+                return 1
+            print("如主程序正在运行，请重启或在程序内导入以刷新界面和Excel")
+        elif args.command == 'prune':
+            print(f"已清理{_transaction(conn, replicator.prune)}条日志")
+        elif args.command == 'new-node':
+            print(f"本节点新的标识: {_transaction(conn, replicator.renew_node)}")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+import sqlite3
+from lookup_keys import lookup_values, prefix_range, reverse_phone
+
+MIN_TRIGRAM_LENGTH = 3  # trigram索引至少需要3个字符才能命中
+LOOKUP_COLUMNS = ['phone_rev', 'name_initials']  # 倒序手机号、拼音首字母
+
+
+class SearchIndex:
+    """会员搜索索引：基于FTS5 trigram的子串索引，不支持FTS5时退回LIKE扫描
+
+    所有卡种共用一张会员表和一个索引，查询时按card_type过滤
+    """
+
+    def __init__(self, table, columns):
+        self.table = table
+        self.fts = f"{table}_fts"
+        self.columns = list(columns)
+        self.fts_enabled = False
+
+    def install(self, conn):
+        """创建索引表和同步触发器，需在写事务中调用"""
+        self._install_lookup_columns(conn)
+
+        try:
+            self._install_fts(conn)
+            self.fts_enabled = True
+        except sqlite3.OperationalError as e:
+            # SQLite未编译FTS5或版本过低不支持trigram分词
+            print(f"全文索引不可用，搜索将使用LIKE扫描: {e}")
+            self.fts_enabled = False
+
+    def _install_fts(self, conn):
+        table, fts = self.table, self.fts
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,)
+        ).fetchone()
+
+        # 外部内容表：只存索引，不重复保存会员数据
+        conn.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+            name, phone,
+            content='{table}', content_rowid='rowid',
+            tokenize='trigram'
+        )
+        """)
+
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts}(rowid, name, phone) VALUES (new.rowid, new.name, new.phone);
+        END
+        """)
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, name, phone)
+            VALUES ('delete', old.rowid, old.name, old.phone);
+        END
+        """)
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF name, phone ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, name, phone)
+            VALUES ('delete', old.rowid, old.name, old.phone);
+            INSERT INTO {fts}(rowid, name, phone) VALUES (new.rowid, new.name, new.phone);
+        END
+        """)
+
+        if not exists:
+            # 首次创建时为已有会员建立索引
+            conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+    def _install_lookup_columns(self, conn):
+        """添加尾号和拼音首字母查找列及其索引"""
+        table = self.table
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for column in LOOKUP_COLUMNS:
+            if column not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} TEXT")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{column} "
+                         f"ON {table} (card_type, {column})")
+        self.backfill(conn)
+
+    def backfill(self, conn):
+        """补齐查找列为空的行(旧数据或外部工具直接写入的数据)"""
+        rows = conn.execute(
+            f"SELECT rowid, name, phone FROM {self.table} "
+            f"WHERE phone_rev IS NULL OR name_initials IS NULL"
+        ).fetchall()
+        if rows:
+            conn.executemany(
+                f"UPDATE {self.table} SET phone_rev = ?, name_initials = ? WHERE rowid = ?",
+                [lookup_values(name, phone) + (rowid,) for rowid, name, phone in rows])
+
+    def rebuild(self, conn):
+        """整体重建索引，用于数据文件被整体替换之后"""
+        if self.fts_enabled:
+            conn.execute(f"INSERT INTO {self.fts}({self.fts}) VALUES ('rebuild')")
+
+    def search(self, conn, card_type, text, limit):
+        """按姓名或手机号子串搜索，结果按相关度排序"""
+        text = text.strip()
+        if self.uses_fts(text):
+            return self._search_fts(conn, card_type, text, limit)
+        return self._search_like(conn, card_type, text, limit)
+
+    def uses_fts(self, text):
+        """输入足够长时走trigram索引，否则只能扫描"""
+        return self.fts_enabled and len(text.strip()) >= MIN_TRIGRAM_LENGTH
+
+    def search_phone_suffix(self, conn, card_type, digits, limit):
+        """手机尾号查询：倒序手机号上的前缀区间查询"""
+        low, high = prefix_range(reverse_phone(digits))
+        return conn.execute(f"""
+        SELECT {', '.join(self.columns)} FROM {self.table}
+        WHERE card_type = ? AND phone_rev >= ? AND phone_rev < ?
+        ORDER BY phone_rev
+        LIMIT ?
+        """, (card_type, low, high, limit)).fetchall()
+
+    def search_initials(self, conn, card_type, letters, limit):
+        """拼音首字母查询：首字母串上的前缀区间查询"""
+        low, high = prefix_range(letters.lower())
+        return conn.execute(f"""
+        SELECT {', '.join(self.columns)} FROM {self.table}
+        WHERE card_type = ? AND name_initials >= ? AND name_initials < ?
+        ORDER BY name_initials
+        LIMIT ?
+        """, (card_type, low, high, limit)).fetchall()
+
+    def _search_fts(self, conn, card_type, text, limit):
+        columns = ', '.join(f"m.{col}" for col in self.columns)
+        # 整体作为一个短语查询，避免输入中的引号等被当成查询语法
+        phrase = '"' + text.replace('"', '""') + '"'
+        return conn.execute(f"""
+        SELECT {columns}
+        FROM {self.fts} f JOIN {self.table} m ON m.rowid = f.rowid
+        WHERE {self.fts} MATCH ? AND m.card_type = ?
+        ORDER BY f.rank
+        LIMIT ?
+        """, (phrase, card_type, limit)).fetchall()
+
+    def _search_like(self, conn, card_type, text, limit):
+        # 过短的输入无法使用trigram，只能扫描；LIMIT让扫描在凑够结果后提前结束
+        pattern = '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        return conn.execute(f"""
+        SELECT {', '.join(self.columns)} FROM {self.table}
+        WHERE card_type = ? AND (name LIKE ? ESCAPE '\\' OR phone LIKE ? ESCAPE '\\')
+        LIMIT ?
+        """, (card_type, pattern, pattern, limit)).fetchall()
@@ -0,0 +1,185 @@
+import time
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal, pyqtSlot
+from database_manager import DatabaseManager, SEARCH_LIMIT, PAGE_SIZE, SORT_COLUMNS
+from lookup_keys import pinyin_initials
+from member_store import MemberColumns
+from metrics import METRICS, timed
+
+
+def matches_search(text, member):
+    """在内存中判断会员是否符合搜索条件，与数据库查询计划保持一致"""
+    text = text.strip()
+    if not text:
+        return True
+    name, phone = member[0], member[1]
+    plan = DatabaseManager.plan_search(text)
+    if plan == 'phone_suffix':
+        return phone.endswith(text)
+    if plan == 'initials':
+        return pinyin_initials(name).startswith(text.lower())
+    needle = text.casefold()
+    return needle in name.casefold() or needle in phone
+
+
+def sort_members(members, field, descending=False):
+    """在内存中排序搜索结果，顺序与数据库分页排序一致"""
+    if field is None:
+        return members
+    if field not in SORT_COLUMNS:
+        raise ValueError(f"不支持的排序列: {field}")
+    columns = MemberColumns(members)
+    return columns.rows(columns.order(field, descending))
+
+
+class SearchPipeline(QObject):
+    """搜索流水线：输入防抖，后台查询，丢弃过期结果，前缀延伸时复用已有结果
+
+    查询交给DatabaseService的读线程执行，总在之前提交的写操作完成后才开始
+    """
+
+    results_ready = pyqtSignal(list, object)  # 结果, 下一页游标(None表示没有更多)
+    page_ready = pyqtSignal(list, object)  # 追加的一页, 下一页游标
+    search_failed = pyqtSignal(str)
+
+    def __init__(self, service, debounce_ms=150, limit=SEARCH_LIMIT, page_size=PAGE_SIZE,
+                 parent=None):
+        super().__init__(parent)
+        self.service = service
+        self.db_manager = service.db_manager
+        self.limit = limit
+        self.page_size = page_size
+        self.sort = None  # 排序列，None为默认顺序(搜索时按相关度)
+        self.descending = False
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(debounce_ms)
+        self.timer.timeout.connect(self._dispatch)
+
+        self._generation = 0
+        self._pending_text = ''
+        self._in_flight = None  # 已发出但结果未到的查询代号
+        self._last = None  # 最近一次完整结果 (卡种, 搜索词, 列存储的结果)
+
+    def is_current(self, generation):
+        return generation == self._generation
+
+    @pyqtSlot(str)
+    def request(self, text):
+        """输入变化时调用，停止输入一段时间后才真正查询"""
+        self._pending_text = text.strip()
+        self._generation += 1  # 让已排队和正在执行的旧查询作废
+        self.timer.start()
+
+    def run_now(self, text=None):
+        """跳过防抖立即查询，用于刷新"""
+        if text is not None:
+            self._pending_text = text.strip()
+        self.timer.stop()
+        self._dispatch()
+
+    def set_sort(self, field, descending=False):
+        """改变排序后立即重新查询第一页"""
+        self.sort, self.descending = field, descending
+        self.invalidate()
+        self.run_now()
+
+    def fetch_more(self, cursor):
+        """按游标取下一页；期间如果有新的查询，这一页会被丢弃"""
+        self._start(self._generation, self.db_manager.current_card_type, '', cursor)
+
+    def invalidate(self):
+        """数据发生变化，已缓存的结果不能再复用"""
+        self._last = None
+
+    def data_changed(self):
+        """数据有改动：作废缓存；若有查询在途，其结果可能早于改动，重新查询"""
+        self.invalidate()
+        if self._in_flight is not None and self.is_current(self._in_flight):
+            self.run_now()
+
+    def _dispatch(self):
+        self._generation += 1
+        generation = self._generation
+        card_type = self.db_manager.current_card_type
+        text = self._pending_text
+
+        reused = self._reuse(card_type, text)
+        if reused is not None:
+            self._deliver(card_type, text, reused)
+            return
+
+        self._in_flight = generation
+        self._start(generation, card_type, text)
+
+    def _start(self, generation, card_type, text, after=None):
+        sort, descending = self.sort, self.descending
+        started = time.perf_counter()
+
+        def done(result):
+            # 从发出查询到结果回到界面线程，包括排队、查询和排序
+            if result is not None and result[2] is None:
+                METRICS.record('ui.search_roundtrip', (time.perf_counter() - started) * 1000, len(result[0]))
+            self._on_result(generation, card_type, text, after, result)
+
+        self.service.read(self._query, generation, card_type, text, sort, descending, after, callback=done)
+
+    def _query(self, generation, card_type, text, sort, descending, after):
+        """在读线程中执行，返回(结果, 游标, 错误信息)"""
+        # 排队期间又有新的输入，直接放弃
+        if not self.is_current(generation):
+            return None
+        try:
+            if text:
+                members = self.db_manager.search_members(text, self.limit, card_type=card_type)
+                return sort_members(members, sort, descending), None, None
+            # 没有搜索词时按页列出，内存和耗时与会员总数无关
+            members, cursor = self.db_manager.list_members(
+                card_type, sort, descending, self.page_size, after)
+            return members, cursor, None
+        except Exception as e:
+            return None, None, str(e)
+
+    def _on_result(self, generation, card_type, text, after, result):
+        if result is None:
+            return
+        members, cursor, error = result
+        if error is not None:
+            if self.is_current(generation):
+                self._in_flight = None
+                self.search_failed.emit(error)
+            return
+        if not self.is_current(generation) or card_type != self.db_manager.current_card_type:
+            return  # 过期结果
+        if after is not None:
+            self.page_ready.emit(members, cursor)
+            return
+        self._in_flight = None
+        self._deliver(card_type, text, members, cursor)
+
+    @timed('ui.search_reuse')
+    def _reuse(self, card_type, text):
+        """新输入是上次输入的延伸且上次结果完整时，直接在内存中过滤"""
+        if self._last is None or not text:
+            return None
+        last_card_type, last_text, columns = self._last
+        if last_card_type != card_type or not last_text or not text.startswith(last_text):
+            return None
+        if len(columns) >= self.limit:
+            return None  # 上次结果被截断，不能保证完整
+
+        plan = self.db_manager.plan_search(text)
+        if plan != self.db_manager.plan_search(last_text):
+            return None
+        if plan in ('substring', 'initials'):
+            return columns.rows(columns.filter(text))
+        return None
+
+    def _deliver(self, card_type, text, members, cursor=None):
+        self._last = (card_type, text, MemberColumns(members)) if text else None
+        self.results_ready.emit(members, cursor)
+
+    def shutdown(self):
+        """停止计时器，让尚未执行的查询作废"""
+        self.timer.stop()
+        self._generation += 1
@@ -0,0 +1,441 @@
+import os
+import json
+import signal
+import asyncio
+import argparse
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs, unquote
+from PyQt5.QtCore import Qt
+from database_manager import DatabaseManager, MEMBER_COLUMNS, SEARCH_LIMIT, PAGE_SIZE
+from backup_manager import BackupManager
+from metrics import METRICS
+
+MAX_BODY = 1024 * 1024  # 请求体上限
+MAX_WAIT = 30  # 长轮询最多等待的秒数
+MAX_PAGE_SIZE = 1000  # 分页列出会员时每页最多的行数
+
+
+class ResponseCache:
+    """热点查询的响应缓存：按卡种分代，写入后该卡种的缓存整体作废
+
+    查询前记下代号，查询完成时代号没变才写入，避免把写入之前读到的旧结果放进缓存。
+    """
+
+    def __init__(self, max_entries=2000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (卡种, 键) -> (代号, 状态码, 响应体)
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def generation(self, card_type):
+        with self._lock:
+            return self._epoch, self._generations.get(card_type, 0)
+
+    def get(self, card_type, key):
+        with self._lock:
+            entry = self._entries.get((card_type, key))
+            generation = (self._epoch, self._generations.get(card_type, 0))
+            if entry is None or entry[0] != generation:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((card_type, key))
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, card_type, key, generation, status, body):
+        with self._lock:
+            if generation != (self._epoch, self._generations.get(card_type, 0)):
+                return
+            self._entries[(card_type, key)] = (generation, status, body)
+            self._entries.move_to_end((card_type, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, card_type=None):
+        with self._lock:
+            if card_type:
+                self._generations[card_type] = self._generations.get(card_type, 0) + 1
+            else:
+                self._epoch += 1
+                self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries),
+                    'hit_rate': self.hits / total if total else 0.0}
+
+
+class ChangeFeed:
+    """变更通知：记录数据库管理器发出的改动，客户端按序号长轮询取回
+
+    只保留最近keep条；客户端落后太多时返回reset，由客户端整体刷新。
+    """
+
+    def __init__(self, db_manager, cache, keep=1000):
+        self.cache = cache
+        self.seq = 0
+        self._events = deque(maxlen=keep)
+        self._lock = threading.Lock()
+        self._waiters = []  # [(事件循环, asyncio.Event)]
+        # 服务端没有Qt事件循环，直接在发出信号的写线程中记录
+        direct = Qt.DirectConnection
+        db_manager.member_added.connect(
+            lambda card_type, member: self._record('added', card_type, member=member), direct)
+        db_manager.member_updated.connect(
+            lambda card_type, old_phone, phone, member: self._record(
+                'updated', card_type, old_phone=old_phone, member=member), direct)
+        db_manager.member_removed.connect(
+            lambda card_type, phone: self._record('removed', card_type, phone=phone), direct)
+        db_manager.members_updated.connect(
+            lambda card_type, members: self._record('bulk', card_type, members=members), direct)
+        db_manager.bulk_reloaded.connect(
+            lambda card_type: self._record('reload', card_type), direct)
+        db_manager.card_types_changed.connect(lambda: self._record('card_types', ''), direct)
+
+    def _record(self, kind, card_type, **data):
+        # 在写线程中调用：先让缓存作废，再通知等待中的客户端
+        self.cache.invalidate(card_type or None)
+        with self._lock:
+            self.seq += 1
+            self._events.append(dict(data, seq=self.seq, event=kind, card_type=card_type))
+            waiters, self._waiters = self._waiters, []
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def since(self, seq):
+        """序号seq之后的事件: (最新序号, 事件列表, 是否需要整体刷新)"""
+        with self._lock:
+            if seq >= self.seq:
+                return self.seq, [], False
+            oldest = self._events[0]['seq'] if self._events else self.seq + 1
+            if seq < oldest - 1:
+                return self.seq, [], True
+            return self.seq, [event for event in self._events if event['seq'] > seq], False
+
+    async def wait(self, seq, timeout):
+        """等到有序号seq之后的事件或超时"""
+        event = asyncio.Event()
+        with self._lock:
+            if self.seq > seq:
+                return
+            self._waiters.append((asyncio.get_running_loop(), event))
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class MemberServer:
+    """多终端服务模式：通过本机HTTP/JSON接口提供搜索、查询、添加、修改和扣减
+
+    写操作由唯一的写线程按到达顺序执行；读操作在读线程池中并行执行，
+    并且总在它之前到达的写操作完成后才开始。热点查询的响应按卡种缓存。
+    """
+
+    def __init__(self, db_manager, host='127.0.0.1', port=8765, readers=4, cache_size=2000):
+        self.db = db_manager
+        self.host = host
+        self.port = port
+        self.cache = ResponseCache(cache_size)
+        self.feed = ChangeFeed(db_manager, self.cache)
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix='api-writer')
+        self._readers = ThreadPoolExecutor(readers, thread_name_prefix='api-reader')
+        self._last_write = None
+        self._server = None
+        self._connections = set()  # 正在处理的连接，停止时取消(如等待中的长轮询)
+        self._routes = [
+            ('GET', ('status',), self.status),
+            ('GET', ('metrics',), self.metrics),
+            ('GET', ('card_types',), self.card_types),
+            ('GET', ('events',), self.events),
+            ('GET', ('members',), self.list_members),
+            ('GET', ('members', 'search'), self.search),
+            ('GET', ('members', None), self.lookup),
+            ('POST', ('members',), self.add),
+            ('PUT', ('members', None), self.update),
+            ('POST', ('members', None, 'deduct'), self.deduct),
+        ]
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]  # port为0时由系统分配
+        print(f"会员服务已启动: http://{self.host}:{self.port}")
+
+    async def stop(self):
+        """停止接受连接，等待已提交的写操作完成"""
+        if self._server is not None:
+            self._server.close()
+        for task in self._connections:
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+
+    async def read(self, fn, *args):
+        """在读线程池中执行，先等之前到达的写操作完成"""
+        pending = self._last_write
+        if pending is not None and not pending.done():
+            await asyncio.wait([pending])
+        return await asyncio.get_running_loop().run_in_executor(self._readers, lambda: fn(*args))
+
+    async def write(self, fn, *args):
+        """交给唯一的写线程按到达顺序执行"""
+        future = asyncio.get_running_loop().run_in_executor(self._writer, lambda: fn(*args))
+        self._last_write = future
+        return await future
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                status, payload = await self._dispatch(method, target, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(self._response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            pass  # 服务停止，连接直接结束
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            return None
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length') or 0)
+        if length > MAX_BODY:
+            return None
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), target, headers, body
+
+    @staticmethod
+    def _response(status, payload, keep_alive):
+        body = payload if isinstance(payload, bytes) else json.dumps(
+            payload, ensure_ascii=False).encode('utf-8')
+        status = HTTPStatus(status)
+        head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                f"Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        return head.encode('latin-1') + body
+
+    async def _dispatch(self, method, target, body):
+        url = urlsplit(target)
+        parts = tuple(unquote(part) for part in url.path.strip('/').split('/') if part)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        allowed = False
+        for route_method, pattern, handler in self._routes:
+            if len(pattern) != len(parts) or any(p is not None and p != part
+                                                 for p, part in zip(pattern, parts)):
+                continue
+            allowed = True
+            if route_method != method:
+                continue
+            args = [part for p, part in zip(pattern, parts) if p is None]
+            try:
+                data = json.loads(body) if body else {}
+                if not isinstance(data, dict):
+                    raise ApiError(400, "请求体必须是JSON对象")
+                started = time.perf_counter()
+                try:
+                    return await handler(query, data, *args)
+                finally:
+                    METRICS.record(f"api.{handler.__name__}", (time.perf_counter() - started) * 1000)
+            except ApiError as e:
+                return e.status, {'ok': False, 'message': str(e)}
+            except ValueError as e:
+                return 400, {'ok': False, 'message': f"请求格式错误: {e}"}
+            except Exception as e:
+                print(f"处理请求 {method} {url.path} 出错: {e}")
+                return 500, {'ok': False, 'message': f"服务器内部错误: {e}"}
+        if allowed:
+            return 405, {'ok': False, 'message': "不支持的请求方法"}
+        return 404, {'ok': False, 'message': "接口不存在"}
+
+    def _card_type(self, params):
+        card_type = params.get('card_type') or self.db.current_card_type
+        if card_type not in dict(self.db.card_types):
+            raise ApiError(400, f"未知的卡种: {card_type}")
+        return card_type
+
+    @staticmethod
+    def _count(params, key, default, upper):
+        """读取行数参数并限制在1..upper之间；负数传给SQLite的LIMIT会变成不限行数"""
+        value = params.get(key)
+        if value is None or value == '':
+            return default
+        try:
+            count = int(value)
+        except ValueError:
+            raise ApiError(400, f"{key} 必须是整数: {value}")
+        return max(1, min(count, upper))
+
+    async def _cached(self, card_type, key, compute):
+        """热点查询先查响应缓存，未命中时在读线程中计算并写回"""
+        cached = self.cache.get(card_type, key)
+        if cached is not None:
+            return cached
+        generation = self.cache.generation(card_type)
+        status, payload = await compute()
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.cache.put(card_type, key, generation, status, body)
+        return status, body
+
+    @staticmethod
+    def _members(rows):
+        return [dict(zip(MEMBER_COLUMNS, row)) for row in rows]
+
+    async def status(self, query, data):
+        return 200, {'ok': True, 'seq': self.feed.seq, 'cache': self.cache.stats(),
+                     'card_types': self.db.get_card_types()}
+
+    async def metrics(self, query, data):
+        return 200, dict(ok=True, **METRICS.snapshot())
+
+    async def card_types(self, query, data):
+        return 200, {'ok': True, 'seq': self.feed.seq, 'card_types': self.db.get_card_types()}
+
+    async def events(self, query, data):
+        since = int(query.get('since', self.feed.seq))
+        wait = min(float(query.get('wait', 0)), MAX_WAIT)
+        if wait > 0:
+            await self.feed.wait(since, wait)
+        seq, events, reset = self.feed.since(since)
+        return 200, {'ok': True, 'seq': seq, 'events': events, 'reset': reset}
+
+    async def list_members(self, query, data):
+        card_type = self._card_type(query)
+        after = json.loads(query['after']) if query.get('after') else None
+        members, cursor = await self.read(
+            self.db.list_members, card_type, query.get('sort') or None,
+            query.get('descending') in ('1', 'true'),
+            self._count(query, 'page_size', PAGE_SIZE, MAX_PAGE_SIZE), after)
+        return 200, {'ok': True, 'members': self._members(members), 'cursor': cursor}
+
+    async def search(self, query, data):
+        card_type = self._card_type(query)
+        text = query.get('q', '').strip()
+        limit = self._count(query, 'limit', SEARCH_LIMIT, SEARCH_LIMIT)
+
+        async def compute():
+            rows = await self.read(self.db.search_members, text, limit, card_type)
+            return 200, {'ok': True, 'members': self._members(rows)}
+        return await self._cached(card_type, ('search', text, limit), compute)
+
+    async def lookup(self, query, data, phone):
+        card_type = self._card_type(query)
+
+        async def compute():
+            member = await self.read(self.db.get_member_by_phone, phone, card_type)
+            if member is None:
+                return 404, {'ok': False, 'message': "会员不存在"}
+            return 200, {'ok': True, 'member': member}
+        return await self._cached(card_type, ('member', phone), compute)
+
+    async def add(self, query, data):
+        card_type = self._card_type(data)
+        member = {field: data.get(field) for field in MEMBER_COLUMNS}
+        success, message = await self.write(self.db.add_member, member, card_type)
+        return (200 if success else 400), {'ok': success, 'message': message}
+
+    async def update(self, query, data, phone):
+        card_type = self._card_type(data)
+        member = {field: data.get(field) for field in MEMBER_COLUMNS}
+        success, message = await self.write(self.db.update_member, phone, member, card_type)
+        return (200 if success else 400), {'ok': success, 'message': message}
+
+    async def deduct(self, query, data, phone):
+        card_type = self._card_type(data)
+        times, amount = int(data.get('times', 1)), int(data.get('amount', 0))
+
+        def deduct():
+            # 在写线程中扣减并读回结果，两步之间不会插入其他写操作
+            success, message = self.db.deduct_member(phone, times, amount, card_type)
+            return success, message, self.db.get_member_by_phone(phone, card_type)
+        success, message, member = await self.write(deduct)
+        status = 200 if success else (404 if member is None else 409)
+        return status, {'ok': success, 'message': message, 'member': member}
+
+
+async def run(host, port, readers, backup_hours):
+    db_manager = DatabaseManager()
+    server = MemberServer(db_manager, host, port, readers)
+    backup_manager = BackupManager(db_manager)
+    loop = asyncio.get_running_loop()
+
+    def backup():
+        # 备份本身在后台线程执行，这里只负责定时
+        backup_manager.create_backup()
+        loop.call_later(backup_hours * 3600, backup)
+    loop.call_later(60, backup)
+    METRICS.start_export()
+
+    stopping = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stopping.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows下由KeyboardInterrupt结束
+
+    try:
+        await server.start()
+        await stopping.wait()
+    finally:
+        await server.stop()
+        backup_manager.wait()
+        METRICS.stop_export()
+        db_manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='会员服务：供多个前台终端通过本机网络访问')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址，局域网访问时用0.0.0.0')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--readers', type=int, default=4, help='读线程数')
+    parser.add_argument('--backup-hours', type=float, default=24, help='自动备份间隔(小时)')
+    args = parser.parse_args()
+
+    os.makedirs('database', exist_ok=True)
+    try:
+        asyncio.run(run(args.host, args.port, args.readers, args.backup_hours))
+    except KeyboardInterrupt:
+        print('会员服务已停止')
+
+
+if __name__ == '__main__':
+    main()
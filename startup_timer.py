@@ -0,0 +1,48 @@
+import json
+import os
+import time
+from datetime import datetime
+
+
+class StartupTimer:
+    """记录启动各阶段的耗时，打印报告并追加到日志，便于发现启动变慢"""
+
+    def __init__(self, log_path=os.path.join('database', 'startup_times.jsonl'), keep=200,
+                 started=None):
+        self.log_path = log_path
+        self.keep = keep  # 日志最多保留的启动记录数
+        self.started = started if started is not None else time.perf_counter()
+        self._last = self.started
+        self.stages = []  # [(阶段, 耗时毫秒)]
+        self.reported = False
+
+    def mark(self, stage):
+        """结束一个阶段，记录从上一个阶段结束到现在的耗时"""
+        now = time.perf_counter()
+        self.stages.append((stage, round((now - self._last) * 1000, 1)))
+        self._last = now
+
+    @property
+    def total_ms(self):
+        return round((self._last - self.started) * 1000, 1)
+
+    def report(self):
+        """打印各阶段耗时并写入日志，只执行一次"""
+        if self.reported:
+            return
+        self.reported = True
+        details = '，'.join(f"{stage} {ms:.0f}ms" for stage, ms in self.stages)
+        print(f"启动耗时 {self.total_ms:.0f}ms: {details}")
+
+        record = {'time': datetime.now().isoformat(timespec='seconds'),
+                  'total_ms': self.total_ms, 'stages': dict(self.stages)}
+        try:
+            lines = []
+            if os.path.exists(self.log_path):
+                with open(self.log_path, encoding='utf-8') as f:
+                    lines = f.read().splitlines()
+            lines = lines[-(self.keep - 1):] + [json.dumps(record, ensure_ascii=False)]
+            with open(self.log_path, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+        except OSError as e:
+            print(f"写入启动耗时日志失败: {e}")
@@ -0,0 +1,99 @@
+import re
+
+
+class FieldRule:
+    """单个字段的校验规则：文本按长度和正则，整数按取值范围"""
+
+    def __init__(self, field, message, pattern=None, length=None,
+                 min_value=None, max_value=None):
+        self.field = field
+        self.message = message
+        self.pattern = pattern
+        self.regex = re.compile(pattern) if pattern else None
+        self.length = length  # 文本长度 (最短, 最长)
+        self.min_value = min_value
+        self.max_value = max_value
+
+    @property
+    def is_integer(self):
+        return self.min_value is not None or self.max_value is not None
+
+    def check(self, value):
+        """校验单个值"""
+        if self.is_integer:
+            if isinstance(value, bool) or not isinstance(value, int):
+                return False
+            return self.min_value <= value <= self.max_value
+        return isinstance(value, str) and self.regex.fullmatch(value) is not None
+
+    def invalid_mask(self, series):
+        """对整列做向量化校验，返回不合格行为True的布尔列"""
+        import pandas as pd  # 只有批量校验用到pandas，不拖慢启动
+        if self.is_integer:
+            values = pd.to_numeric(series, errors='coerce')
+            valid = values.between(self.min_value, self.max_value) & (values % 1 == 0)
+        else:
+            valid = series.astype('string').str.fullmatch(self.pattern).fillna(False)
+        return ~valid.astype(bool)
+
+    def sql_condition(self, expr=None):
+        """生成SQL条件表达式，expr默认为字段本身，也可以是计算后的新值"""
+        expr = expr or self.field
+        if self.is_integer:
+            return f"{expr} >= {self.min_value} AND {expr} <= {self.max_value}"
+        low, high = self.length
+        if low == high:
+            return f"length({expr}) = {low}"
+        return f"length({expr}) >= {low} AND length({expr}) <= {high}"
+
+    def sql_check(self):
+        """生成对应的SQLite CHECK约束"""
+        return f"CHECK({self.sql_condition()})"
+
+
+class RuleSet:
+    """一组字段规则，界面、批量导入和建表共用"""
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.fields = [rule.field for rule in self.rules]
+
+    def __getitem__(self, field):
+        for rule in self.rules:
+            if rule.field == field:
+                return rule
+        raise KeyError(field)
+
+    def validate(self, record):
+        """校验一条记录，返回 [(字段, 错误信息)]，为空表示通过"""
+        return [(rule.field, rule.message) for rule in self.rules
+                if not rule.check(record.get(rule.field))]
+
+    def validate_frame(self, frame):
+        """按列向量化校验整个DataFrame，返回每个字段的不合格掩码"""
+        import pandas as pd
+        return pd.DataFrame({rule.field: rule.invalid_mask(frame[rule.field])
+                             for rule in self.rules}, index=frame.index)
+
+    def reasons(self, masks):
+        """每行第一个不合格字段的错误信息，合格的行为NA"""
+        import pandas as pd
+        reason = pd.Series(pd.NA, index=masks.index, dtype='string')
+        for rule in self.rules:
+            reason = reason.mask(masks[rule.field] & reason.isna(), rule.message)
+        return reason
+
+    def column_definitions(self, types, separator=',\n'):
+        """建表用的列定义，约束由规则生成"""
+        return separator.join(f"{field} {types[field]} {self[field].sql_check()}"
+                              for field in self.fields)
+
+
+MEMBER_RULES = RuleSet([
+    FieldRule('name', "姓名必须是2-10个汉字", pattern=r'[\u4e00-\u9fa5]{2,10}', length=(2, 10)),
+    FieldRule('phone', "手机号必须是11位数字", pattern=r'[0-9]{11}', length=(11, 11)),
+    FieldRule('remaining_times', "剩余次数必须是0-99的整数", min_value=0, max_value=99),
+    FieldRule('balance', "余额必须是0-9999的整数", min_value=0, max_value=9999),
+])
+
+MEMBER_COLUMN_TYPES = {'name': 'TEXT', 'phone': 'TEXT', 'remaining_times': 'INTEGER', 'balance': 'INTEGER'}